@@ -1,14 +1,34 @@
 
 import requests
+import httpx
+import asyncio
+import json
 import time
-from typing import Dict, Any, Optional, Tuple, Union
+import queue
+import hashlib
+import threading
+import weakref
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Any, Optional, Tuple, Union, Awaitable, TypeVar, Callable, Iterator, AsyncIterator, List, Sequence
 import logging
 from abc import ABC, abstractmethod
+from requests.adapters import HTTPAdapter
+from rate_limiter import DEFAULT_ACQUIRE_TIMEOUT, RateLimiter, estimate_tokens, get_rate_limiter, parse_retry_after
+from retry_policy import (NO_RETRY, DeadlineExceeded, RetryEngine, RetryPolicy, RetryState, current_deadline,
+                          deadline_at, submit_in_context)
+from circuit_breaker import CircuitBreaker, get_circuit_breaker
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
+# SSE 流结束标记
+_SSE_DONE = object()
+
 class APIError(Exception):
     """API 错误基类"""
     pass
@@ -21,7 +41,10 @@ class AuthenticationError(APIError):
 
 class RateLimitError(APIError):
     """频率限制错误"""
-    pass
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
 
 
 class NetworkError(APIError):
@@ -29,9 +52,139 @@ class NetworkError(APIError):
     pass
 
 
+class ServerError(APIError):
+    """服务端 5xx 错误"""
+    pass
+
+
+class CircuitOpenError(APIError):
+    """provider 端点处于熔断状态，请求被直接拒绝"""
+    pass
+
+
+# 按错误类型的重试策略：认证失败和其他 4xx 不重试，限流、网络和服务端错误带抖动重试
+_retry_engine = RetryEngine(
+    [
+        (AuthenticationError, NO_RETRY),
+        (RateLimitError, RetryPolicy(max_attempts=4, base_delay=1.0, max_delay=30.0)),
+        (NetworkError, RetryPolicy(max_attempts=3, base_delay=0.5, max_delay=8.0)),
+        (ServerError, RetryPolicy(max_attempts=3, base_delay=0.5, max_delay=8.0)),
+        (APIError, NO_RETRY)
+    ],
+    default_policy=RetryPolicy(max_attempts=2, base_delay=0.5, max_delay=4.0)
+)
+
+
+def get_retry_engine() -> RetryEngine:
+    """获取进程级重试引擎（所有客户端共享重试预算）"""
+    return _retry_engine
+
+
+def configure_retry_engine(engine: RetryEngine) -> None:
+    """替换进程级重试引擎"""
+    global _retry_engine
+    _retry_engine = engine
+
+
+def _parse_sse_line(line: str) -> Union[Dict[str, Any], object, None]:
+    """解析一行 SSE 数据
+
+    返回 data 事件的 JSON 对象；遇到 [DONE] 返回 _SSE_DONE；其他行返回 None。
+    """
+    if not line or not line.startswith("data:"):
+        return None
+    data = line[5:].strip()
+    if data == "[DONE]":
+        return _SSE_DONE
+    try:
+        return json.loads(data)
+    except ValueError:
+        return None
+
+
+# 限流时为模型输出预留的 token 数（请求体没有 max_tokens 时使用）
+OUTPUT_TOKEN_ALLOWANCE = 512
+# 每张图片按固定 token 计入限流（base64 数据的长度与实际计费无关）
+IMAGE_TOKEN_COST = 1000
+
+
+def _strip_images(value: Any) -> Tuple[Any, int]:
+    """去掉请求体中的图片内容（image_url 片段、data: URI），返回剩余内容与图片数"""
+    if isinstance(value, dict):
+        if value.get('type') in ('image_url', 'image'):
+            return None, 1
+        stripped, images = {}, 0
+        for key, item in value.items():
+            stripped[key], count = _strip_images(item)
+            images += count
+        return stripped, images
+    if isinstance(value, list):
+        stripped, images = [], 0
+        for item in value:
+            item, count = _strip_images(item)
+            stripped.append(item)
+            images += count
+        return stripped, images
+    if isinstance(value, str) and value.startswith('data:'):
+        return None, 1
+    return value, 0
+
+
+class PromptCacheStats:
+    """按功能（提示词模板名）统计 provider 端提示词缓存的命中情况
+
+    数据来自各 provider 响应中的用量字段：命中次数为带缓存 token 的请求数，
+    token 命中率为缓存读取的输入 token 占全部输入 token 的比例。
+    """
+
+    def __init__(self):
+        self._features: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, feature: Optional[str], input_tokens: int, cached_tokens: int) -> None:
+        with self._lock:
+            entry = self._features.setdefault(
+                feature or "other",
+                {'requests': 0, 'hits': 0, 'input_tokens': 0, 'cached_tokens': 0}
+            )
+            entry['requests'] += 1
+            entry['hits'] += 1 if cached_tokens else 0
+            entry['input_tokens'] += input_tokens
+            entry['cached_tokens'] += cached_tokens
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            features = {name: dict(entry) for name, entry in self._features.items()}
+        return {
+            name: {
+                **entry,
+                'hit_rate': entry['hits'] / entry['requests'] if entry['requests'] else 0.0,
+                'token_hit_rate': entry['cached_tokens'] / entry['input_tokens'] if entry['input_tokens'] else 0.0
+            }
+            for name, entry in features.items()
+        }
+
+
+_prompt_cache_stats = PromptCacheStats()
+
+
+def get_prompt_cache_stats() -> PromptCacheStats:
+    """获取进程级提示词缓存命中统计"""
+    return _prompt_cache_stats
+
+
 class BaseAPIClient(ABC):
     """API 客户端基类"""
 
+    # provider 名称，用于按 (provider, api_key) 共享限流器
+    provider = ""
+    # 聊天接口相对于 base_url 的路径
+    chat_endpoint = "chat/completions"
+    # 不消耗 token 的模型列表接口（相对路径或完整 URL），为 None 时用最小对话验证密钥
+    models_endpoint: Optional[str] = None
+    # 是否支持 provider 原生的 JSON 输出模式（prepare_chat_payload 的 response_schema 参数）
+    supports_json_mode = True
+
     def __init__(
             self,
             api_key: str,
@@ -40,7 +193,7 @@ class BaseAPIClient(ABC):
             temperature: float = 0.2,
             max_retries: int = 3,
             timeout: int = 30,
-            backoff_factor: float = 0.5
+            pool_maxsize: int = 10
     ):
         self.api_key = api_key
         self.base_url = base_url.rstrip('/')
@@ -48,15 +201,98 @@ class BaseAPIClient(ABC):
         self.temperature = temperature
         self.max_retries = max_retries
         self.timeout = timeout
-        self.backoff_factor = backoff_factor
+        self.pool_maxsize = pool_maxsize
         self.session = self._create_session()
+        # 正在使用会话的请求数；期间调用 close 会推迟到最后一个请求结束
+        self._in_use = 0
+        self._close_pending = False
+        self._use_lock = threading.Lock()
 
     def _create_session(self) -> requests.Session:
-        """创建复用的会话对象"""
+        """创建复用的会话对象（带 keep-alive 连接池）"""
         session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_maxsize)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
         session.headers.update(self.get_headers())
         return session
 
+    @property
+    def in_use(self) -> bool:
+        """是否有请求正在使用会话（含未读完的流式响应）"""
+        return self._in_use > 0
+
+    def close(self) -> None:
+        """关闭会话并释放连接；仍有请求在进行时推迟到这些请求结束后关闭"""
+        with self._use_lock:
+            if self._in_use:
+                self._close_pending = True
+                return
+        self.session.close()
+
+    @contextmanager
+    def _using_session(self) -> Iterator[requests.Session]:
+        with self._use_lock:
+            self._in_use += 1
+        try:
+            yield self.session
+        finally:
+            with self._use_lock:
+                self._in_use -= 1
+                close = self._close_pending and not self._in_use
+            if close:
+                self.session.close()
+
+    def get_request_url(self, endpoint: str) -> str:
+        """拼接请求地址"""
+        if endpoint.startswith(("http://", "https://")):
+            return endpoint
+        return f"{self.base_url}/{endpoint}"
+
+    def verify(self) -> None:
+        """用最便宜的请求验证密钥，密钥无效时抛出 AuthenticationError
+
+        有模型列表接口的 provider 发送零 token 的 GET 请求，否则发送只生成 1 个
+        token 的对话请求。
+        """
+        if self.models_endpoint:
+            try:
+                response = self.session.get(self.get_request_url(self.models_endpoint), timeout=self.timeout)
+            except requests.exceptions.RequestException as e:
+                raise NetworkError(f"网络错误: {str(e)}")
+            if not response.ok:
+                self._handle_error_response(response)
+            return
+        payload = self.prepare_chat_payload("Hi", 0.1)
+        payload["max_tokens"] = 1
+        self.make_request(self.chat_endpoint, payload)
+
+    @property
+    def retry_engine(self) -> RetryEngine:
+        return _retry_engine
+
+    @property
+    def circuit_breaker(self) -> CircuitBreaker:
+        """同一 provider 端点共享的熔断器"""
+        return get_circuit_breaker(self.provider or type(self).__name__, self.base_url)
+
+    @property
+    def rate_limiter(self) -> RateLimiter:
+        """同一 provider 与密钥共享的限流器"""
+        return get_rate_limiter(self.provider or type(self).__name__, self.api_key)
+
+    def estimate_request_tokens(self, payload: Dict[str, Any]) -> int:
+        """估算一次请求消耗的 token（输入 + 预留输出），用于限流"""
+        output_tokens = payload.get('max_tokens') or payload.get('parameters', {}).get('max_tokens')
+        text_payload, images = _strip_images(payload)
+        return (estimate_tokens(json.dumps(text_payload, ensure_ascii=False)) + images * IMAGE_TOKEN_COST
+                + (output_tokens or OUTPUT_TOKEN_ALLOWANCE))
+
+    @staticmethod
+    def extra_output_tokens(text: str) -> int:
+        """实际输出 token 超出预留量的部分"""
+        return estimate_tokens(text) - OUTPUT_TOKEN_ALLOWANCE
+
     @abstractmethod
     def get_headers(self) -> Dict[str, str]:
         """返回 API 请求头"""
@@ -80,49 +316,138 @@ class BaseAPIClient(ABC):
         if response.status_code == 401:
             raise AuthenticationError("API密钥无效或已过期")
         elif response.status_code == 429:
-            raise RateLimitError("API调用频率超限")
+            raise RateLimitError("API调用频率超限", parse_retry_after(response.headers.get('Retry-After')))
+        elif response.status_code >= 500:
+            raise ServerError(f"API请求失败: {error_msg}")
         else:
             raise APIError(f"API请求失败: {error_msg}")
 
-    def make_request(
+    def _check_circuit(self, breaker: CircuitBreaker, limiter: RateLimiter) -> None:
+        """熔断期间快速失败，不再等待超时与重试"""
+        if not breaker.allow_request():
+            limiter.release()
+            raise CircuitOpenError(
+                f"{self.provider or self.base_url} 服务暂时不可用，约{breaker.retry_in():.0f}秒后自动重试"
+            )
+
+    @staticmethod
+    def _record_circuit(breaker: CircuitBreaker, error: Optional[BaseException], started: float,
+                        headers_latency: Optional[float]) -> None:
+        """网络错误和 5xx 计为端点故障，其余结果（包括 4xx）说明端点可用
+
+        慢调用按收到响应头的耗时判断：生成并下载一段长回复本身就要几十秒，不代表
+        端点变慢。没有收到响应（超时、连接失败）时按总耗时计。
+        """
+        latency = headers_latency if headers_latency is not None else time.monotonic() - started
+        if isinstance(error, (NetworkError, ServerError)):
+            breaker.record_failure(latency)
+        else:
+            breaker.record_success(latency)
+
+    def _attempt_timeout(self, state: RetryState) -> float:
+        """开始一次尝试，返回不超过剩余截止时间的超时秒数"""
+        try:
+            return state.attempt_timeout(self.timeout)
+        except DeadlineExceeded as e:
+            raise NetworkError(f"网络错误: {str(e)}")
+
+    @staticmethod
+    def _acquire_timeout(state: RetryState) -> float:
+        """排队等待限流额度的最长时间：剩余截止时间，未设置时取默认上限"""
+        remaining = state.remaining()
+        return DEFAULT_ACQUIRE_TIMEOUT if remaining is None else min(remaining, DEFAULT_ACQUIRE_TIMEOUT)
+
+    def _retry_delay(self, state: RetryState, error: BaseException, limiter: RateLimiter) -> float:
+        """计算重试前需要等待的秒数，不应重试时直接抛出 error"""
+        if isinstance(error, NetworkError):
+            logger.warning(f"Network error on attempt {state.attempt}: {str(error)}")
+        elif isinstance(error, RateLimitError):
+            logger.warning(f"Rate limited on attempt {state.attempt}, retry after {error.retry_after}s")
+        else:
+            logger.error(f"Request error on attempt {state.attempt}: {str(error)}")
+
+        delay = state.next_delay(error, min_delay=getattr(error, 'retry_after', None) or 0.0)
+        if delay is None:
+            raise error
+        if isinstance(error, RateLimitError):
+            # 冷却由限流器执行，同一密钥上排队的所有请求一起暂停
+            limiter.penalize(delay)
+            return 0.0
+        return delay
+
+    def _send_with_retries(
             self,
-            endpoint: str,
-            payload: Dict[str, Any]
-    ) -> str:
-        """发送 API 请求并处理重试"""
-        url = f"{self.base_url}/{endpoint}"
-        last_exception = None
+            url: str,
+            payload: Dict[str, Any],
+            handle: Callable[[requests.Response], T],
+            stream: bool = False,
+            headers: Optional[Dict[str, str]] = None
+    ) -> T:
+        """发送请求并按重试引擎的策略重试，成功响应交给 handle 处理
 
-        for attempt in range(self.max_retries):
+        每次尝试前都在 (provider, api_key) 的限流器上排队；收到 429 时按 Retry-After
+        暂停该密钥的放行后重试。stream 为 True 时成功响应继续占用并发额度，由调用方
+        在读完流后 release。整个过程不超过调用方通过 request_deadline 设置的截止时间。
+        """
+        state = self.retry_engine.start(self.max_retries)
+        limiter = self.rate_limiter
+        breaker = self.circuit_breaker
+        estimated_tokens = self.estimate_request_tokens(payload)
+
+        while True:
+            timeout = self._attempt_timeout(state)
+            if not limiter.acquire(estimated_tokens, timeout=self._acquire_timeout(state)):
+                raise RateLimitError("等待限流额度超时")
+            self._check_circuit(breaker, limiter)
+            holding = True
+            error = None
+            headers_latency = None
+            started = time.monotonic()
             try:
-                logger.info(f"Attempting API request to {url} (attempt {attempt + 1}/{self.max_retries})")
+                logger.info(f"Attempting API request to {url} (attempt {state.attempt}/{self.max_retries})")
                 response = self.session.post(
                     url,
                     json=payload,
-                    timeout=self.timeout
+                    timeout=timeout,
+                    stream=stream,
+                    headers=headers
                 )
+                # elapsed 为发出请求到解析完响应头的耗时，不含下载响应体
+                headers_latency = response.elapsed.total_seconds()
 
                 if response.ok:
-                    return self.process_response(response)
+                    if stream:
+                        holding = False
+                        return handle(response)
+                    result = handle(response)
+                    limiter.release(self.extra_output_tokens(result) if isinstance(result, str) else 0)
+                    holding = False
+                    return result
                 else:
                     self._handle_error_response(response)
 
             except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
-                last_exception = NetworkError(f"网络错误: {str(e)}")
-                logger.warning(f"Network error on attempt {attempt + 1}: {str(e)}")
-            except (AuthenticationError, RateLimitError) as e:
-                # 这些错误不需要重试
-                raise
+                error = NetworkError(f"网络错误: {str(e)}")
             except Exception as e:
-                last_exception = e
-                logger.error(f"Unexpected error on attempt {attempt + 1}: {str(e)}")
+                error = e
+            finally:
+                self._record_circuit(breaker, error, started, headers_latency)
+                if holding:
+                    limiter.release()
 
-            if attempt < self.max_retries - 1:
-                sleep_time = self.backoff_factor * (2 ** attempt)
-                logger.info(f"Retrying in {sleep_time} seconds...")
-                time.sleep(sleep_time)
+            delay = self._retry_delay(state, error, limiter)
+            if delay:
+                logger.info(f"Retrying in {delay:.2f} seconds...")
+                time.sleep(delay)
 
-        raise last_exception or APIError("所有重试尝试均失败")
+    def make_request(
+            self,
+            endpoint: str,
+            payload: Dict[str, Any]
+    ) -> str:
+        """发送 API 请求并处理重试"""
+        with self._using_session():
+            return self._send_with_retries(self.get_request_url(endpoint), payload, self.process_response)
 
     def chat(
             self,
@@ -132,12 +457,123 @@ class BaseAPIClient(ABC):
     ) -> str:
         """发送聊天请求"""
         try:
+            prompt, kwargs = self.split_prompt(prompt, kwargs)
             payload = self.prepare_chat_payload(prompt, temperature, **kwargs)
-            return self.make_request("chat/completions", payload)
+            feature = kwargs.get("feature")
+            with self._using_session():
+                return self._send_with_retries(
+                    self.get_request_url(self.chat_endpoint),
+                    payload,
+                    lambda response: self._process_chat_response(response, feature)
+                )
         except Exception as e:
             logger.error(f"Chat request failed: {str(e)}")
             raise
 
+    def split_prompt(self, prompt: str, kwargs: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+        """把 RenderedPrompt 拆成系统消息、历史消息与用户消息
+
+        未显式传入 system / history 时生效；feature 默认为提示词携带的功能名，
+        用于统计提示词缓存命中率。
+        """
+        user = getattr(prompt, "user", None)
+        if user is None or kwargs.get("system") is not None or kwargs.get("history") is not None:
+            return prompt, kwargs
+        kwargs = {**kwargs, "system": prompt.system, "history": prompt.history}
+        kwargs.setdefault("feature", prompt.feature)
+        return user, kwargs
+
+    def build_messages(self, prompt: str, system: Optional[str] = None,
+                       history: Sequence[Dict[str, Any]] = ()) -> List[Dict[str, Any]]:
+        """OpenAI 格式的消息列表：系统消息、历史消息、当前用户消息
+
+        不变的部分在前，以便命中 provider 的前缀缓存。
+        """
+        messages: List[Dict[str, Any]] = [{"role": "system", "content": system}] if system else []
+        messages.extend(dict(message) for message in history)
+        messages.append({"role": "user", "content": prompt})
+        return messages
+
+    def extract_usage(self, data: Dict[str, Any]) -> Optional[Tuple[int, int]]:
+        """从响应或流式事件中提取 (输入 token 数, 命中缓存的 token 数)，OpenAI 兼容格式"""
+        usage = data.get('usage')
+        if not usage or 'prompt_tokens' not in usage:
+            return None
+        return usage['prompt_tokens'], (usage.get('prompt_tokens_details') or {}).get('cached_tokens') or 0
+
+    def _process_chat_response(self, response: Any, feature: Optional[str]) -> str:
+        text = self.process_response(response)
+        usage = self.extract_usage(response.json())
+        if usage:
+            _prompt_cache_stats.record(feature, *usage)
+        return text
+
+    def stream_chat(
+            self,
+            prompt: str,
+            temperature: Optional[float] = None,
+            **kwargs
+    ) -> Iterator[str]:
+        """发送流式聊天请求，随 SSE 事件到达逐段返回增量文本"""
+        with self._using_session():
+            prompt, kwargs = self.split_prompt(prompt, kwargs)
+            payload = self.prepare_stream_payload(prompt, temperature, **kwargs)
+            response = self._send_with_retries(
+                self.get_request_url(self.chat_endpoint),
+                payload,
+                lambda r: r,
+                stream=True,
+                headers=self.get_stream_headers()
+            )
+            # SSE 响应通常不带 charset，避免 requests 回退为 ISO-8859-1
+            response.encoding = 'utf-8'
+            output_tokens = 0
+            usage = None
+            try:
+                for line in response.iter_lines(decode_unicode=True):
+                    event = _parse_sse_line(line)
+                    if event is _SSE_DONE:
+                        break
+                    if event is None:
+                        continue
+                    # 用量通常在首个或最后一个事件中，取最后一次出现的值
+                    usage = self.extract_usage(event) or usage
+                    delta = self.parse_stream_event(event)
+                    if delta:
+                        output_tokens += estimate_tokens(delta)
+                        yield delta
+            except requests.exceptions.RequestException as e:
+                raise NetworkError(f"网络错误: {str(e)}")
+            finally:
+                response.close()
+                self.rate_limiter.release(output_tokens - OUTPUT_TOKEN_ALLOWANCE)
+                if usage:
+                    _prompt_cache_stats.record(kwargs.get("feature"), *usage)
+
+    def get_stream_headers(self) -> Dict[str, str]:
+        """流式请求额外的请求头"""
+        return {"Accept": "text/event-stream"}
+
+    def prepare_stream_payload(
+            self,
+            prompt: str,
+            temperature: Optional[float] = None,
+            **kwargs
+    ) -> Dict[str, Any]:
+        """准备流式聊天请求的参数"""
+        payload = self.prepare_chat_payload(prompt, temperature, **kwargs)
+        payload["stream"] = True
+        return payload
+
+    def parse_stream_event(self, event: Dict[str, Any]) -> str:
+        """从一个 SSE 事件中提取增量文本（OpenAI 兼容格式）"""
+        if 'error' in event:
+            raise APIError(f"API请求失败: {event['error'].get('message', event['error'])}")
+        choices = event.get('choices') or []
+        if not choices:
+            return ""
+        return (choices[0].get('delta') or {}).get('content') or ""
+
     @abstractmethod
     def prepare_chat_payload(
             self,
@@ -152,13 +588,21 @@ class BaseAPIClient(ABC):
 class QwenClient(BaseAPIClient):
     """通义千问 API 客户端"""
 
-    def __init__(self, api_key: str, temperature: float = 0.2):
+    provider = "qwen"
+
+    # 通义千问使用 DashScope 原生文本生成端点
+    chat_endpoint = "services/aigc/text-generation/generation"
+    # 模型列表只在 OpenAI 兼容模式下提供
+    models_endpoint = "https://dashscope.aliyuncs.com/compatible-mode/v1/models"
+
+    def __init__(self, api_key: str, temperature: float = 0.2, **kwargs):
         super().__init__(
             api_key=api_key,
             # 修改为正确的 API 端点
             base_url="https://dashscope.aliyuncs.com/api/v1",
             model="qwen-max",
-            temperature=temperature
+            temperature=temperature,
+            **kwargs
         )
 
     def get_headers(self) -> Dict[str, str]:
@@ -169,7 +613,43 @@ class QwenClient(BaseAPIClient):
 
     def process_response(self, response: requests.Response) -> str:
         data = response.json()
-        return data['output']['text']
+        return _qwen_output_text(data['output'])
+
+    def get_stream_headers(self) -> Dict[str, str]:
+        return {"Accept": "text/event-stream", "X-DashScope-SSE": "enable"}
+
+    def prepare_stream_payload(
+            self,
+            prompt: str,
+            temperature: Optional[float] = None,
+            **kwargs
+    ) -> Dict[str, Any]:
+        payload = self.prepare_chat_payload(prompt, temperature, **kwargs)
+        # 增量输出，每个事件只包含新生成的文本
+        payload.setdefault("parameters", {})["incremental_output"] = True
+        return payload
+
+    def parse_stream_event(self, event: Dict[str, Any]) -> str:
+        if 'code' in event and 'output' not in event:
+            raise APIError(f"API请求失败: {event.get('message', event['code'])}")
+        return _qwen_output_text(event.get('output') or {})
+
+    def extract_usage(self, data: Dict[str, Any]) -> Optional[Tuple[int, int]]:
+        usage = data.get('usage')
+        if not usage or 'input_tokens' not in usage:
+            return None
+        return usage['input_tokens'], (usage.get('prompt_tokens_details') or {}).get('cached_tokens') or 0
+
+    def build_messages(self, prompt: str, system: Optional[str] = None,
+                       history: Sequence[Dict[str, Any]] = ()) -> List[Dict[str, Any]]:
+        messages = super().build_messages(prompt, None, history)
+        if system:
+            # 显式缓存标记：系统消息作为可复用的前缀缓存
+            messages.insert(0, {
+                "role": "system",
+                "content": [{"type": "text", "text": system, "cache_control": {"type": "ephemeral"}}]
+            })
+        return messages
 
     def prepare_chat_payload(
             self,
@@ -180,63 +660,36 @@ class QwenClient(BaseAPIClient):
         payload = {
             "model": self.model,
             "input": {
-                "messages": [{"role": "user", "content": prompt}]
+                "messages": self.build_messages(prompt, kwargs.get("system"), kwargs.get("history") or ())
             }
         }
         if temperature is not None:
             payload["parameters"] = {"temperature": temperature}
+        if kwargs.get("response_schema"):
+            # JSON 模式需要 message 格式的输出
+            payload.setdefault("parameters", {}).update({
+                "result_format": "message",
+                "response_format": {"type": "json_object"}
+            })
         return payload
 
-    def make_request(
-            self,
-            endpoint: str,
-            payload: Dict[str, Any]
-    ) -> str:
-        """重写请求方法以适配通义千问的特殊端点"""
-        url = f"{self.base_url}/services/aigc/text-generation/generation"
-        last_exception = None
-
-        for attempt in range(self.max_retries):
-            try:
-                logger.info(f"Attempting API request to {url} (attempt {attempt + 1}/{self.max_retries})")
-                response = self.session.post(
-                    url,
-                    json=payload,
-                    timeout=self.timeout
-                )
-
-                if response.ok:
-                    return self.process_response(response)
-                else:
-                    self._handle_error_response(response)
-
-            except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
-                last_exception = NetworkError(f"网络错误: {str(e)}")
-                logger.warning(f"Network error on attempt {attempt + 1}: {str(e)}")
-            except (AuthenticationError, RateLimitError) as e:
-                raise
-            except Exception as e:
-                last_exception = e
-                logger.error(f"Unexpected error on attempt {attempt + 1}: {str(e)}")
-
-            if attempt < self.max_retries - 1:
-                sleep_time = self.backoff_factor * (2 ** attempt)
-                logger.info(f"Retrying in {sleep_time} seconds...")
-                time.sleep(sleep_time)
-
-        raise last_exception or APIError("所有重试尝试均失败")
-
-
 
 class ChatGPTClient(BaseAPIClient):
     """ChatGPT API 客户端"""
 
-    def __init__(self, api_key: str, temperature: float = 0.2):
+    provider = "chatgpt"
+    models_endpoint = "models"
+
+    # 不支持 response_format 的旧模型
+    LEGACY_MODELS = ("gpt-4", "gpt-4-0314", "gpt-4-0613")
+
+    def __init__(self, api_key: str, temperature: float = 0.2, **kwargs):
         super().__init__(
             api_key=api_key,
             base_url="https://api.openai.com/v1",
             model="gpt-4",
-            temperature=temperature
+            temperature=temperature,
+            **kwargs
         )
 
     def get_headers(self) -> Dict[str, str]:
@@ -245,6 +698,21 @@ class ChatGPTClient(BaseAPIClient):
             "Content-Type": "application/json"
         }
 
+    @property
+    def supports_json_mode(self) -> bool:
+        return self.model not in self.LEGACY_MODELS
+
+    def prepare_stream_payload(
+            self,
+            prompt: str,
+            temperature: Optional[float] = None,
+            **kwargs
+    ) -> Dict[str, Any]:
+        payload = super().prepare_stream_payload(prompt, temperature, **kwargs)
+        # 流式响应默认不带用量，需要显式请求
+        payload["stream_options"] = {"include_usage": True}
+        return payload
+
     def process_response(self, response: requests.Response) -> str:
         data = response.json()
         return data['choices'][0]['message']['content']
@@ -257,21 +725,29 @@ class ChatGPTClient(BaseAPIClient):
     ) -> Dict[str, Any]:
         payload = {
             "model": self.model,
-            "messages": [{"role": "user", "content": prompt}]
+            "messages": self.build_messages(prompt, kwargs.get("system"), kwargs.get("history") or ())
         }
         if temperature is not None:
             payload["temperature"] = temperature
+        if kwargs.get("response_schema") and self.supports_json_mode:
+            payload["response_format"] = {"type": "json_object"}
         return payload
 
 class ClaudeClient(BaseAPIClient):
     """Claude API 客户端"""
 
-    def __init__(self, api_key: str, temperature: float = 0.2):
+    provider = "claude"
+    models_endpoint = "models"
+
+    chat_endpoint = "messages"
+
+    def __init__(self, api_key: str, temperature: float = 0.2, **kwargs):
         super().__init__(
             api_key=api_key,
             base_url="https://api.anthropic.com/v1",
             model="claude-3-sonnet-20240229",
-            temperature=temperature
+            temperature=temperature,
+            **kwargs
         )
 
     def get_headers(self) -> Dict[str, str]:
@@ -281,9 +757,59 @@ class ClaudeClient(BaseAPIClient):
             "content-type": "application/json"
         }
 
+    def build_messages(self, prompt: str, system: Optional[str] = None,
+                       history: Sequence[Dict[str, Any]] = ()) -> List[Dict[str, Any]]:
+        # Claude 的系统提示词单独放在 system 字段，消息列表必须以用户消息开头。
+        # prepare_chat_payload 已把开头的非用户消息并入 system，这里只兜底直接调用的情况
+        messages = super().build_messages(prompt, None, history)
+        while messages[0]["role"] != "user":
+            dropped = messages.pop(0)
+            logger.warning(f"Claude messages must start with a user turn, dropped leading {dropped['role']} message")
+        return messages
+
+    @staticmethod
+    def _merge_leading_history(system: Optional[str],
+                               history: Sequence[Dict[str, Any]]) -> Tuple[Optional[str], List[Dict[str, Any]]]:
+        """把历史开头的非用户消息（例如人设开场白）并入系统提示词，返回 (system, 其余历史)"""
+        history = list(history)
+        leading = []
+        while history and history[0]["role"] != "user":
+            leading.append(history.pop(0))
+        if not leading:
+            return system, history
+        opening = "\n".join(
+            f"{'Assistant' if message['role'] == 'assistant' else message['role']}: {message['content']}"
+            for message in leading
+        )
+        opening = f"对话开始时已有的消息：\n{opening}"
+        return (f"{system}\n\n{opening}" if system else opening), history
+
     def process_response(self, response: requests.Response) -> str:
         data = response.json()
-        return data['content'][0]['text']
+        block = data['content'][0]
+        if block.get('type') == 'tool_use':
+            # 结构化输出通过强制调用工具实现，工具参数即为 JSON 结果
+            return json.dumps(block['input'], ensure_ascii=False)
+        return block['text']
+
+    def extract_usage(self, data: Dict[str, Any]) -> Optional[Tuple[int, int]]:
+        # 非流式响应直接带 usage，流式响应在 message_start 事件的 message 中
+        usage = (data.get('message') or data).get('usage') if data.get('type') in ('message', 'message_start') else None
+        if not usage or 'input_tokens' not in usage:
+            return None
+        cached = usage.get('cache_read_input_tokens') or 0
+        return usage['input_tokens'] + cached + (usage.get('cache_creation_input_tokens') or 0), cached
+
+    def parse_stream_event(self, event: Dict[str, Any]) -> str:
+        event_type = event.get('type')
+        if event_type == 'content_block_delta':
+            delta = event.get('delta', {})
+            if delta.get('type') == 'input_json_delta':
+                return delta.get('partial_json', '')
+            return delta.get('text', '')
+        if event_type == 'error':
+            raise APIError(f"API请求失败: {event.get('error', {}).get('message', '')}")
+        return ""
 
     def prepare_chat_payload(
             self,
@@ -291,24 +817,40 @@ class ClaudeClient(BaseAPIClient):
             temperature: Optional[float] = None,
             **kwargs
     ) -> Dict[str, Any]:
+        system, history = self._merge_leading_history(kwargs.get("system"), kwargs.get("history") or ())
         payload = {
             "model": self.model,
-            "messages": [{"role": "user", "content": prompt}]
+            "max_tokens": kwargs.get("max_tokens", 4096),
+            "messages": self.build_messages(prompt, history=history)
         }
+        if system:
+            # 系统提示词标记为可缓存前缀，后续相同前缀的请求按缓存读取计费
+            payload["system"] = [{"type": "text", "text": system, "cache_control": {"type": "ephemeral"}}]
         if temperature is not None:
             payload["temperature"] = temperature
+        schema = kwargs.get("response_schema")
+        if schema:
+            # Claude 没有 JSON 模式，用 input_schema 定义工具并强制调用
+            name = schema.get("title", "structured_output")
+            payload["tools"] = [{"name": name, "description": schema.get("description", name), "input_schema": schema}]
+            payload["tool_choice"] = {"type": "tool", "name": name}
         return payload
 
 
 class GLMClient(BaseAPIClient):
     """智谱 API 客户端"""
 
-    def __init__(self, api_key: str, temperature: float = 0.2):
+    provider = "glm"
+
+    def __init__(self, api_key: str, temperature: float = 0.2, **kwargs):
+        # 智谱接口响应较慢，默认使用更长的超时时间
+        kwargs.setdefault("timeout", 60)
         super().__init__(
             api_key=api_key,
             base_url="https://open.bigmodel.cn/api/paas/v4",
             model="glm-4-plus",
-            temperature=temperature
+            temperature=temperature,
+            **kwargs
         )
 
     def get_headers(self) -> Dict[str, str]:
@@ -327,52 +869,822 @@ class GLMClient(BaseAPIClient):
             temperature: Optional[float] = None,
             **kwargs
     ) -> Dict[str, Any]:
+        # 智谱对相同前缀自动做上下文缓存，系统消息放在最前即可命中
         payload = {
             "model": self.model,
-            "messages": [{"role": "user", "content": prompt}]
+            "messages": self.build_messages(prompt, kwargs.get("system"), kwargs.get("history") or ())
         }
         if temperature is not None:
             payload["temperature"] = temperature
+        if kwargs.get("response_schema"):
+            payload["response_format"] = {"type": "json_object"}
         return payload
 
 
+def _qwen_output_text(output: Dict[str, Any]) -> str:
+    """兼容 DashScope 的 text 与 message 两种输出格式"""
+    if output.get('text') is not None:
+        return output['text']
+    choices = output.get('choices') or []
+    if not choices:
+        return ""
+    return (choices[0].get('message') or {}).get('content') or ""
+
+
+# 每个事件循环共享一个 httpx.AsyncClient（连接池不能跨事件循环使用）
+_async_http_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = \
+    weakref.WeakKeyDictionary()
+_async_pool_limits = httpx.Limits(max_connections=200, max_keepalive_connections=50, keepalive_expiry=300)
+
+
+def configure_async_pool(
+        max_connections: Optional[int] = None,
+        max_keepalive_connections: Optional[int] = None,
+        keepalive_expiry: Optional[float] = None
+) -> None:
+    """配置异步连接池，仅对之后新建的连接池生效"""
+    global _async_pool_limits
+    _async_pool_limits = httpx.Limits(
+        max_connections=max_connections or _async_pool_limits.max_connections,
+        max_keepalive_connections=max_keepalive_connections or _async_pool_limits.max_keepalive_connections,
+        keepalive_expiry=keepalive_expiry or _async_pool_limits.keepalive_expiry
+    )
+
+
+def get_async_http_client() -> httpx.AsyncClient:
+    """获取当前事件循环共享的异步 HTTP 客户端"""
+    loop = asyncio.get_running_loop()
+    http_client = _async_http_clients.get(loop)
+    if http_client is None or http_client.is_closed:
+        http_client = httpx.AsyncClient(limits=_async_pool_limits)
+        _async_http_clients[loop] = http_client
+    return http_client
+
+
+async def aclose_async_pool() -> None:
+    """关闭当前事件循环的异步连接池"""
+    http_client = _async_http_clients.pop(asyncio.get_running_loop(), None)
+    if http_client is not None:
+        await http_client.aclose()
+
+
+class AsyncBaseAPIClient(BaseAPIClient):
+    """异步 API 客户端基类
+
+    与同步客户端共用请求头、请求体和响应解析逻辑，只把网络请求和退避等待换成
+    可 await 的实现。所有实例共享同一事件循环上的 httpx 连接池，一个事件循环即可
+    同时承载大量进行中的请求。
+    """
+
+    def _create_session(self) -> None:
+        # 异步客户端使用事件循环级共享连接池，不持有自己的会话
+        return None
+
+    def close(self) -> None:
+        pass
+
+    async def _asend_with_retries(
+            self,
+            url: str,
+            payload: Dict[str, Any],
+            handle: Callable[[httpx.Response], T],
+            stream: bool = False,
+            headers: Optional[Dict[str, str]] = None
+    ) -> T:
+        """发送异步请求并处理重试，成功响应交给 handle 处理（限流、重试与截止时间规则同同步版本）"""
+        state = self.retry_engine.start(self.max_retries)
+        limiter = self.rate_limiter
+        breaker = self.circuit_breaker
+        estimated_tokens = self.estimate_request_tokens(payload)
+
+        while True:
+            timeout = self._attempt_timeout(state)
+            # 排队等待不阻塞事件循环上的其他请求，任务被取消时不会泄漏并发额度
+            if not await limiter.aacquire(estimated_tokens, self._acquire_timeout(state)):
+                raise RateLimitError("等待限流额度超时")
+            self._check_circuit(breaker, limiter)
+            holding = True
+            error = None
+            headers_latency = None
+            started = time.monotonic()
+            try:
+                logger.info(f"Attempting async API request to {url} (attempt {state.attempt}/{self.max_retries})")
+                http_client = get_async_http_client()
+                request = http_client.build_request(
+                    "POST",
+                    url,
+                    json=payload,
+                    headers={**self.get_headers(), **(headers or {})},
+                    timeout=timeout
+                )
+                # 总是先只读取响应头，以便单独记录到达响应头的耗时
+                response = await http_client.send(request, stream=True)
+                headers_latency = time.monotonic() - started
+                if not stream:
+                    await response.aread()
+
+                if response.is_success:
+                    if stream:
+                        holding = False
+                        return handle(response)
+                    result = handle(response)
+                    limiter.release(self.extra_output_tokens(result) if isinstance(result, str) else 0)
+                    holding = False
+                    return result
+                else:
+                    if stream:
+                        await response.aread()
+                    self._handle_error_response(response)
+
+            except httpx.TransportError as e:
+                error = NetworkError(f"网络错误: {str(e)}")
+            except Exception as e:
+                error = e
+            finally:
+                self._record_circuit(breaker, error, started, headers_latency)
+                if holding:
+                    limiter.release()
+
+            delay = self._retry_delay(state, error, limiter)
+            if delay:
+                logger.info(f"Retrying in {delay:.2f} seconds...")
+                await asyncio.sleep(delay)
+
+    async def make_request(
+            self,
+            endpoint: str,
+            payload: Dict[str, Any]
+    ) -> str:
+        """发送异步 API 请求并处理重试"""
+        return await self._asend_with_retries(self.get_request_url(endpoint), payload, self.process_response)
+
+    async def chat(
+            self,
+            prompt: str,
+            temperature: Optional[float] = None,
+            **kwargs
+    ) -> str:
+        """发送异步聊天请求"""
+        try:
+            prompt, kwargs = self.split_prompt(prompt, kwargs)
+            payload = self.prepare_chat_payload(prompt, temperature, **kwargs)
+            feature = kwargs.get("feature")
+            return await self._asend_with_retries(
+                self.get_request_url(self.chat_endpoint),
+                payload,
+                lambda response: self._process_chat_response(response, feature)
+            )
+        except Exception as e:
+            logger.error(f"Async chat request failed: {str(e)}")
+            raise
+
+    async def astream_chat(
+            self,
+            prompt: str,
+            temperature: Optional[float] = None,
+            **kwargs
+    ) -> AsyncIterator[str]:
+        """发送异步流式聊天请求，随 SSE 事件到达逐段返回增量文本"""
+        prompt, kwargs = self.split_prompt(prompt, kwargs)
+        payload = self.prepare_stream_payload(prompt, temperature, **kwargs)
+        response = await self._asend_with_retries(
+            self.get_request_url(self.chat_endpoint),
+            payload,
+            lambda r: r,
+            stream=True,
+            headers=self.get_stream_headers()
+        )
+        output_tokens = 0
+        usage = None
+        try:
+            async for line in response.aiter_lines():
+                event = _parse_sse_line(line)
+                if event is _SSE_DONE:
+                    break
+                if event is None:
+                    continue
+                usage = self.extract_usage(event) or usage
+                delta = self.parse_stream_event(event)
+                if delta:
+                    output_tokens += estimate_tokens(delta)
+                    yield delta
+        except httpx.TransportError as e:
+            raise NetworkError(f"网络错误: {str(e)}")
+        finally:
+            await response.aclose()
+            self.rate_limiter.release(output_tokens - OUTPUT_TOKEN_ALLOWANCE)
+            if usage:
+                _prompt_cache_stats.record(kwargs.get("feature"), *usage)
+
+
+class AsyncQwenClient(AsyncBaseAPIClient, QwenClient):
+    """通义千问异步客户端"""
+    pass
+
+
+class AsyncChatGPTClient(AsyncBaseAPIClient, ChatGPTClient):
+    """ChatGPT 异步客户端"""
+    pass
+
+
+class AsyncClaudeClient(AsyncBaseAPIClient, ClaudeClient):
+    """Claude 异步客户端"""
+    pass
+
+
+class AsyncGLMClient(AsyncBaseAPIClient, GLMClient):
+    """智谱异步客户端"""
+    pass
+
+
+class _AsyncLoopThread:
+    """后台常驻事件循环，供 Streamlit 等同步代码提交协程"""
+
+    def __init__(self):
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = threading.Lock()
+
+    def get_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None or self._loop.is_closed():
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(
+                    target=loop.run_forever,
+                    name="api-clients-event-loop",
+                    daemon=True
+                )
+                thread.start()
+                self._loop = loop
+            return self._loop
+
+
+_loop_thread = _AsyncLoopThread()
+
+
+def run_async(coro: Awaitable[T], timeout: Optional[float] = None) -> T:
+    """在共享后台事件循环中执行协程并阻塞等待结果
+
+    同步调用方（例如 Streamlit 脚本线程）通过它使用异步客户端，所有调用共享
+    同一个事件循环及其连接池。调用方的截止时间随协程带入事件循环。
+    """
+    deadline = current_deadline()
+
+    async def run_with_deadline() -> T:
+        with deadline_at(deadline):
+            return await coro
+
+    future = asyncio.run_coroutine_threadsafe(run_with_deadline(), _loop_thread.get_loop())
+    try:
+        return future.result(timeout)
+    except BaseException:
+        future.cancel()
+        raise
+
+
+CLIENT_CLASSES = {
+    "qwen": QwenClient,
+    "chatgpt": ChatGPTClient,
+    "claude": ClaudeClient,
+    "glm": GLMClient
+}
+
+ASYNC_CLIENT_CLASSES = {
+    "qwen": AsyncQwenClient,
+    "chatgpt": AsyncChatGPTClient,
+    "claude": AsyncClaudeClient,
+    "glm": AsyncGLMClient
+}
+
+
 def create_client(
         model_type: str,
         api_key: str,
-        temperature: float = 0.2
+        temperature: float = 0.2,
+        async_mode: bool = False,
+        **kwargs
 ) -> BaseAPIClient:
-    """创建对应的客户端实例"""
-    clients = {
-        "qwen": QwenClient,
-        "chatgpt": ChatGPTClient,
-        "claude": ClaudeClient,
-        "glm": GLMClient
-    }
+    """创建对应的客户端实例
 
+    async_mode 为 True 时返回异步客户端（chat 为协程）。
+    """
+    clients = ASYNC_CLIENT_CLASSES if async_mode else CLIENT_CLASSES
     if model_type not in clients:
         raise ValueError(f"不支持的模型类型: {model_type}")
 
     try:
-        return clients[model_type](api_key, temperature=temperature)
+        return clients[model_type](api_key, temperature=temperature, **kwargs)
     except Exception as e:
         logger.error(f"Failed to create client for {model_type}: {str(e)}")
         raise
 
 
-def verify_api_key(model_type: str, api_key: str) -> Tuple[bool, str]:
-    """验证 API 密钥"""
+class PromptGroup:
+    """一组相互独立的提示词
+
+    所有提示词在共享事件循环上并发发送，结果按添加顺序返回，总耗时约等于最慢的
+    一个请求。
+
+    示例::
+
+        group = PromptGroup("glm", api_key)
+        group.add(title_prompt)
+        group.add(script_prompt)
+        title, script = group.run()
+    """
+
+    def __init__(
+            self,
+            model_type: str,
+            api_key: str,
+            temperature: float = 0.2,
+            max_concurrency: int = 8
+    ):
+        self.client = create_client(model_type, api_key, temperature=temperature, async_mode=True)
+        self.max_concurrency = max_concurrency
+        self._requests: List[Tuple[str, Optional[float], Dict[str, Any]]] = []
+
+    def add(self, prompt: str, temperature: Optional[float] = None, **kwargs) -> int:
+        """添加一个提示词，返回其结果在列表中的下标"""
+        self._requests.append((prompt, temperature, kwargs))
+        return len(self._requests) - 1
+
+    async def arun(self, return_exceptions: bool = False) -> List[Any]:
+        """并发执行所有提示词
+
+        return_exceptions 为 False 时任一请求失败即抛出异常并取消其余请求；
+        为 True 时失败请求的位置返回异常对象。
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def run_one(prompt: str, temperature: Optional[float], kwargs: Dict[str, Any]) -> str:
+            async with semaphore:
+                return await self.client.chat(prompt, temperature, **kwargs)
+
+        tasks = [asyncio.ensure_future(run_one(*request)) for request in self._requests]
+        try:
+            return await asyncio.gather(*tasks, return_exceptions=return_exceptions)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+
+    def run(self, timeout: Optional[float] = None, return_exceptions: bool = False) -> List[Any]:
+        """在共享后台事件循环上执行并阻塞等待全部结果"""
+        return run_async(self.arun(return_exceptions=return_exceptions), timeout=timeout)
+
+
+def run_prompt_group(
+        model_type: str,
+        api_key: str,
+        prompts: Sequence[str],
+        temperature: float = 0.2,
+        max_concurrency: int = 8,
+        timeout: Optional[float] = None,
+        return_exceptions: bool = False
+) -> List[Any]:
+    """并发发送多个独立提示词，按顺序返回结果"""
+    group = PromptGroup(model_type, api_key, temperature=temperature, max_concurrency=max_concurrency)
+    for prompt in prompts:
+        group.add(prompt)
+    return group.run(timeout=timeout, return_exceptions=return_exceptions)
+
+
+class ClientPool:
+    """进程级客户端池
+
+    按 (provider, api_key) 复用客户端及其 keep-alive 会话，避免每次请求都重新
+    建立 TCP/TLS 连接。超过 idle_timeout 未使用的客户端会被回收，客户端数量
+    超过 max_size 时按最近最少使用淘汰。正在进行请求的客户端不会被淘汰（此时池可以
+    暂时超过 max_size）；取出后尚未发起请求就被淘汰的客户端，其会话关闭推迟到
+    请求结束。
+    """
+
+    def __init__(self, max_size: int = 16, idle_timeout: float = 300, pool_maxsize: int = 10):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.pool_maxsize = pool_maxsize
+        self._clients: "OrderedDict[Tuple[str, str], Tuple[BaseAPIClient, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def configure(
+            self,
+            max_size: Optional[int] = None,
+            idle_timeout: Optional[float] = None,
+            pool_maxsize: Optional[int] = None
+    ) -> None:
+        """调整池参数，pool_maxsize 仅对之后新建的客户端生效"""
+        with self._lock:
+            if max_size is not None:
+                self.max_size = max_size
+            if idle_timeout is not None:
+                self.idle_timeout = idle_timeout
+            if pool_maxsize is not None:
+                self.pool_maxsize = pool_maxsize
+            self._evict_locked(time.monotonic())
+
+    def get(self, model_type: str, api_key: str) -> BaseAPIClient:
+        """获取（或创建）对应 provider 与密钥的客户端"""
+        key = (model_type, api_key)
+        now = time.monotonic()
+        with self._lock:
+            self._evict_locked(now)
+            entry = self._clients.pop(key, None)
+            if entry is None:
+                client = create_client(model_type, api_key, pool_maxsize=self.pool_maxsize)
+                logger.info(f"Created pooled client for {model_type}")
+            else:
+                client = entry[0]
+            self._clients[key] = (client, now)
+            return client
+
+    def evict_idle(self) -> int:
+        """回收空闲客户端，返回回收数量"""
+        with self._lock:
+            return self._evict_locked(time.monotonic())
+
+    def clear(self) -> None:
+        """关闭并清空所有客户端"""
+        with self._lock:
+            for client, _ in self._clients.values():
+                client.close()
+            self._clients.clear()
+
+    def _evict_locked(self, now: float) -> int:
+        evicted = 0
+        for key, (client, last_used) in list(self._clients.items()):
+            if now - last_used > self.idle_timeout and not client.in_use:
+                del self._clients[key]
+                client.close()
+                evicted += 1
+        # 按最近最少使用的顺序淘汰空闲客户端
+        idle = [key for key, (client, _) in self._clients.items() if not client.in_use]
+        for key in idle[:max(0, len(self._clients) - self.max_size)]:
+            client, _ = self._clients.pop(key)
+            client.close()
+            evicted += 1
+        return evicted
+
+    def __len__(self) -> int:
+        return len(self._clients)
+
+
+_client_pool = ClientPool()
+
+
+def get_client(model_type: str, api_key: str) -> BaseAPIClient:
+    """从进程级客户端池获取客户端"""
+    if model_type not in CLIENT_CLASSES:
+        raise ValueError(f"不支持的模型类型: {model_type}")
+    return _client_pool.get(model_type, api_key)
+
+
+def configure_client_pool(
+        max_size: Optional[int] = None,
+        idle_timeout: Optional[float] = None,
+        pool_maxsize: Optional[int] = None
+) -> None:
+    """配置进程级客户端池"""
+    _client_pool.configure(max_size=max_size, idle_timeout=idle_timeout, pool_maxsize=pool_maxsize)
+
+
+# 对冲请求：主 provider 在阈值内没有返回首个 token 时启动备用 provider
+DEFAULT_HEDGE_DELAY = 3.0
+HEDGE_MIN_SAMPLES = 20
+
+
+class ProviderLatencyStats:
+    """按 provider 统计请求的首 token 延迟、总延迟以及对冲中的胜负"""
+
+    def __init__(self, window: int = 200):
+        self.window = window
+        self._providers: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def _entry_locked(self, provider: str) -> Dict[str, Any]:
+        entry = self._providers.get(provider)
+        if entry is None:
+            entry = {
+                'wins': 0, 'losses': 0, 'errors': 0, 'hedges': 0,
+                'first_token': deque(maxlen=self.window),
+                'total': deque(maxlen=self.window)
+            }
+            self._providers[provider] = entry
+        return entry
+
+    def record_first_token(self, provider: str, latency: float) -> None:
+        with self._lock:
+            self._entry_locked(provider)['first_token'].append(latency)
+
+    def record_total(self, provider: str, latency: float) -> None:
+        with self._lock:
+            self._entry_locked(provider)['total'].append(latency)
+
+    def record(self, provider: str, outcome: str) -> None:
+        """记录一次结果，outcome 为 wins / losses / errors / hedges"""
+        with self._lock:
+            self._entry_locked(provider)[outcome] += 1
+
+    def percentile(self, provider: str, q: float = 0.95, metric: str = 'first_token') -> Optional[float]:
+        """返回延迟分位数，样本不足 HEDGE_MIN_SAMPLES 时返回 None"""
+        with self._lock:
+            samples = sorted(self._entry_locked(provider)[metric])
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """按 provider 返回胜负次数与延迟中位数/P95"""
+        with self._lock:
+            providers = {name: dict(entry) for name, entry in self._providers.items()}
+
+        def quantile(samples, q):
+            samples = sorted(samples)
+            return samples[min(len(samples) - 1, int(q * len(samples)))] if samples else None
+
+        return {
+            name: {
+                'wins': entry['wins'],
+                'losses': entry['losses'],
+                'errors': entry['errors'],
+                'hedges': entry['hedges'],
+                'first_token_p50': quantile(entry['first_token'], 0.5),
+                'first_token_p95': quantile(entry['first_token'], 0.95),
+                'total_p50': quantile(entry['total'], 0.5)
+            }
+            for name, entry in providers.items()
+        }
+
+
+_hedge_stats = ProviderLatencyStats()
+_hedge_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="hedged-request")
+
+
+def get_hedge_stats() -> ProviderLatencyStats:
+    """获取进程级 provider 延迟与胜负统计"""
+    return _hedge_stats
+
+
+class HedgedClient:
+    """多 provider 对冲请求
+
+    先向主 provider 发送流式请求；若在 hedge_after 秒内没有收到首个 token（或主请求
+    直接失败），依次启动备用 provider。最先完整返回的结果胜出，其余请求被取消，
+    它们会在收到下一段数据时关闭连接。hedge_after 为 None 时使用主 provider 首 token
+    延迟的 P95（样本不足时为 DEFAULT_HEDGE_DELAY）。stream_chat 以最先输出首个 token
+    的 provider 为胜者，之后只转发它的输出。
+
+    示例::
+
+        client = HedgedClient(("glm", glm_key), [("qwen", qwen_key)])
+        text = client.chat(prompt)
+    """
+
+    def __init__(
+            self,
+            primary: Tuple[str, str],
+            backups: Sequence[Tuple[str, str]],
+            hedge_after: Optional[float] = None,
+            stats: Optional[ProviderLatencyStats] = None
+    ):
+        self.targets = [primary] + list(backups)
+        self.hedge_after = hedge_after
+        self.stats = stats or _hedge_stats
+
+    def hedge_delay(self) -> float:
+        """启动下一个备用 provider 前等待首 token 的时间"""
+        if self.hedge_after is not None:
+            return self.hedge_after
+        p95 = self.stats.percentile(self.targets[0][0], 0.95)
+        return p95 if p95 is not None else DEFAULT_HEDGE_DELAY
+
+    def chat(self, prompt: str, temperature: Optional[float] = None, **kwargs) -> str:
+        """发送对冲请求，返回最先完成的 provider 的回复"""
+        results: "queue.Queue[Tuple[int, Optional[str], Optional[BaseException]]]" = queue.Queue()
+        first_token = threading.Event()
+        cancels: List[threading.Event] = []
+        delay = self.hedge_delay()
+
+        def attempt(index: int, cancel: threading.Event) -> None:
+            provider, api_key = self.targets[index]
+            started = time.monotonic()
+            chunks: List[str] = []
+            try:
+                stream = get_client(provider, api_key).stream_chat(prompt, temperature, **kwargs)
+                try:
+                    for delta in stream:
+                        if not chunks:
+                            # 被取消的慢请求也记录首 token 延迟，P95 才能反映真实尾部
+                            self.stats.record_first_token(provider, time.monotonic() - started)
+                            first_token.set()
+                        if cancel.is_set():
+                            return
+                        chunks.append(delta)
+                finally:
+                    stream.close()
+                self.stats.record_total(provider, time.monotonic() - started)
+                results.put((index, "".join(chunks), None))
+            except BaseException as e:
+                results.put((index, None, e))
+
+        def launch(index: int) -> None:
+            cancel = threading.Event()
+            cancels.append(cancel)
+            if index > 0:
+                self.stats.record(self.targets[index][0], 'hedges')
+                logger.info(f"Hedging request to {self.targets[index][0]} after {delay:.2f}s")
+            submit_in_context(_hedge_executor, attempt, index, cancel)
+
+        launch(0)
+        launched_at = time.monotonic()
+        running = 1
+        failed = set()
+        last_error: Optional[BaseException] = None
+        while True:
+            timeout = None
+            if len(cancels) < len(self.targets) and not first_token.is_set():
+                timeout = max(0.0, launched_at + delay - time.monotonic())
+            try:
+                index, text, error = results.get(timeout=timeout)
+            except queue.Empty:
+                launch(len(cancels))
+                launched_at = time.monotonic()
+                running += 1
+                continue
+
+            running -= 1
+            provider = self.targets[index][0]
+            if error is None and text:
+                for other, cancel in enumerate(cancels):
+                    if other != index and other not in failed:
+                        cancel.set()
+                        self.stats.record(self.targets[other][0], 'losses')
+                self.stats.record(provider, 'wins')
+                return text
+
+            failed.add(index)
+            self.stats.record(provider, 'errors')
+            last_error = error or APIError(f"{provider} 返回了空回复")
+            logger.warning(f"Hedged attempt on {provider} failed: {str(last_error)}")
+            if len(cancels) < len(self.targets):
+                # 失败时不必等待阈值，立即启动下一个备用 provider
+                launch(len(cancels))
+                launched_at = time.monotonic()
+                running += 1
+            elif running == 0:
+                raise last_error
+
+    def stream_chat(self, prompt: str, temperature: Optional[float] = None, **kwargs) -> Iterator[str]:
+        """发送对冲的流式请求，逐段返回最先输出首个 token 的 provider 的回复
+
+        胜者确定后其余请求被取消；胜者中途出错时直接抛出，不再切换 provider。
+        """
+        events: "queue.Queue[Tuple[int, str, Any]]" = queue.Queue()
+        cancels: List[threading.Event] = []
+        delay = self.hedge_delay()
+
+        def attempt(index: int, cancel: threading.Event) -> None:
+            provider, api_key = self.targets[index]
+            started = time.monotonic()
+            first = True
+            try:
+                stream = get_client(provider, api_key).stream_chat(prompt, temperature, **kwargs)
+                try:
+                    for delta in stream:
+                        if first:
+                            self.stats.record_first_token(provider, time.monotonic() - started)
+                            first = False
+                        if cancel.is_set():
+                            return
+                        events.put((index, 'delta', delta))
+                finally:
+                    stream.close()
+                self.stats.record_total(provider, time.monotonic() - started)
+                events.put((index, 'done', None))
+            except BaseException as e:
+                events.put((index, 'error', e))
+
+        def launch(index: int) -> None:
+            cancel = threading.Event()
+            cancels.append(cancel)
+            if index > 0:
+                self.stats.record(self.targets[index][0], 'hedges')
+                logger.info(f"Hedging stream to {self.targets[index][0]} after {delay:.2f}s")
+            submit_in_context(_hedge_executor, attempt, index, cancel)
+
+        launch(0)
+        launched_at = time.monotonic()
+        winner: Optional[int] = None
+        failed = set()
+        try:
+            while True:
+                timeout = None
+                if winner is None and len(cancels) < len(self.targets):
+                    timeout = max(0.0, launched_at + delay - time.monotonic())
+                try:
+                    index, kind, value = events.get(timeout=timeout)
+                except queue.Empty:
+                    launch(len(cancels))
+                    launched_at = time.monotonic()
+                    continue
+
+                if winner is not None and index != winner:
+                    continue
+                provider = self.targets[index][0]
+                if kind == 'delta':
+                    if winner is None:
+                        winner = index
+                        for other, cancel in enumerate(cancels):
+                            if other != index and other not in failed:
+                                cancel.set()
+                                self.stats.record(self.targets[other][0], 'losses')
+                        self.stats.record(provider, 'wins')
+                    yield value
+                elif winner is not None:
+                    if kind == 'error':
+                        raise value
+                    return
+                else:
+                    # 未输出任何内容就结束或失败，立即启动下一个备用 provider
+                    failed.add(index)
+                    self.stats.record(provider, 'errors')
+                    error = value if kind == 'error' else APIError(f"{provider} 返回了空回复")
+                    logger.warning(f"Hedged stream on {provider} failed: {str(error)}")
+                    if len(cancels) < len(self.targets):
+                        launch(len(cancels))
+                        launched_at = time.monotonic()
+                    elif len(failed) == len(cancels):
+                        raise error
+        finally:
+            # 调用方提前停止迭代时取消所有仍在进行的请求
+            for cancel in cancels:
+                cancel.set()
+
+
+# 密钥验证结果缓存：成功结果保留较久，认证失败只短暂保留以便用户改正后重试
+VERIFY_CACHE_TTL = 600
+VERIFY_FAILURE_TTL = 60
+VERIFY_TIMEOUT = 10
+
+_verify_cache: Dict[Tuple[str, str], Tuple[float, bool, str]] = {}
+_verify_cache_lock = threading.Lock()
+# 后台验证任务（例如启动时验证已配置的密钥）使用的线程池
+_verify_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="verify-keys")
+
+
+def verify_api_key(model_type: str, api_key: str, use_cache: bool = True) -> Tuple[bool, str]:
+    """验证 API 密钥
+
+    使用各 provider 最便宜的请求（模型列表或 1 token 对话），结果按 (模型, 密钥哈希)
+    缓存；限流、网络等临时错误不缓存。
+    """
+    cache_key = (model_type, hashlib.sha256(api_key.encode('utf-8')).hexdigest())
+    if use_cache:
+        with _verify_cache_lock:
+            cached = _verify_cache.get(cache_key)
+        if cached and cached[0] > time.monotonic():
+            return cached[1], cached[2]
+
+    ttl = 0
+    client = None
     try:
         logger.info(f"Verifying API key for {model_type}")
-        client = create_client(model_type, api_key)
-        response = client.chat("测试消息")
+        # 验证用短超时、少重试的独立客户端，用完即关闭会话
+        client = create_client(model_type, api_key, timeout=VERIFY_TIMEOUT, max_retries=1)
+        client.verify()
         logger.info(f"API key verification successful for {model_type}")
-        return True, "API密钥验证成功"
+        result, ttl = (True, "API密钥验证成功"), VERIFY_CACHE_TTL
     except AuthenticationError as e:
         logger.error(f"Authentication error for {model_type}: {str(e)}")
-        return False, str(e)
+        result, ttl = (False, str(e)), VERIFY_FAILURE_TTL
     except RateLimitError as e:
         logger.error(f"Rate limit error for {model_type}: {str(e)}")
-        return False, str(e)
+        result = (False, str(e))
     except Exception as e:
         logger.error(f"Verification failed for {model_type}: {str(e)}")
-        return False, f"验证失败: {str(e)}"
\ No newline at end of file
+        result = (False, f"验证失败: {str(e)}")
+    finally:
+        if client is not None:
+            client.close()
+
+    if ttl:
+        with _verify_cache_lock:
+            _verify_cache[cache_key] = (time.monotonic() + ttl, result[0], result[1])
+    return result
+
+
+def verify_api_keys(api_keys: Dict[str, str], use_cache: bool = True) -> Dict[str, Tuple[bool, str]]:
+    """并发验证多个模型的密钥，跳过空密钥"""
+    targets = {model_type: key for model_type, key in api_keys.items() if key}
+    if not targets:
+        return {}
+    with ThreadPoolExecutor(max_workers=len(targets), thread_name_prefix="verify-key") as executor:
+        futures = {
+            model_type: executor.submit(verify_api_key, model_type, key, use_cache)
+            for model_type, key in targets.items()
+        }
+        return {model_type: future.result() for model_type, future in futures.items()}
+
+
+def verify_api_keys_async(api_keys: Dict[str, str], use_cache: bool = True) -> Future:
+    """在后台验证多个模型的密钥，立即返回 Future，结果与 verify_api_keys 相同"""
+    return _verify_executor.submit(verify_api_keys, dict(api_keys), use_cache)
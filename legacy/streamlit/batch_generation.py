@@ -0,0 +1,169 @@
+import csv
+import hashlib
+import io
+import json
+import logging
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+from utils import generate_xiaohongshu_content
+
+logger = logging.getLogger(__name__)
+
+# 批量任务的断点文件目录，每个任务一个 JSONL 文件
+BATCH_DIR = Path.cwd() / "batch_jobs"
+# 每个密钥的并发数（同一密钥还受 rate_limiter 的限额约束）
+BATCH_WORKERS_PER_KEY = 2
+BATCH_MAX_WORKERS = 16
+
+_THEME_COLUMNS = ("theme", "主题")
+
+
+def load_batch_themes(file_content: bytes, file_name: str) -> List[Dict[str, Any]]:
+    """解析 CSV / JSONL 主题文件
+
+    CSV 读取 theme（或“主题”）列，缺少时取第一列；JSONL 每行为含 theme 字段的对象
+    或纯字符串。可选的 id、temperature 字段原样保留，缺少 id 时按行号编号。
+    """
+    text = file_content.decode("utf-8-sig")
+    rows: List[Dict[str, Any]] = []
+    if file_name.lower().endswith((".jsonl", ".json")):
+        for line in text.splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            rows.append(record if isinstance(record, dict) else {"theme": str(record)})
+    else:
+        reader = csv.DictReader(io.StringIO(text))
+        fields = reader.fieldnames or []
+        column = next((name for name in fields if name.strip().lower() in _THEME_COLUMNS), fields[0] if fields else None)
+        for row in reader:
+            rows.append({**row, "theme": row.get(column) or ""})
+
+    items = []
+    for index, row in enumerate(rows, start=1):
+        theme = str(row.get("theme") or "").strip()
+        if not theme:
+            continue
+        item: Dict[str, Any] = {"id": str(row.get("id") or index), "theme": theme}
+        if row.get("temperature") not in (None, ""):
+            item["temperature"] = float(row["temperature"])
+        items.append(item)
+    return items
+
+
+class XiaohongshuBatch:
+    """小红书文案批量生成任务
+
+    主题分发到所有可用密钥的工作线程上并发生成，结果逐条追加写入断点文件
+    （同时也是可下载的 JSONL）。同一份输入再次运行时跳过已成功的条目，
+    失败的条目会重新生成。
+    """
+
+    def __init__(
+            self,
+            items: List[Dict[str, Any]],
+            api_keys: Dict[str, str],
+            temperature: float = 0.7,
+            job_id: Optional[str] = None,
+            workers_per_key: int = BATCH_WORKERS_PER_KEY,
+            output_dir: Path = BATCH_DIR
+    ):
+        self.items = items
+        self.api_keys = {model_type: key for model_type, key in api_keys.items() if key}
+        if not self.api_keys:
+            raise ValueError("没有可用的API密钥")
+        self.temperature = temperature
+        self.job_id = job_id or hashlib.sha256(
+            json.dumps(items, ensure_ascii=False, sort_keys=True).encode("utf-8")
+        ).hexdigest()[:16]
+        self.workers_per_key = max(1, workers_per_key)
+        self.path = Path(output_dir) / f"{self.job_id}.jsonl"
+
+    def records(self) -> Dict[str, Dict[str, Any]]:
+        """读取断点文件，返回每个条目最新的记录"""
+        latest: Dict[str, Dict[str, Any]] = {}
+        if not self.path.exists():
+            return latest
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # 崩溃时写了一半的最后一行
+                    continue
+                latest[record["id"]] = record
+        return latest
+
+    def pending(self) -> List[Dict[str, Any]]:
+        done = {item_id for item_id, record in self.records().items() if record.get("status") == "ok"}
+        return [item for item in self.items if item["id"] not in done]
+
+    def run(self) -> Iterator[Dict[str, Any]]:
+        """生成尚未完成的条目，每完成一条写入断点文件并返回该记录"""
+        pending = self.pending()
+        if not pending:
+            return
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tasks: "queue.Queue[Dict[str, Any]]" = queue.Queue()
+        for item in pending:
+            tasks.put(item)
+        results: "queue.Queue[Dict[str, Any]]" = queue.Queue()
+        stop = threading.Event()
+
+        slots = [(model_type, key) for model_type, key in self.api_keys.items() for _ in range(self.workers_per_key)]
+        slots = slots[:min(BATCH_MAX_WORKERS, len(pending))]
+        executor = ThreadPoolExecutor(max_workers=len(slots), thread_name_prefix="xhs-batch")
+        for model_type, key in slots:
+            executor.submit(self._work, tasks, results, stop, model_type, key)
+
+        try:
+            # 只有当前线程写文件，工作线程通过队列交回结果
+            with open(self.path, "a", encoding="utf-8") as f:
+                if f.tell() and not self._ends_with_newline():
+                    # 上次崩溃留下的半行单独成行，避免与新记录粘连
+                    f.write("\n")
+                for _ in range(len(pending)):
+                    record = results.get()
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    f.flush()
+                    yield record
+        finally:
+            # 调用方中途停止时不再领取新条目，进行中的请求完成后线程退出
+            stop.set()
+            executor.shutdown(wait=False)
+
+    def _ends_with_newline(self) -> bool:
+        with open(self.path, "rb") as f:
+            f.seek(-1, 2)
+            return f.read(1) == b"\n"
+
+    def _work(self, tasks: "queue.Queue[Dict[str, Any]]", results: "queue.Queue[Dict[str, Any]]",
+              stop: threading.Event, model_type: str, api_key: str) -> None:
+        while not stop.is_set():
+            try:
+                item = tasks.get_nowait()
+            except queue.Empty:
+                return
+            record: Dict[str, Any] = {"id": item["id"], "theme": item["theme"], "model": model_type}
+            try:
+                record["result"] = generate_xiaohongshu_content(
+                    item["theme"], model_type, api_key, item.get("temperature", self.temperature)
+                )
+                record["status"] = "ok"
+            except Exception as e:
+                logger.warning(f"Batch item {item['id']} failed on {model_type}: {str(e)}")
+                record["status"] = "error"
+                record["error"] = str(e)
+            results.put(record)
+
+    def export_jsonl(self) -> bytes:
+        """按输入顺序导出每个条目的最新记录"""
+        latest = self.records()
+        lines = [json.dumps(latest[item["id"]], ensure_ascii=False) for item in self.items if item["id"] in latest]
+        return ("\n".join(lines) + "\n").encode("utf-8") if lines else b""
@@ -1,3 +1,8 @@
+from types import MappingProxyType
+from typing import Dict, Mapping, Tuple
+
+from prompt_registry import register_template
+
 CHARACTER_TEMPLATES = {
     "AI助手": {
             "name": "AI助手",
@@ -26,6 +31,7 @@ CHARACTER_TEMPLATES = {
 
     "温柔知性大姐姐": {
         "name": "小柔",
+        "memory": {"strategy": "sliding_summary", "max_turns": 6, "token_budget": 1500},
         "personality": """你现在是一位温柔知性的大姐姐，名字叫小柔。你说话温柔体贴，总是带着关心和理解。
 你会经常使用"亲爱的"、"没关系"、"我理解"等温和的词语。
 你的语气总是充满耐心和包容，会适时给予安慰和鼓励。
@@ -38,6 +44,7 @@ CHARACTER_TEMPLATES = {
     },
     "性感冷艳御姐": {
     "name": "安然",
+    "memory": {"strategy": "sliding_summary", "max_turns": 6, "token_budget": 1500},
     "personality": """
 我是一个性感魅惑的高冷美女，举手投足间散发着优雅与魅力。说话时语气慵懒而妩媚，保持优雅得体。
 
@@ -66,6 +73,7 @@ CHARACTER_TEMPLATES = {
 
     "呆呆萌萌萝莉妹": {
         "name": "糖糖",
+        "memory": {"strategy": "sliding_summary", "max_turns": 6, "token_budget": 1500},
         "personality": """你现在是一位呆萌可爱的萝莉，名字叫糖糖。你说话总是天真烂漫，充满童趣。
 你会经常使用"呜"、"啦"、"呢"等可爱的语气词。
 你说话方式活泼可爱，经常带着疑惑和好奇。
@@ -79,6 +87,7 @@ CHARACTER_TEMPLATES = {
 
     "暴躁顶撞纹身男": {
         "name": "阿虎",
+        "memory": {"strategy": "sliding_summary", "max_turns": 6, "token_budget": 1500},
         "personality": """你现在是一位性格暴躁的纹身男，名字叫阿虎。你说话直接火爆，经常带着痞气。
 你会使用"兄弟"、"老铁"、"搞啥咯"等江湖气息的词语。
 虽然说话冲，但内心热心肠，有自己的原则。
@@ -92,6 +101,7 @@ CHARACTER_TEMPLATES = {
 
     "高冷霸道男总裁": {
         "name": "霆谦",
+        "memory": {"strategy": "sliding_summary", "max_turns": 6, "token_budget": 1500},
         "personality": """你现在是一位高冷霸道的男总裁，名字叫霆谦。你说话简洁有力，带着上位者的威严。
 你很少使用语气词，更多是陈述句和命令句。
 说话直接，带有些许傲慢，但不失风度。
@@ -105,6 +115,7 @@ CHARACTER_TEMPLATES = {
 
     "阳光开朗小奶狗": {
         "name": "暖暖",
+        "memory": {"strategy": "sliding_summary", "max_turns": 6, "token_budget": 1500},
         "personality": """你现在是一位阳光开朗的小奶狗，名字叫暖暖。你说话充满活力和正能量。
 你会经常使用"哈哈"、"耶"等表示开心的语气词。
 你乐观积极，善于鼓励他人，充满青春活力。
@@ -118,6 +129,7 @@ CHARACTER_TEMPLATES = {
 
     "英姿飒爽女王大人": {
         "name": "凌霜",
+        "memory": {"strategy": "sliding_summary", "max_turns": 6, "token_budget": 1500},
         "personality": """你现在是一位英姿飒爽的女王，名字叫凌霜。你说话凌厉干练，充满女强人气场。
 你用词高贵优雅，带有君临天下的气势。
 你处事果断，说一不二，但也有细腻的一面。
@@ -128,4 +140,30 @@ CHARACTER_TEMPLATES = {
             "很好，你的表现本王很满意。"
         ]
     }
-}
\ No newline at end of file
+}
+
+
+# 人设提示词在导入时按角色构建一次：人设文本是静态的系统消息，对话历史和用户输入
+# 都在它之后，因此每一轮对话都以相同的前缀开头，可以命中 provider 的提示词缓存
+PERSONA_PROMPTS = {
+    character_type: register_template(f"character.{character_type}", """{personality}
+
+以下是一些你的回复示例，请参考其中的语气和风格：
+{examples}
+
+请始终保持这个人设风格回复用户的消息。""", "现在用户说：{user_prompt}",
+                                      personality=character['personality'].strip(),
+                                      examples="\n".join(character['example_responses']))
+    for character_type, character in CHARACTER_TEMPLATES.items()
+}
+
+# 冻结的人设消息列表（只读），组装请求时直接放在历史消息之前
+PERSONA_MESSAGES: Dict[str, Tuple[Mapping[str, str], ...]] = {
+    character_type: (MappingProxyType({"role": "system", "content": template.static}),)
+    for character_type, template in PERSONA_PROMPTS.items()
+}
+
+# 各人设系统提示词的 token 数（估算），用于预算上下文长度
+PERSONA_TOKENS: Dict[str, int] = {
+    character_type: template.static_tokens for character_type, template in PERSONA_PROMPTS.items()
+}
@@ -0,0 +1,141 @@
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain.memory import ConversationBufferMemory
+from langchain_core.chat_history import InMemoryChatMessageHistory
+
+from api_clients import get_client
+from character_templates import CHARACTER_TEMPLATES
+from rate_limiter import estimate_tokens
+from retry_policy import submit_in_context
+
+logger = logging.getLogger(__name__)
+
+# 默认的滑动窗口参数：保留的最近轮数与窗口 token 预算
+DEFAULT_MAX_TURNS = 6
+DEFAULT_TOKEN_BUDGET = 1500
+
+# 摘要在后台线程生成，不占用对话回复的关键路径
+_summary_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="chat-summary")
+
+
+class SlidingSummaryMemory:
+    """滑动窗口 + 滚动摘要的对话记忆
+
+    最近 max_turns 轮且不超过 token_budget 的对话原样保留在 chat_memory 中；超出
+    窗口的旧对话在后台与已有摘要合并成新的摘要。摘要生成期间旧对话仍留在窗口内，
+    摘要完成后（下一次 prepare 时）才从窗口移除，因此上下文不会出现空档。
+    """
+
+    def __init__(self, max_turns: int = DEFAULT_MAX_TURNS, token_budget: int = DEFAULT_TOKEN_BUDGET):
+        self.max_turns = max_turns
+        self.token_budget = token_budget
+        self.chat_memory = InMemoryChatMessageHistory()
+        self._summary = ""
+        self._future: Optional[Future] = None
+        self._lock = threading.Lock()
+
+    @property
+    def summary(self) -> str:
+        return self._summary
+
+    def prepare(self) -> str:
+        """应用已完成的后台摘要并返回当前摘要，在组装提示词前调用"""
+        with self._lock:
+            future = self._future
+            if future is None or not future.done():
+                return self._summary
+            self._future = None
+
+        try:
+            summary, folded = future.result()
+        except Exception as e:
+            logger.warning(f"Rolling summary update failed: {str(e)}")
+            return self._summary
+
+        messages = self.chat_memory.messages
+        # 只有被摘要的消息仍在窗口头部时才移除，期间被清空的记忆不受影响
+        if len(messages) >= len(folded) and all(a is b for a, b in zip(messages, folded)):
+            del messages[:len(folded)]
+            self._summary = summary
+        return self._summary
+
+    def save_turn(self, user_message: str, ai_message: str,
+                  model_type: Optional[str] = None, api_key: Optional[str] = None) -> None:
+        """保存一轮对话，窗口超出预算时在后台折叠最旧的对话"""
+        self.chat_memory.add_user_message(user_message)
+        self.chat_memory.add_ai_message(ai_message)
+
+        if not (model_type and api_key):
+            return
+        folded = self._overflow()
+        if not folded:
+            return
+        with self._lock:
+            if self._future is not None:
+                # 已有摘要任务在运行，等它完成后下一轮再折叠
+                return
+            self._future = submit_in_context(
+                _summary_executor, _summarize, self._summary, folded, model_type, api_key
+            )
+
+    def clear(self) -> None:
+        self.chat_memory.clear()
+        self._summary = ""
+        with self._lock:
+            self._future = None
+
+    def _overflow(self) -> List[Any]:
+        """返回需要移出窗口的最旧消息（按整轮计算）"""
+        messages = self.chat_memory.messages
+        tokens = [estimate_tokens(getattr(message, 'content', '') or '') for message in messages]
+        start = 0
+        while start < len(messages):
+            turns = (len(messages) - start + 1) // 2
+            if turns <= self.max_turns and sum(tokens[start:]) <= self.token_budget:
+                break
+            # 一次移出一轮（用户 + 助手），且至少保留最新一轮
+            if len(messages) - start <= 2:
+                break
+            start += 2
+        return list(messages[:start])
+
+
+def _summarize(previous_summary: str, messages: List[Any], model_type: str, api_key: str) -> Tuple[str, List[Any]]:
+    """把旧摘要与新移出窗口的对话合并成新摘要"""
+    transcript = "\n".join(
+        f"{'Human' if message.type == 'human' else 'Assistant'}: {message.content}"
+        for message in messages
+    )
+    prompt = f"""请把以下对话内容合并进已有的对话摘要，保留人物关系、用户的偏好和重要事实，省略寒暄。
+直接输出更新后的摘要，不超过300字。
+
+已有摘要：
+{previous_summary or "（无）"}
+
+新增对话：
+{transcript}"""
+    summary = get_client(model_type, api_key).chat(prompt, temperature=0.3)
+    return summary.strip(), messages
+
+
+def create_chat_memory(character_type: Optional[str] = None):
+    """按人设配置创建对话记忆
+
+    CHARACTER_TEMPLATES 中的 memory 配置决定策略：strategy 为 "sliding_summary" 时使用
+    SlidingSummaryMemory（可配置 max_turns / token_budget），否则使用完整缓冲记忆。
+    """
+    config: Dict[str, Any] = CHARACTER_TEMPLATES.get(character_type, {}).get("memory", {})
+    if config.get("strategy") == "sliding_summary":
+        return SlidingSummaryMemory(
+            max_turns=config.get("max_turns", DEFAULT_MAX_TURNS),
+            token_budget=config.get("token_budget", DEFAULT_TOKEN_BUDGET)
+        )
+    return ConversationBufferMemory(
+        return_messages=True,
+        memory_key="chat_history",
+        input_key="input",
+        output_key="output"
+    )
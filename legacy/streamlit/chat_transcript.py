@@ -0,0 +1,127 @@
+import hashlib
+import threading
+import weakref
+from typing import Any, Dict, List, Sequence
+
+
+def render_message(message: Any) -> str:
+    """渲染单条消息，空消息返回空字符串"""
+    if not (hasattr(message, 'content') and message.content):
+        return ""
+    role = 'Human' if message.type == 'human' else 'Assistant'
+    return f"{role}: {message.content}\n"
+
+
+class IncrementalTranscript:
+    """追加式维护的对话记录
+
+    记住已渲染的消息对象及其文本，新一轮对话只渲染新增的消息并追加到缓存的前缀
+    之后。已渲染部分的字节保持不变，可直接作为服务端提示词缓存的稳定前缀。
+    同时增量维护按角色拆分的历史消息和整段记录的摘要（用作响应缓存键），每轮
+    只处理新增消息。如果历史从头部被裁剪（例如滑动窗口），只丢弃对应的前缀；
+    其他改动则整体重建。
+    """
+
+    def __init__(self):
+        self._messages: List[Any] = []
+        self._lines: List[str] = []
+        self._line_digests: List[bytes] = []
+        self._turns: List[Dict[str, str]] = []
+        self._text = ""
+        self._hasher = hashlib.sha256()
+        self._lock = threading.Lock()
+
+    @property
+    def prefix(self) -> str:
+        """当前缓存的已渲染记录"""
+        return self._text
+
+    @property
+    def turns(self) -> List[Dict[str, str]]:
+        """与记录对应的历史消息（user / assistant），不含空消息"""
+        return self._turns
+
+    @property
+    def digest(self) -> str:
+        """当前记录的摘要，内容相同的记录摘要相同"""
+        return self._hasher.hexdigest()
+
+    def render(self, messages: Sequence[Any]) -> str:
+        """同步到给定消息列表并返回完整记录"""
+        with self._lock:
+            start = self._align(messages)
+            if start is None:
+                self._reset()
+                start = 0
+            for message in messages[start:]:
+                line = render_message(message)
+                line_digest = hashlib.sha256(line.encode('utf-8')).digest()
+                self._messages.append(message)
+                self._lines.append(line)
+                self._line_digests.append(line_digest)
+                self._hasher.update(line_digest)
+                self._text += line
+                if line:
+                    self._turns.append({
+                        "role": "user" if message.type == "human" else "assistant",
+                        "content": message.content
+                    })
+            return self._text
+
+    def _align(self, messages: Sequence[Any]):
+        """返回需要新渲染的起始下标；缓存无法复用时返回 None"""
+        if not self._messages:
+            return 0
+        if not messages:
+            return None
+
+        # 历史头部被裁剪时，找到仍保留的第一条消息在缓存中的位置
+        try:
+            dropped = next(i for i, cached in enumerate(self._messages) if cached is messages[0])
+        except StopIteration:
+            return None
+
+        kept = len(self._messages) - dropped
+        if len(messages) < kept:
+            return None
+        # 逐条比较对象身份（开销远小于重新渲染），中间被替换的消息也要整体重建
+        if any(message is not cached for message, cached in zip(messages[:kept], self._messages[dropped:])):
+            return None
+
+        if dropped:
+            dropped_length = sum(len(line) for line in self._lines[:dropped])
+            dropped_turns = sum(1 for line in self._lines[:dropped] if line)
+            del self._messages[:dropped]
+            del self._lines[:dropped]
+            del self._line_digests[:dropped]
+            del self._turns[:dropped_turns]
+            self._text = self._text[dropped_length:]
+            # 摘要由保留下来的各条消息摘要重新串联（窗口内的消息数有限）
+            self._hasher = hashlib.sha256()
+            for line_digest in self._line_digests:
+                self._hasher.update(line_digest)
+        return kept
+
+    def _reset(self) -> None:
+        self._messages = []
+        self._lines = []
+        self._line_digests = []
+        self._turns = []
+        self._text = ""
+        self._hasher = hashlib.sha256()
+
+
+_transcripts: Dict[int, IncrementalTranscript] = {}
+_transcripts_lock = threading.Lock()
+
+
+def get_transcript(memory: Any) -> IncrementalTranscript:
+    """获取与记忆对象绑定的增量记录，记忆对象被回收时一并释放"""
+    key = id(memory)
+    with _transcripts_lock:
+        transcript = _transcripts.get(key)
+        if transcript is None:
+            transcript = IncrementalTranscript()
+            _transcripts[key] = transcript
+            weakref.finalize(memory, _transcripts.pop, key, None)
+        return transcript
@@ -0,0 +1,165 @@
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Optional, Tuple
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """provider 端点的熔断器
+
+    在 window 秒的滑动窗口内，样本数达到 min_calls 后，失败率或慢调用率超过阈值即
+    熔断（open），熔断期间直接拒绝请求；open_duration 秒后进入半开（half_open），
+    只放行 half_open_calls 个探测请求，探测成功则恢复（closed），失败则重新熔断。
+    """
+
+    def __init__(
+            self,
+            failure_rate: float = 0.5,
+            slow_call_rate: float = 0.8,
+            slow_call_seconds: float = 20.0,
+            min_calls: int = 5,
+            window: float = 60.0,
+            open_duration: float = 30.0,
+            half_open_calls: int = 1
+    ):
+        self.failure_rate = failure_rate
+        self.slow_call_rate = slow_call_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.min_calls = min_calls
+        self.window = window
+        self.open_duration = open_duration
+        self.half_open_calls = half_open_calls
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probes = 0
+        # (时间, 是否失败, 是否慢调用)
+        self._calls: deque = deque()
+        self._lock = threading.Lock()
+        self._rejected = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state_locked(time.monotonic())
+
+    def allow_request(self) -> bool:
+        """是否放行一次请求；半开状态下占用一个探测名额"""
+        with self._lock:
+            state = self._current_state_locked(time.monotonic())
+            if state == CLOSED:
+                return True
+            if state == HALF_OPEN and self._probes < self.half_open_calls:
+                self._probes += 1
+                return True
+            self._rejected += 1
+            return False
+
+    def record_success(self, latency: float) -> None:
+        self._record(False, latency)
+
+    def record_failure(self, latency: float) -> None:
+        self._record(True, latency)
+
+    def retry_in(self) -> float:
+        """距离进入半开状态还需的秒数"""
+        with self._lock:
+            if self._state != OPEN:
+                return 0.0
+            return max(0.0, self._opened_at + self.open_duration - time.monotonic())
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            now = time.monotonic()
+            state = self._current_state_locked(now)
+            self._trim_locked(now)
+            calls = len(self._calls)
+            return {
+                'state': state,
+                'calls': calls,
+                'failure_rate': sum(1 for _, failed, _ in self._calls if failed) / calls if calls else 0.0,
+                'slow_call_rate': sum(1 for _, _, slow in self._calls if slow) / calls if calls else 0.0,
+                'rejected': self._rejected,
+                'retry_in': max(0.0, self._opened_at + self.open_duration - now) if state == OPEN else 0.0
+            }
+
+    def _record(self, failed: bool, latency: float) -> None:
+        now = time.monotonic()
+        slow = latency >= self.slow_call_seconds
+        with self._lock:
+            state = self._current_state_locked(now)
+            if state == HALF_OPEN:
+                self._probes = max(0, self._probes - 1)
+                if failed or slow:
+                    self._open_locked(now)
+                else:
+                    # 探测成功，清空旧样本重新统计
+                    self._state = CLOSED
+                    self._calls.clear()
+                return
+            if state == OPEN:
+                return
+
+            self._calls.append((now, failed, slow))
+            self._trim_locked(now)
+            calls = len(self._calls)
+            if calls < self.min_calls:
+                return
+            failures = sum(1 for _, failed_call, _ in self._calls if failed_call)
+            slow_calls = sum(1 for _, _, slow_call in self._calls if slow_call)
+            if failures / calls >= self.failure_rate or slow_calls / calls >= self.slow_call_rate:
+                self._open_locked(now)
+
+    def _current_state_locked(self, now: float) -> str:
+        if self._state == OPEN and now - self._opened_at >= self.open_duration:
+            self._state = HALF_OPEN
+            self._probes = 0
+        return self._state
+
+    def _open_locked(self, now: float) -> None:
+        self._state = OPEN
+        self._opened_at = now
+        self._probes = 0
+        self._calls.clear()
+
+    def _trim_locked(self, now: float) -> None:
+        while self._calls and now - self._calls[0][0] > self.window:
+            self._calls.popleft()
+
+
+_breakers: Dict[Tuple[str, str], CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(provider: str, endpoint: str) -> CircuitBreaker:
+    """获取 provider 端点对应的熔断器，所有密钥与会话共享"""
+    key = (provider, endpoint)
+    with _breakers_lock:
+        breaker = _breakers.get(key)
+        if breaker is None:
+            breaker = CircuitBreaker()
+            _breakers[key] = breaker
+        return breaker
+
+
+def get_circuit_states() -> Dict[str, Dict[str, Any]]:
+    """按 provider 汇总熔断状态（同一 provider 多个端点时取最差的状态）"""
+    severity = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+    with _breakers_lock:
+        breakers = list(_breakers.items())
+    states: Dict[str, Dict[str, Any]] = {}
+    for (provider, _), breaker in breakers:
+        snapshot = breaker.snapshot()
+        current: Optional[Dict[str, Any]] = states.get(provider)
+        if current is None or severity[snapshot['state']] > severity[current['state']]:
+            states[provider] = snapshot
+    return states
+
+
+def is_provider_available(provider: str) -> bool:
+    """provider 当前是否未处于熔断状态"""
+    state = get_circuit_states().get(provider)
+    return state is None or state['state'] != OPEN
@@ -1,13 +1,105 @@
+import io
+import json
 import os
+import threading
 from pathlib import Path
+from typing import Dict, Optional, Tuple
 import streamlit as st
 import base64
+from PIL import Image
+
+# 聊天气泡中头像的显示尺寸（px）；缩略图按 2 倍尺寸生成，高分屏上依然清晰
+AVATAR_DISPLAY_SIZE = 40
+AVATAR_THUMBNAIL_SIZE = AVATAR_DISPLAY_SIZE * 2
+# 构建步骤生成的清单文件：所有头像缩略图的 data URI 打包在一个 JSON 中
+AVATAR_MANIFEST_NAME = "manifest.json"
+
+# 进程级缓存：路径 -> ((mtime_ns, 文件大小), data URI)，文件修改后自动失效
+_avatar_cache: Dict[str, Tuple[Tuple[int, int], str]] = {}
+_avatar_cache_lock = threading.Lock()
+_loaded_manifests: set = set()
+
+
+def _file_version(file_path: Path) -> Tuple[int, int]:
+    stat = file_path.stat()
+    return stat.st_mtime_ns, stat.st_size
+
+
+def encode_avatar_thumbnail(file_path: Path, size: int = AVATAR_THUMBNAIL_SIZE) -> str:
+    """把头像缩放为缩略图并编码为 PNG data URI；无法解析的图片原样编码"""
+    try:
+        with Image.open(file_path) as image:
+            image = image.convert("RGBA")
+            image.thumbnail((size, size), Image.LANCZOS)
+            buffer = io.BytesIO()
+            image.save(buffer, format="PNG", optimize=True)
+            data = buffer.getvalue()
+    except OSError:
+        data = file_path.read_bytes()
+    return f"data:image/png;base64,{base64.b64encode(data).decode()}"
+
+
+def _load_manifest(avatar_dir: Path) -> None:
+    """把构建好的清单预先装入缓存，版本号与源文件不一致的条目忽略"""
+    manifest_path = avatar_dir / AVATAR_MANIFEST_NAME
+    key = str(manifest_path)
+    with _avatar_cache_lock:
+        if key in _loaded_manifests:
+            return
+        _loaded_manifests.add(key)
+    if not manifest_path.exists():
+        return
+    try:
+        manifest = json.loads(manifest_path.read_text(encoding="utf-8"))
+    except (OSError, ValueError) as e:
+        print(f"头像清单读取错误: {str(e)}")
+        return
+    if manifest.get("size") != AVATAR_THUMBNAIL_SIZE:
+        return
+    with _avatar_cache_lock:
+        for file_name, entry in manifest.get("avatars", {}).items():
+            _avatar_cache.setdefault(str(avatar_dir / file_name), (tuple(entry["version"]), entry["data_uri"]))
+
+
+def get_cached_avatar(file_path: Path) -> Optional[str]:
+    """获取头像缩略图的 data URI（按修改时间校验的进程级缓存），文件不存在时返回 None"""
+    try:
+        version = _file_version(file_path)
+    except OSError:
+        return None
+    key = str(file_path)
+    with _avatar_cache_lock:
+        cached = _avatar_cache.get(key)
+    if cached and cached[0] == version:
+        return cached[1]
+    data_uri = encode_avatar_thumbnail(file_path)
+    with _avatar_cache_lock:
+        _avatar_cache[key] = (version, data_uri)
+    return data_uri
+
+
+def build_avatar_manifest(avatar_dir: Path = Path("assets/avatars")) -> Path:
+    """构建步骤：把目录下所有头像的缩略图打包进一个清单文件，启动时直接加载"""
+    avatar_dir = Path(avatar_dir).resolve()
+    avatars = {}
+    for file_path in sorted(avatar_dir.glob("*.png")):
+        avatars[file_path.name] = {
+            "version": list(_file_version(file_path)),
+            "data_uri": encode_avatar_thumbnail(file_path)
+        }
+    manifest_path = avatar_dir / AVATAR_MANIFEST_NAME
+    manifest_path.write_text(
+        json.dumps({"size": AVATAR_THUMBNAIL_SIZE, "avatars": avatars}, ensure_ascii=False),
+        encoding="utf-8"
+    )
+    return manifest_path
 
 
 class AvatarManager:
     def __init__(self):
         self.avatar_dir = Path("assets/avatars").resolve()
         self.ensure_avatar_directory()
+        _load_manifest(self.avatar_dir)
 
         # 定义模型对应的头像
         self.model_avatars = {
@@ -25,12 +117,9 @@ class AvatarManager:
             st.error(f"无法创建头像目录: {str(e)}")
 
     def _get_avatar_base64(self, file_path: Path) -> str:
-        """将头像文件转换为base64编码"""
+        """将头像文件转换为base64编码（缩略图，带缓存）"""
         try:
-            if file_path.exists():
-                with open(file_path, "rb") as f:
-                    return f"data:image/png;base64,{base64.b64encode(f.read()).decode()}"
-            return self.get_default_avatar_base64()
+            return get_cached_avatar(file_path) or self.get_default_avatar_base64()
         except Exception as e:
             print(f"头像转换错误 ({file_path.name}): {str(e)}")
             return self.get_default_avatar_base64()
@@ -78,10 +167,9 @@ class AvatarManager:
     def get_default_avatar_base64(self) -> str:
         """返回默认头像的 base64 编码"""
         try:
-            default_path = self.avatar_dir / "default_assistant.png"
-            if default_path.exists():
-                with open(default_path, "rb") as f:
-                    return f"data:image/png;base64,{base64.b64encode(f.read()).decode()}"
+            data_uri = get_cached_avatar(self.avatar_dir / "default_assistant.png")
+            if data_uri:
+                return data_uri
         except Exception:
             pass
 
@@ -91,12 +179,15 @@ class AvatarManager:
     def get_user_avatar_base64(self) -> str:
         """获取用户头像的base64编码"""
         try:
-            user_avatar_path = self.avatar_dir / "default_user.png"
-            if user_avatar_path.exists():
-                with open(user_avatar_path, "rb") as f:
-                    return f"data:image/png;base64,{base64.b64encode(f.read()).decode()}"
+            data_uri = get_cached_avatar(self.avatar_dir / "default_user.png")
+            if data_uri:
+                return data_uri
         except Exception as e:
             print(f"获取用户头像错误: {str(e)}")
 
         # 如果没有找到用户头像，返回默认的用户头像base64编码
         return "data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAADIAAAAyBAMAAADsEZWCAAAAG1BMVEVHcEz///////////////////////////8b/+NWAAAACXBIWXMAAAsTAAALEwEAmpwYAAAAO0lEQVQ4jWNgGAWjgP6AEcJ0/ACTZQQxHYHsDiCTEch0ALKZgUwmIM0IYTqAQADFZIIwmUBMRlrEjgIA7wgRTqrTlx4AAAAASUVORK5CYII="
+
+
+if __name__ == "__main__":
+    print(f"已生成头像清单: {build_avatar_manifest()}")
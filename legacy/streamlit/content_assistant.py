@@ -1,9 +1,10 @@
 import streamlit as st
 from utils import (
     generate_script,
-    generate_xiaohongshu_content,
+    stream_xiaohongshu_content,
     create_copy_button
 )
+from batch_generation import XiaohongshuBatch, load_batch_themes, BATCH_WORKERS_PER_KEY
 
 
 def render_script_generator():
@@ -148,20 +149,31 @@ def render_xiaohongshu_generator():
             st.error("⚠️ 请输入文案主题")
             st.stop()
 
+        # 标题一生成就先展示，正文完成后再展示完整结果
+        titles_placeholder = st.empty()
         with st.spinner(f"🎯 正在生成小红书文案，请稍后..."):
             try:
-                result = generate_xiaohongshu_content(
-                    theme=theme,
-                    model_type=current_model,
-                    api_key=st.session_state.api_keys[current_model],
-                    temperature=temperature
-                )
-
+                streamed_titles = []
+                for kind, value in stream_xiaohongshu_content(
+                        theme=theme,
+                        model_type=current_model,
+                        api_key=st.session_state.api_keys[current_model],
+                        temperature=temperature
+                ):
+                    if kind == "title":
+                        streamed_titles.append(value)
+                        titles_placeholder.markdown(
+                            "\n".join(f"{i}. {title}" for i, title in enumerate(streamed_titles, 1))
+                        )
+                    else:
+                        st.session_state.xiaohongshu_result = value
+                        st.session_state.selected_title_index = 0
+
+                titles_placeholder.empty()
                 st.success("✅ 小红书文案已生成！")
-                st.session_state.xiaohongshu_result = result
-                st.session_state.selected_title_index = 0
 
             except Exception as e:
+                titles_placeholder.empty()
                 st.error(f"❌ 生成失败：{str(e)}")
                 st.info("💡 请检查API密钥是否正确，或稍后重试")
 
@@ -206,6 +218,80 @@ def render_xiaohongshu_generator():
             key=f"copy_xiaohongshu_{hash(full_content)}"
         )
 
+    st.markdown("---")
+    with st.expander("📦 批量生成", expanded=False):
+        render_xiaohongshu_batch(temperature)
+
+
+def render_xiaohongshu_batch(temperature: float):
+    """Render Xiaohongshu batch generation interface"""
+    uploaded_file = st.file_uploader(
+        "上传主题文件（CSV 需包含 theme 或“主题”列；JSONL 每行一个主题）",
+        type=["csv", "jsonl"],
+        key="xiaohongshu_batch_file"
+    )
+
+    # 所有已验证的密钥一起分担批量任务
+    api_keys = {
+        model_type: key for model_type, key in st.session_state.api_keys.items()
+        if key and st.session_state.get(f"{model_type}_verified", False)
+    }
+    if not api_keys:
+        st.warning("⚠️ 请先在侧边栏验证至少一个API密钥")
+        return
+    if uploaded_file is None:
+        return
+
+    try:
+        items = load_batch_themes(uploaded_file.getvalue(), uploaded_file.name)
+    except (ValueError, UnicodeDecodeError) as e:
+        st.error(f"❌ 主题文件解析失败：{str(e)}")
+        return
+    if not items:
+        st.warning("⚠️ 文件中没有主题")
+        return
+
+    workers_per_key = st.slider(
+        "⚙️ 每个密钥的并发数",
+        min_value=1,
+        max_value=4,
+        value=BATCH_WORKERS_PER_KEY,
+        key="xiaohongshu_batch_workers"
+    )
+    batch = XiaohongshuBatch(items, api_keys, temperature=temperature, workers_per_key=workers_per_key)
+    done = len(items) - len(batch.pending())
+    st.caption(f"共 {len(items)} 个主题，使用 {len(api_keys)} 个密钥；已完成 {done} 个")
+
+    if st.button("🚀 开始批量生成" if done == 0 else "▶️ 继续批量生成",
+                 key="xiaohongshu_batch_btn",
+                 use_container_width=True,
+                 disabled=done == len(items)):
+        progress = st.progress(done / len(items))
+        status = st.empty()
+        failed = 0
+        for record in batch.run():
+            if record["status"] == "ok":
+                done += 1
+            else:
+                failed += 1
+            progress.progress(done / len(items))
+            status.caption(f"[{record['model']}] {record['theme']}：{'✅' if record['status'] == 'ok' else '❌ ' + record['error']}")
+        if failed:
+            st.warning(f"⚠️ {failed} 个主题生成失败，可点击继续重新生成")
+        else:
+            st.success("✅ 批量生成完成！")
+
+    data = batch.export_jsonl()
+    if data:
+        st.download_button(
+            "📥 下载结果 (JSONL)",
+            data=data,
+            file_name=f"xiaohongshu_{batch.job_id}.jsonl",
+            mime="application/jsonl",
+            key="xiaohongshu_batch_download",
+            use_container_width=True
+        )
+
 
 def render_content_assistant():
     """Render AI Writing Assistant main interface"""
@@ -1,4 +1,5 @@
 from typing import Dict
+from prompt_registry import register_template
 
 CONTRACT_TEMPLATES = {
     "房屋租赁合同": {
@@ -84,41 +85,8 @@ CONTRACT_TEMPLATES = {
 }
 
 
-def get_prompt_for_contract(template_type: str, details: Dict) -> str:
-    """根据模板类型和详情生成提示词"""
-
-    if template_type == "自定义合同":
-        prompt = f"""请根据以下信息生成一份专业的合同文本：
-
-合同名称：{details.get('合同名称', '合同')}
-
-合同双方信息：
-{details.get('合同双方信息', '')}
-
-合同主要内容：
-{details.get('合同主要内容', '')}
-
-"""
-        if details.get('特殊约定'):
-            prompt += f"""
-特殊约定：
-{details.get('特殊约定')}
-"""
-
-    else:
-        template = CONTRACT_TEMPLATES[template_type]
-        prompt = f"""请根据以下信息生成一份专业的{template['name']}：
-
-"""
-        # 添加所有字段信息
-        for field, value in details.items():
-            if isinstance(value, list):
-                value = '、'.join(value)
-            prompt += f"{field}：{value}\n"
-
-    # 添加通用的合同要求
-    prompt += """
-请生成一份完整的合同文本，包含以下部分：
+# 通用的合同要求，作为各合同模板静态前缀的一部分
+CONTRACT_REQUIREMENTS = """请生成一份完整的合同文本，包含以下部分：
 1. 合同标题
 2. 合同双方基本信息
 3. 合同标的
@@ -136,7 +104,50 @@ def get_prompt_for_contract(template_type: str, details: Dict) -> str:
 2. 权责明确，避免歧义
 3. 符合相关法律法规
 4. 适当引用法律依据
-5. 注意保护双方合法权益
-"""
+5. 注意保护双方合法权益"""
+
+_CONTRACT_STATIC = """请根据用户提供的信息生成一份专业的{contract_name}。
+
+{requirements}"""
+
+# 每种合同在导入时预编译，静态前缀只渲染一次
+CONTRACT_PROMPTS = {
+    template_type: register_template(
+        f"contract.{template_type}", _CONTRACT_STATIC, "{details}",
+        contract_name=template['name'], requirements=CONTRACT_REQUIREMENTS
+    )
+    for template_type, template in CONTRACT_TEMPLATES.items()
+}
+CONTRACT_PROMPTS["自定义合同"] = register_template(
+    "contract.自定义合同", _CONTRACT_STATIC, "{details}",
+    contract_name="合同文本", requirements=CONTRACT_REQUIREMENTS
+)
+
+
+def get_prompt_for_contract(template_type: str, details: Dict) -> str:
+    """根据模板类型和详情生成提示词"""
+
+    if template_type == "自定义合同":
+        details_text = f"""合同名称：{details.get('合同名称', '合同')}
+
+合同双方信息：
+{details.get('合同双方信息', '')}
+
+合同主要内容：
+{details.get('合同主要内容', '')}"""
+        if details.get('特殊约定'):
+            details_text += f"""
+
+特殊约定：
+{details.get('特殊约定')}"""
+
+    else:
+        # 添加所有字段信息
+        lines = []
+        for field, value in details.items():
+            if isinstance(value, list):
+                value = '、'.join(value)
+            lines.append(f"{field}：{value}")
+        details_text = "\n".join(lines)
 
-    return prompt
\ No newline at end of file
+    return CONTRACT_PROMPTS[template_type].render(details=details_text)
@@ -1,18 +1,25 @@
 import streamlit as st
 from utils import (
     verify_api_key,
-    get_chat_response
+    stream_chat_response,
+    get_hedge_targets
 )
-from langchain.memory import ConversationBufferMemory
+from chat_memory import create_chat_memory
 import streamlit.components.v1 as components
-from character_templates import CHARACTER_TEMPLATES
+from character_templates import CHARACTER_TEMPLATES, PERSONA_TOKENS
 from pathlib import Path
 import os
 import base64
-from components.avatar_manager import AvatarManager
+from components.avatar_manager import AvatarManager, AVATAR_DISPLAY_SIZE
 from content_assistant import render_content_assistant
 from medical_assistant import render_medical_assistant
 from legal_assistant import render_legal_assistant
+from response_cache import get_response_cache, get_single_flight
+from api_clients import get_hedge_stats, get_prompt_cache_stats, verify_api_keys_async
+from circuit_breaker import get_circuit_states, is_provider_available
+from prompt_template import TRAVEL_PROMPTS
+from retry_policy import FEATURE_DEADLINES, request_deadline
+from welcome_pool import get_welcome_pool
 
 
 # 初始化头像管理器
@@ -58,6 +65,39 @@ if 'api_keys' not in st.session_state:
         'glm': st.secrets.get("api_keys", {}).get("glm", "")
     }
 
+# 启动时在后台并发验证已配置的密钥（结果按密钥缓存，重复会话不会再次请求），
+# 不阻塞首屏渲染
+if 'startup_verification' not in st.session_state:
+    st.session_state.startup_verification = (
+        dict(st.session_state.api_keys),
+        verify_api_keys_async(st.session_state.api_keys)
+    )
+
+
+def apply_startup_verification() -> bool:
+    """后台验证完成后写入验证状态并预热开场白池，返回验证是否仍在进行"""
+    if st.session_state.get('startup_keys_verified'):
+        return False
+    verified_keys, future = st.session_state.startup_verification
+    if not future.done():
+        return True
+    for model_key, (is_valid, _) in future.result().items():
+        # 验证期间手动验证过或修改过的密钥，以当前状态为准
+        if (f"{model_key}_verified" not in st.session_state
+                and st.session_state.api_keys.get(model_key) == verified_keys[model_key]):
+            st.session_state[f"{model_key}_verified"] = is_valid
+    # 预热开场白池：缺失或过期的 (人设, 模型) 在后台生成并写入磁盘
+    get_welcome_pool().warm_up(
+        {model_key: key for model_key, key in st.session_state.api_keys.items()
+         if st.session_state.get(f"{model_key}_verified")},
+        [char for char in CHARACTER_TEMPLATES if char not in ["AI助手", "默认"]]
+    )
+    st.session_state.startup_keys_verified = True
+    return False
+
+
+startup_verifying = apply_startup_verification()
+
 # 初始化其他 session state 变量
 if 'use_env_qwen_key' not in st.session_state:
     st.session_state.use_env_qwen_key = False
@@ -120,13 +160,40 @@ with st.sidebar:
         }
     }
 
+    # 熔断中的模型在下拉框中标注出来
+    circuit_states = get_circuit_states()
+
+    def format_model_option(option: str) -> str:
+        state = circuit_states.get(model_info[option]['key'], {}).get('state')
+        if state == "open":
+            return f"{option}（暂不可用）"
+        if state == "half_open":
+            return f"{option}（恢复中）"
+        return option
+
+    def switch_model(option: str) -> None:
+        st.session_state.model_select = option
+
     # 模型选择下拉框
     model_type = st.selectbox(
         "选择AI模型",
         list(model_info.keys()),
-        key="model_select"
+        key="model_select",
+        format_func=format_model_option
     )
 
+    # 当前模型熔断时提示，并提供切换到其他已验证模型的入口
+    provider_state = circuit_states.get(model_info[model_type]['key'])
+    if provider_state and provider_state['state'] == "open":
+        st.warning(f"⚠️ {model_type} 服务暂时不可用，约{provider_state['retry_in']:.0f}秒后自动恢复探测")
+        alternatives = [
+            name for name, info in model_info.items()
+            if name != model_type and is_provider_available(info['key'])
+            and st.session_state.get(f"{info['key']}_verified", False)
+        ]
+        if alternatives:
+            st.button(f"🔀 切换到 {alternatives[0]}", on_click=switch_model, args=(alternatives[0],))
+
     # 显示模型详细信息
     st.caption(f"**当前模型**: {model_info[model_type]['model_name']}")
     st.caption(f"**模型说明**: {model_info[model_type]['description']}")
@@ -135,6 +202,16 @@ with st.sidebar:
     st.markdown("---")
     st.subheader("🔑 API密钥配置")
 
+    if startup_verifying:
+        # 后台验证完成后整页重跑，显示验证结果；之后不再轮询
+        @st.fragment(run_every=1)
+        def startup_verification_status():
+            if st.session_state.startup_verification[1].done():
+                st.rerun()
+            st.caption("⏳ 正在后台验证已配置的密钥...")
+
+        startup_verification_status()
+
     # 获取当前选中的模型信息
     model_key = model_info[model_type]['key']
     key_label = model_info[model_type]['api_label']
@@ -216,11 +293,32 @@ with st.sidebar:
                 st.session_state.api_keys[model_key] = api_key
                 st.success("✅ 密钥已保存！")
 
+    # 对冲请求：聊天等流式功能在当前模型首 token 过慢时，由其他已验证的模型兜底
+    st.checkbox(
+        "⚡ 对冲请求",
+        key="hedge_enabled",
+        help="当前模型响应过慢时，同时请求其他已验证密钥的模型，采用最先开始输出的回复"
+    )
+
     # 更新模型状态
     previous_model = st.session_state.get('previous_model_type', None)
     current_model = model_mapping[model_type][0]
     st.session_state['current_model_type'] = current_model
 
+    # 响应缓存统计
+    cache_stats = get_response_cache().stats()
+    st.caption(f"响应缓存：命中 {cache_stats['hits']} 次 / 未命中 {cache_stats['misses']} 次")
+    st.caption(f"合并的重复请求：{get_single_flight().stats()['shared']} 次")
+
+    # 对冲请求统计（仅在使用过对冲模式后显示）
+    for provider, stats in get_hedge_stats().snapshot().items():
+        first_token = f"{stats['first_token_p95']:.1f}s" if stats['first_token_p95'] is not None else "-"
+        st.caption(f"对冲 {provider}：胜 {stats['wins']} / 负 {stats['losses']} / 失败 {stats['errors']}，首 token P95 {first_token}")
+
+    # 各功能的 provider 提示词缓存命中率（按响应中的用量统计）
+    for feature, stats in sorted(get_prompt_cache_stats().snapshot().items()):
+        st.caption(f"提示词缓存 {feature}：命中 {stats['hits']}/{stats['requests']} 次，缓存 token {stats['token_hit_rate']:.0%}")
+
 def create_copy_button(text: str, button_text: str = "📋 复制到剪贴板", key: str = None) -> None:
     """使用 JavaScript 实现的复制功能"""
     if key not in st.session_state:
@@ -278,7 +376,7 @@ def get_welcome_message(character_type: str, model_type: str = None) -> str:
         model_type: 模型类型（如"qwen", "chatgpt", "claude", "glm"）
 
     Returns:
-        str: 生成的欢迎消息
+        str: 欢迎消息
     """
     if character_type == "AI助手" and model_type:
         model_display_names = {
@@ -289,38 +387,9 @@ def get_welcome_message(character_type: str, model_type: str = None) -> str:
         }
         model_name = model_display_names.get(model_type, "AI")
         return f"你好，我是由{model_name}驱动的AI助手，请问有什么可以帮你的吗？"
-    elif character_type in CHARACTER_TEMPLATES:
-        # 构建人设提示词
-        character = CHARACTER_TEMPLATES[character_type]
-        prompt = f"""
-你现在是一个{character['name']}。
-
-个性特点：
-{character['personality']}
-
-请根据以上人设，生成一个独特的开场白（不超过50字），展现你的性格特点。直接输出开场白内容，不需要任何解释。
-"""
-        try:
-            # 获取当前选择的模型类型和API密钥
-            current_model_key = st.session_state.get('current_model_type')
-            api_key = st.session_state.api_keys.get(current_model_key)
-
-            # 使用AI生成开场白
-            response = get_chat_response(
-                prompt=prompt,
-                memory=None,
-                model_type=current_model_key,
-                api_key=api_key,
-                character_type=None,
-                is_chat_feature=False
-            )
-            return response.strip()
-        except Exception as e:
-            print(f"生成开场白失败: {str(e)}")
-            # 如果AI生成失败，使用默认开场白
-            return f"你好，我是{character['name']}，有什么可以帮你的吗？"
-
-    return "你好，我是AI助手，有什么可以帮你的吗？"
+    # 从预生成的开场白池中随机取一条，不发起模型请求；池为空或过期时在后台刷新
+    model_type = model_type or st.session_state.get('current_model_type')
+    return get_welcome_pool().get(character_type, model_type, st.session_state.api_keys.get(model_type))
 
 # 主界面标签页配置
 tabs = st.tabs([
@@ -332,8 +401,10 @@ tabs = st.tabs([
 ])
 
 # AI写作标签页
+# 每个功能入口设置总截止时间，排队、重试与分块请求都不会超过它
 with tabs[0]:
-    render_content_assistant()
+    with request_deadline(FEATURE_DEADLINES["writing"]):
+        render_content_assistant()
 
 # AI聊天标签页
 with tabs[1]:
@@ -350,6 +421,8 @@ with tabs[1]:
             ["AI助手"] + [char for char in CHARACTER_TEMPLATES.keys() if char not in ["AI助手", "默认"]],
             key="character_select"
         )
+        if st.session_state.selected_character in PERSONA_TOKENS:
+            st.caption(f"人设提示词约 {PERSONA_TOKENS[st.session_state.selected_character]} tokens（已缓存）")
 
         # 获取当前选择的模型类型
         current_model = model_mapping[model_type][0]
@@ -357,20 +430,16 @@ with tabs[1]:
         # 检测人设是否改变
         if previous_character != st.session_state.selected_character:
             if st.session_state.selected_character not in st.session_state.character_messages:
-                # 获取欢迎消息（使用AI生成）
-                with st.spinner("正在准备角色..."):
-                    welcome_msg = get_welcome_message(st.session_state.selected_character, current_model)
+                # 获取欢迎消息（从预生成的开场白池中选取）
+                welcome_msg = get_welcome_message(st.session_state.selected_character, current_model)
 
                 # 初始化新人设的消息和记忆
                 st.session_state.character_messages[st.session_state.selected_character] = [
                     {"role": "assistant", "content": welcome_msg}
                 ]
                 # 创建新的记忆实例
-                st.session_state.character_memories[st.session_state.selected_character] = ConversationBufferMemory(
-                    return_messages=True,
-                    memory_key="chat_history",
-                    input_key="input",
-                    output_key="output"
+                st.session_state.character_memories[st.session_state.selected_character] = create_chat_memory(
+                    st.session_state.selected_character
                 )
 
         if st.session_state.selected_character != "AI助手":
@@ -398,6 +467,49 @@ with tabs[1]:
         return ""
 
     with col1:
+        def assistant_message_html(content: str, current_model: str) -> str:
+            """生成AI回复气泡的HTML"""
+            avatar_html = f'<img src="{avatar_manager.get_avatar_base64(st.session_state.selected_character, current_model)}" style="width: {AVATAR_DISPLAY_SIZE}px; height: {AVATAR_DISPLAY_SIZE}px; border-radius: {AVATAR_DISPLAY_SIZE // 2}px; margin-right: 10px;">'
+
+            # 为AI助手使用特殊的样式
+            if st.session_state.selected_character == "AI助手":
+                model_styles = {
+                    "qwen": ("#e6f3ff", "#0077cc"),  # 通义千问的蓝色主题
+                    "chatgpt": ("#e9f7ef", "#28a745"),  # ChatGPT的绿色主题
+                    "claude": ("#f5e6ff", "#6f42c1"),  # Claude的紫色主题
+                    "glm": ("#fff3e6", "#fd7e14")  # GLM的橙色主题
+                }
+                style = model_styles.get(current_model, ("#f0f2f6", "#1a1a1a"))
+                name_suffix = f" ({model_display_names.get(current_model, 'AI')})"
+                character_name = "AI助手" + name_suffix
+            else:
+                # 其他角色使用原有的样式
+                character_styles = {
+                    "温柔知性大姐姐": ("#f8e1e7", "#d35d90"),
+                    "暴躁顶撞纹身男": ("#ffe4e1", "#ff4500"),
+                    "呆呆萌萌萝莉妹": ("#ffebcd", "#ff69b4"),
+                    "高冷霸道男总裁": ("#e6e6fa", "#483d8b"),
+                    "阳光开朗小奶狗": ("#fff8dc", "#ffa500"),
+                    "英姿飒爽女王大人": ("#e6e6fa", "#800080"),
+                    "性感冷艳御姐": ("#FFE4E1", "#800020"),
+                }
+                style = character_styles.get(st.session_state.selected_character, ("#f0f2f6", "#1a1a1a"))
+                character_name = CHARACTER_TEMPLATES[st.session_state.selected_character]["name"]
+
+            return f"""
+                            <div style="display: flex; justify-content: flex-start; align-items: flex-start; margin: 10px 0;">
+                                {avatar_html}
+                                <div style="max-width: 80%;">
+                                    <div style="font-size: 12px; color: {style[1]}; margin-bottom: 5px;">
+                                        {character_name}
+                                    </div>
+                                    <div style="background-color: {style[0]}; color: {style[1]}; border-radius: 20px; padding: 15px;">
+                                        {content}
+                                    </div>
+                                </div>
+                            </div>
+                            """
+
         def render_chat_interface():
             chat_container = st.container()
             current_model = st.session_state.get('current_model_type')
@@ -411,19 +523,9 @@ with tabs[1]:
                 for idx, message in enumerate(messages):
                     is_user = message["role"] == "user"
 
-                    # 获取头像
-                    if is_user:
-                        avatar_html = f'<img src="{avatar_manager.get_user_avatar_base64()}" style="width: 40px; height: 40px; border-radius: 20px;'
-                    else:
-                        avatar_html = f'<img src="{avatar_manager.get_avatar_base64(st.session_state.selected_character, current_model)}" style="width: 40px; height: 40px; border-radius: 20px;'
-
-                    if is_user:
-                        avatar_html += ' margin-left: 10px;">'
-                    else:
-                        avatar_html += ' margin-right: 10px;">'
-
                     # 设置消息样式
                     if is_user:
+                        avatar_html = f'<img src="{avatar_manager.get_user_avatar_base64()}" style="width: {AVATAR_DISPLAY_SIZE}px; height: {AVATAR_DISPLAY_SIZE}px; border-radius: {AVATAR_DISPLAY_SIZE // 2}px; margin-left: 10px;">'
                         st.markdown(
                             f"""
                             <div style="display: flex; justify-content: flex-end; align-items: flex-start; margin: 10px 0;">
@@ -439,50 +541,12 @@ with tabs[1]:
                             unsafe_allow_html=True
                         )
                     else:
-                        # 为AI助手使用特殊的样式
-                        if st.session_state.selected_character == "AI助手":
-                            model_styles = {
-                                "qwen": ("#e6f3ff", "#0077cc"),  # 通义千问的蓝色主题
-                                "chatgpt": ("#e9f7ef", "#28a745"),  # ChatGPT的绿色主题
-                                "claude": ("#f5e6ff", "#6f42c1"),  # Claude的紫色主题
-                                "glm": ("#fff3e6", "#fd7e14")  # GLM的橙色主题
-                            }
-                            style = model_styles.get(current_model, ("#f0f2f6", "#1a1a1a"))
-                            name_suffix = f" ({model_display_names.get(current_model, 'AI')})"
-                            character_name = "AI助手" + name_suffix
-                        else:
-                            # 其他角色使用原有的样式
-                            character_styles = {
-                                "温柔知性大姐姐": ("#f8e1e7", "#d35d90"),
-                                "暴躁顶撞纹身男": ("#ffe4e1", "#ff4500"),
-                                "呆呆萌萌萝莉妹": ("#ffebcd", "#ff69b4"),
-                                "高冷霸道男总裁": ("#e6e6fa", "#483d8b"),
-                                "阳光开朗小奶狗": ("#fff8dc", "#ffa500"),
-                                "英姿飒爽女王大人": ("#e6e6fa", "#800080"),
-                                "性感冷艳御姐": ("#FFE4E1", "#800020"),
-                            }
-                            style = character_styles.get(st.session_state.selected_character, ("#f0f2f6", "#1a1a1a"))
-                            character_name = CHARACTER_TEMPLATES[st.session_state.selected_character]["name"]
-
                         st.markdown(
-                            f"""
-                            <div style="display: flex; justify-content: flex-start; align-items: flex-start; margin: 10px 0;">
-                                {avatar_html}
-                                <div style="max-width: 80%;">
-                                    <div style="font-size: 12px; color: {style[1]}; margin-bottom: 5px;">
-                                        {character_name}
-                                    </div>
-                                    <div style="background-color: {style[0]}; color: {style[1]}; border-radius: 20px; padding: 15px;">
-                                        {message["content"]}
-                                    </div>
-                                </div>
-                            </div>
-                            """,
+                            assistant_message_html(message["content"], current_model),
                             unsafe_allow_html=True
                         )
 
 
-
         def handle_input():
             """处理用户输入的函数"""
             if st.session_state.user_input and st.session_state.user_input.strip():
@@ -498,45 +562,68 @@ with tabs[1]:
                     "content": user_input
                 })
 
-                try:
-                    # 获取当前模型信息
-                    current_model_key = model_mapping[model_type][0]
-                    api_key = st.session_state.api_keys[current_model_key]
-
-                    # 确保记忆存在
-                    if current_character not in st.session_state.character_memories:
-                        st.session_state.character_memories[current_character] = ConversationBufferMemory(
-                            return_messages=True,
-                            memory_key="chat_history",
-                            input_key="input",
-                            output_key="output"
-                        )
+                # 回调中无法渲染流式输出，记录待回复的消息，由主流程在对话下方流式生成
+                st.session_state.pending_chat_input = {
+                    "character": current_character,
+                    "content": user_input
+                }
+
+                # 清空输入框
+                st.session_state.user_input = ""
+
+        def stream_pending_reply():
+            """流式生成待回复消息的AI响应"""
+            pending = st.session_state.pop('pending_chat_input', None)
+            if not pending or pending["character"] != st.session_state.selected_character:
+                return
+
+            current_character = pending["character"]
+            try:
+                # 获取当前模型信息
+                current_model_key = model_mapping[model_type][0]
+                api_key = st.session_state.api_keys[current_model_key]
+
+                # 确保记忆存在
+                if current_character not in st.session_state.character_memories:
+                    st.session_state.character_memories[current_character] = create_chat_memory(current_character)
 
-                    # 获取AI响应
-                    response = get_chat_response(
-                        prompt=user_input,
+                # 获取AI响应，逐段刷新回复气泡
+                placeholder = st.empty()
+                response = ""
+                for delta in stream_chat_response(
+                        prompt=pending["content"],
                         memory=st.session_state.character_memories[current_character],
                         model_type=current_model_key,
                         api_key=api_key,
                         character_type=current_character if current_character != "默认" else None,
-                        is_chat_feature=True
+                        is_chat_feature=True,
+                        hedge_with=get_hedge_targets(current_model_key)
+                ):
+                    response += delta
+                    placeholder.markdown(
+                        assistant_message_html(response + "▌", current_model_key),
+                        unsafe_allow_html=True
                     )
-                    # 添加AI响应到历史记录
-                    st.session_state.character_messages[current_character].append({
-                        "role": "assistant",
-                        "content": response
-                    })
+                placeholder.markdown(
+                    assistant_message_html(response, current_model_key),
+                    unsafe_allow_html=True
+                )
 
-                except Exception as e:
-                    st.error(f"获取响应失败: {str(e)}")
+                # 添加AI响应到历史记录
+                st.session_state.character_messages[current_character].append({
+                    "role": "assistant",
+                    "content": response
+                })
 
-                # 清空输入框
-                st.session_state.user_input = ""
+            except Exception as e:
+                st.error(f"获取响应失败: {str(e)}")
 
 
         # 显示对话界面
         if st.session_state.selected_character in st.session_state.character_messages:
             render_chat_interface()
+            with request_deadline(FEATURE_DEADLINES["chat"]):
+                stream_pending_reply()
 
             # 输入框和按钮布局
             col_input, col_button = st.columns([6, 1])
@@ -562,8 +649,8 @@ with tabs[1]:
             if st.button("🗑️", help="清空当前对话"):
                 if st.session_state.selected_character in st.session_state.character_messages:
                     # 获取欢迎消息
-                    character = CHARACTER_TEMPLATES[st.session_state.selected_character]
-                    welcome_msg = f"你好，我是{character['name']}，有什么可以帮你的吗？"
+                    welcome_msg = get_welcome_message(st.session_state.selected_character,
+                                                      model_mapping[model_type][0])
 
                     # 重置消息历史
                     st.session_state.character_messages[st.session_state.selected_character] = [
@@ -571,11 +658,8 @@ with tabs[1]:
                     ]
 
                     # 重置记忆
-                    st.session_state.character_memories[st.session_state.selected_character] = ConversationBufferMemory(
-                        return_messages=True,
-                        memory_key="chat_history",
-                        input_key="input",
-                        output_key="output"
+                    st.session_state.character_memories[st.session_state.selected_character] = create_chat_memory(
+                        st.session_state.selected_character
                     )
                     st.rerun()
 
@@ -668,112 +752,34 @@ with tabs[2]:
                 # 构建提示词
                 days = (end_date - start_date).days + 1
 
-                if selected_function == "行程规划":
-                    prompt = f"""请帮我规划一个{destination}的{days}天行程。
-具体信息如下：
-- 出行日期：{start_date} 到 {end_date}
-- 预算：{budget}元
-- 出行人数：{travelers}人
-- 偏好：{', '.join(preferences)}
-
-请提供详细的行程安排，包括：
-1. 每天的行程安排（景点、用餐、休息等）
-2. 建议游玩时长
-3. 交通方式建议
-4. 用餐和休息时间安排
-5. 注意事项和建议
-
-请确保行程合理，充分考虑游玩时间和交通时间。"""
-
-                elif selected_function == "交通建议":
-                    prompt = f"""请为我推荐去{destination}的最佳交通方式。
-具体信息如下：
-- 出行日期：{start_date}
-- 出行人数：{travelers}人
-- 预算：{budget}元
-
-请提供以下信息：
-1. 不同交通方式的对比（飞机、高铁、大巴等）
-2. 各种交通方式的大概价格
-3. 最优交通方案建议
-4. 当地交通卡办理建议
-5. 从机场/车站到市区的交通建议"""
-
-                elif selected_function == "住宿推荐":
-                    prompt = f"""请为我在{destination}推荐合适的住宿。
-具体信息如下：
-- 入住日期：{start_date} 到 {end_date}
-- 人数：{travelers}人
-- 预算：每晚{budget // days}元左右
-
-请提供以下信息：
-1. 推荐的住宿区域
-2. 不同价位的住宿选择
-3. 各类型住宿的优缺点
-4. 订房注意事项
-5. 具体住宿推荐（含预估价格）"""
-
-                elif selected_function == "美食指南":
-                    prompt = f"""请为我推荐{destination}的特色美食。
-具体信息如下：
-- 预算：人均{budget // days // travelers}元/天
-- 人数：{travelers}人
-
-请提供以下信息：
-1. 必尝特色美食清单
-2. 推荐餐厅和小吃街
-3. 各美食预估价格
-4. 用餐建议和注意事项
-5. 美食打卡地图规划"""
-
-                elif selected_function == "景点介绍":
-                    prompt = f"""请为我介绍{destination}的主要景点。
-
-请提供以下信息：
-1. 必游景点清单及门票价格
-2. 各景点游玩建议时长
-3. 最佳游玩时间
-4. 门票预订建议
-5. 景点之间的交通安排"""
-
-                elif selected_function == "天气查询":
-                    prompt = f"""请为我介绍{destination}的天气情况。
-计划出行日期：{start_date} 到 {end_date}
-
-请提供以下信息：
-1. 当地天气特点
-2. 建议携带的衣物
-3. 天气对行程的影响
-4. 出行建议
-5. 必备物品清单"""
-
-                else:  # 花费预估
-                    prompt = f"""请帮我预估在{destination}旅行的整体费用。
-具体信息如下：
-- 出行日期：{start_date} 到 {end_date}
-- 人数：{travelers}人
-- 总预算：{budget}元
-- 偏好：{', '.join(preferences)}
-
-请提供以下信息：
-1. 交通费用预估
-2. 住宿费用预估
-3. 餐饮费用预估
-4. 门票费用预估
-5. 其他费用预估（购物、娱乐等）
-6. 建议预留的额外费用
-7. 省钱建议和攻略"""
-
-                # 获取回复
-                response = get_chat_response(
-                    prompt=prompt,
-                    memory=None,
-                    model_type=current_model_key,
-                    api_key=st.session_state.api_keys[current_model_key],
-                    character_type=None,
-                    is_chat_feature=False
+                # 各功能的模板只使用自己需要的槽位
+                prompt = TRAVEL_PROMPTS[selected_function].render(
+                    destination=destination,
+                    days=days,
+                    start_date=start_date,
+                    end_date=end_date,
+                    budget=budget,
+                    nightly_budget=budget // max(days, 1),
+                    daily_budget_per_person=budget // max(days, 1) // travelers,
+                    travelers=travelers,
+                    preferences=', '.join(preferences)
                 )
 
+                # 流式获取回复，生成过程中实时显示，完成后交给下方结果区统一展示
+                stream_area = st.empty()
+                with stream_area.container(), request_deadline(FEATURE_DEADLINES["travel"]):
+                    response = st.write_stream(stream_chat_response(
+                        prompt=prompt,
+                        memory=None,
+                        model_type=current_model_key,
+                        api_key=st.session_state.api_keys[current_model_key],
+                        character_type=None,
+                        is_chat_feature=False,
+                        use_cache=True,
+                        hedge_with=get_hedge_targets(current_model_key)
+                    ))
+                stream_area.empty()
+
                 # 保存响应到 session state
                 st.session_state.travel_response = response
 
@@ -800,27 +806,6 @@ with tabs[2]:
         )
 
 
-    if generate_btn:
-        # ... (保留生成逻辑代码)
-        with st.spinner(f"🎯 正在为您规划{destination}之旅..."):
-            try:
-                # ... (保留现有的生成逻辑)
-                response = get_chat_response(
-                    prompt=prompt,
-                    memory=None,
-                    model_type=current_model_key,
-                    api_key=st.session_state.api_keys[current_model_key],
-                    character_type=None,
-                    is_chat_feature=False
-                )
-
-                # 保存响应到 session state
-                st.session_state.travel_response = response
-
-            except Exception as e:
-                st.error(f"生成失败：{str(e)}")
-                st.info("💡 请检查输入内容是否完整，或稍后重试")
-
     # 修改后的显示结果部分
     if st.session_state.travel_response:
         st.markdown("---")
@@ -841,9 +826,11 @@ with tabs[2]:
         """)
 
 with tabs[3]:
-    render_medical_assistant()
+    with request_deadline(FEATURE_DEADLINES["medical"]):
+        render_medical_assistant()
 
 with tabs[4]:
     from legal_assistant import render_legal_assistant
-    render_legal_assistant()
+    with request_deadline(FEATURE_DEADLINES["legal"]):
+        render_legal_assistant()
 
@@ -1,3 +1,4 @@
+import hashlib
 import streamlit as st
 import streamlit.components.v1 as components
 from utils import (
@@ -6,7 +7,8 @@ from utils import (
     analyze_legal_document,
     get_legal_advice,
     analyze_legal_risk,
-    extract_text_from_image
+    extract_text_from_image,
+    extract_texts_from_images
 )
 
 
@@ -77,21 +79,28 @@ def create_copy_button(text: str, button_text: str = "📋 复制到剪贴板",
     st.components.v1.html(js_code + html_button, height=80)
 
 
+def content_digest(file_content: bytes) -> str:
+    """上传文件的内容哈希，用于去重和复用提取结果"""
+    return hashlib.sha256(file_content).hexdigest()
+
+
+def is_uploaded_image(digest: str) -> bool:
+    """检查相同内容的图片是否已经上传过（与文件名无关）"""
+    return any(existing_image.get('hash') == digest for existing_image in st.session_state.uploaded_images)
+
+
 def handle_uploaded_image(uploaded_image):
     """处理上传的图片"""
     if not uploaded_image:
         return None
 
-    # 检查是否为新图片
-    for existing_image in st.session_state.uploaded_images:
-        if (uploaded_image.name == existing_image['name'] and
-                uploaded_image.size == existing_image['size']):
-            return None
-
     # 读取图片内容
-    image_content = uploaded_image.read()
-    # 重置文件指针
-    uploaded_image.seek(0)
+    image_content = uploaded_image.getvalue()
+
+    # 检查是否为新图片
+    digest = content_digest(image_content)
+    if is_uploaded_image(digest):
+        return None
 
     try:
         # 使用GLM-4V-Flash模型提取文字
@@ -104,6 +113,7 @@ def handle_uploaded_image(uploaded_image):
         new_image = {
             'name': uploaded_image.name,
             'size': uploaded_image.size,
+            'hash': digest,
             'content': uploaded_image,
             'text': text,
             'order': len(st.session_state.uploaded_images)
@@ -116,6 +126,42 @@ def handle_uploaded_image(uploaded_image):
         return None
 
 
+def ocr_uploaded_images(indices):
+    """并发识别指定下标的已上传图片，逐页显示进度并按原页序回填识别结果"""
+    images = st.session_state.uploaded_images
+    indices = [idx for idx in indices if idx < len(images)]
+    if not indices:
+        return
+
+    progress = st.progress(0.0, text=f"正在识别图片文字 (0/{len(indices)})...")
+    page_status = st.empty()
+    for idx in indices:
+        images[idx]['status'] = 'pending'
+        images[idx]['error'] = None
+
+    finished = 0
+    results = extract_texts_from_images(
+        [images[idx]['content'].getvalue() for idx in indices],
+        api_key=st.session_state.api_keys.get('glm', '')
+    )
+    for position, text, error in results:
+        idx = indices[position]
+        finished += 1
+        if error is None:
+            images[idx]['status'] = 'done'
+            images[idx]['text'] = text
+            st.session_state.image_texts[idx] = text
+            page_status.caption(f"✅ 第{idx + 1}页识别完成")
+        else:
+            images[idx]['status'] = 'error'
+            images[idx]['error'] = error
+            page_status.caption(f"❌ 第{idx + 1}页识别失败")
+        progress.progress(finished / len(indices), text=f"正在识别图片文字 ({finished}/{len(indices)})...")
+
+    progress.empty()
+    page_status.empty()
+
+
 def render_legal_assistant():
     st.header("⚖️ 政法助手")
 
@@ -162,10 +208,23 @@ def render_legal_assistant():
 
             if uploaded_file is not None:
                 try:
-                    if uploaded_file.type == "application/pdf":
-                        text = extract_text_from_pdf(uploaded_file.getvalue())
-                    else:
-                        text = extract_text_from_docx(uploaded_file.getvalue())
+                    # 同一文件只提取一次，页面重跑时直接复用提取结果
+                    file_content = uploaded_file.getvalue()
+                    digest = content_digest(file_content)
+                    extracted = st.session_state.get('extracted_document')
+                    if not extracted or extracted['digest'] != digest:
+                        with st.spinner("正在提取文档文本..."):
+                            if uploaded_file.type == "application/pdf":
+                                # 扫描版PDF中没有文本层的页面回退到OCR识别
+                                text = extract_text_from_pdf(
+                                    file_content,
+                                    ocr_api_key=st.session_state.api_keys.get('glm', '')
+                                )
+                            else:
+                                text = extract_text_from_docx(file_content)
+                        extracted = {'digest': digest, 'text': text}
+                        st.session_state.extracted_document = extracted
+                    text = extracted['text']
                     st.session_state.document_text = text
                     with st.expander("查看提取的文本"):
                         st.text_area("文档内容", text, height=300)
@@ -173,49 +232,35 @@ def render_legal_assistant():
                     st.error(f"文件处理失败: {str(e)}")
 
         else:  # 图片文件上传
-            # 添加单个图片上传器
-            uploaded_image = st.file_uploader(
-                "上传合同或法律文书照片 (支持JPG、PNG格式)",
+            # 图片上传器，支持一次选择多页
+            uploaded_images = st.file_uploader(
+                "上传合同或法律文书照片 (支持JPG、PNG格式，可多选)",
                 type=['jpg', 'jpeg', 'png'],
-                key="single_image_uploader"
+                accept_multiple_files=True,
+                key="image_uploader"
             )
 
-            # 如果有新图片上传，添加到列表中
-            if uploaded_image is not None:
-                # 检查是否为新图片
-                is_new_image = True
-                for existing_image in st.session_state.uploaded_images:
-                    if (uploaded_image.name == existing_image['name'] and
-                            uploaded_image.size == existing_image['size']):
-                        is_new_image = False
-                        break
-
-                if is_new_image:
-                    # 读取图片内容
-                    image_content = uploaded_image.read()
-                    # 重置文件指针
-                    uploaded_image.seek(0)
-
-                    with st.spinner("正在识别图片文字..."):
-                        try:
-                            # 使用GLM-4V-Flash模型提取文字
-                            text = extract_text_from_image(
-                                image_content=image_content,
-                                api_key=st.session_state.api_keys.get('glm', '')
-                            )
-
-                            # 保存图片信息和识别文本
-                            st.session_state.uploaded_images.append({
-                                'name': uploaded_image.name,
-                                'size': uploaded_image.size,
-                                'content': uploaded_image,
-                                'text': text,
-                                'order': len(st.session_state.uploaded_images)
-                            })
-                            st.session_state.image_texts.append(text)
-
-                        except Exception as e:
-                            st.error(f"处理图片时出错: {str(e)}")
+            # 新图片按上传顺序追加到列表末尾，然后一次性并发识别
+            new_indices = []
+            for uploaded_image in uploaded_images or []:
+                # 按内容哈希检查是否为新图片，同一扫描件改名后重新上传也会被识别
+                digest = content_digest(uploaded_image.getvalue())
+                if not is_uploaded_image(digest):
+                    new_indices.append(len(st.session_state.uploaded_images))
+                    st.session_state.uploaded_images.append({
+                        'name': uploaded_image.name,
+                        'size': uploaded_image.size,
+                        'hash': digest,
+                        'content': uploaded_image,
+                        'text': '',
+                        'status': 'pending',
+                        'error': None,
+                        'order': len(st.session_state.uploaded_images)
+                    })
+                    st.session_state.image_texts.append('')
+
+            if new_indices:
+                ocr_uploaded_images(new_indices)
 
             # 显示已上传的图片和排序控制
             if st.session_state.uploaded_images:
@@ -248,6 +293,13 @@ def render_legal_assistant():
                                  use_column_width=True)
 
                     with col3:
+                        # 识别失败的页面可以单独重试
+                        if image_data.get('status') == 'error':
+                            st.error(f"图片 {idx + 1} 识别失败: {image_data.get('error')}")
+                            if st.button("🔄 重试", key=f"retry_{idx}"):
+                                ocr_uploaded_images([idx])
+                                st.rerun()
+
                         # 显示识别的文本
                         with st.expander(f"查看图片 {idx + 1} 识别内容", expanded=False):
                             st.text_area(
@@ -264,11 +316,21 @@ def render_legal_assistant():
                             st.session_state.image_texts.pop(idx)
                             st.rerun()
 
-                # 合并所有识别文本
-                if st.session_state.image_texts:
+                failed_indices = [
+                    idx for idx, image_data in enumerate(st.session_state.uploaded_images)
+                    if image_data.get('status') == 'error'
+                ]
+                if len(failed_indices) > 1:
+                    if st.button(f"🔄 重试全部失败页面 ({len(failed_indices)})", use_container_width=True):
+                        ocr_uploaded_images(failed_indices)
+                        st.rerun()
+
+                # 合并所有识别文本（跳过识别失败的页面）
+                if any(st.session_state.image_texts):
                     combined_text = "\n\n".join([
                         f"=== 第{i + 1}页 ===\n{text}"
                         for i, text in enumerate(st.session_state.image_texts)
+                        if st.session_state.uploaded_images[i].get('status') != 'error'
                     ])
                     st.session_state.document_text = combined_text
 
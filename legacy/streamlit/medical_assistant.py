@@ -1,13 +1,35 @@
 import streamlit as st
-from typing import Dict, List, Optional
-from utils import get_chat_response, create_copy_button
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+from utils import get_chat_response, stream_chat_response, create_copy_button, get_hedge_targets
+from prompt_registry import register_template
+from retry_policy import submit_in_context
 from datetime import datetime
 
+# 病情总结在后台增量生成：对话达到最少消息数后，每积累一轮新对话、且距上次提交
+# 超过去抖间隔才提交一次；任务进行中的新对话会合并到下一次任务里
+SUMMARY_MIN_MESSAGES = 4
+SUMMARY_DEBOUNCE_SECONDS = 10
+SUMMARY_POLL_SECONDS = 2
+_summary_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="case-summary")
+
+
+def _run_medical_prompt(prompt: str, model_type: str, api_key: str, stream: bool = False):
+    """执行医疗提示词，stream 为 True 时返回逐段输出文本的生成器"""
+    respond = stream_chat_response if stream else get_chat_response
+    return respond(
+        prompt=prompt,
+        memory=None,
+        model_type=model_type,
+        api_key=api_key,
+        is_chat_feature=False,
+        use_cache=True
+    )
 
-def query_symptoms(symptoms: str, model_type: str, api_key: str) -> Dict:
-    """查询症状分析"""
-    prompt = f"""请作为一个专业的医生，对以下症状进行分析：
-{symptoms}
+
+# 提示词模板：静态的角色与输出要求在前，患者信息在后，同一功能的请求共享相同前缀
+SYMPTOMS_PROMPT = register_template("medical.symptoms", """请作为一个专业的医生，对用户提供的症状进行分析。
 
 请从以下几个方面进行详细分析：
 1. 可能的疾病：列出最可能的3-5种疾病
@@ -16,60 +38,23 @@ def query_symptoms(symptoms: str, model_type: str, api_key: str) -> Dict:
 4. 注意事项：需要特别注意的事项
 5. 生活建议：日常生活中的注意事项
 
-请注意：这只是初步分析，具体诊断需要医生面诊。"""
+请注意：这只是初步分析，具体诊断需要医生面诊。""", """症状：
+{symptoms}""")
 
-    try:
-        response = get_chat_response(
-            prompt=prompt,
-            memory=None,
-            model_type=model_type,
-            api_key=api_key,
-            is_chat_feature=False
-        )
-        return {'status': 'success', 'analysis': response}
-    except Exception as e:
-        return {'status': 'error', 'message': str(e)}
-
-
-def health_self_check(age: int, gender: str, conditions: List[str], model_type: str, api_key: str) -> Dict:
-    """健康自查分析"""
-    conditions_text = "\n".join([f"- {condition}" for condition in conditions])
-    prompt = f"""请作为一个专业的医生，为以下情况进行健康分析：
-
-基本信息：
-- 年龄：{age}岁
-- 性别：{gender}
-- 症状/状况：
-{conditions_text}
+HEALTH_CHECK_PROMPT = register_template("medical.health_check", """请作为一个专业的医生，为用户提供的情况进行健康分析。
 
 请提供以下分析：
 1. 健康风险评估
 2. 建议进行的体检项目
 3. 生活方式建议
 4. 预防保健措施
-5. 需要注意的健康警示"""
-
-    try:
-        response = get_chat_response(
-            prompt=prompt,
-            memory=None,
-            model_type=model_type,
-            api_key=api_key,
-            is_chat_feature=False
-        )
-        return {'status': 'success', 'analysis': response}
-    except Exception as e:
-        return {'status': 'error', 'message': str(e)}
-
-
-def suggest_medication(symptoms: str, age: int, allergies: str, model_type: str, api_key: str) -> Dict:
-    """药物建议"""
-    prompt = f"""请作为一个专业的医生，针对以下情况提供用药建议：
-
-患者情况：
+5. 需要注意的健康警示""", """基本信息：
 - 年龄：{age}岁
-- 症状：{symptoms}
-- 过敏史：{allergies if allergies else "无"}
+- 性别：{gender}
+- 症状/状况：
+{conditions}""")
+
+MEDICATION_PROMPT = register_template("medical.medication", """请作为一个专业的医生，针对用户提供的情况提供用药建议。
 
 请提供以下建议：
 1. 推荐药物类型
@@ -78,28 +63,12 @@ def suggest_medication(symptoms: str, age: int, allergies: str, model_type: str,
 4. 用药禁忌
 5. 建议就医情况
 
-请注意：这只是建议，具体用药需要遵医嘱。"""
-
-    try:
-        response = get_chat_response(
-            prompt=prompt,
-            memory=None,
-            model_type=model_type,
-            api_key=api_key,
-            is_chat_feature=False
-        )
-        return {'status': 'success', 'advice': response}
-    except Exception as e:
-        return {'status': 'error', 'message': str(e)}
-
-
-def suggest_recovery(condition: str, age: int, model_type: str, api_key: str) -> Dict:
-    """康复建议"""
-    prompt = f"""请作为一个康复科医生，针对以下情况提供康复建议：
-
-患者情况：
+请注意：这只是建议，具体用药需要遵医嘱。""", """患者情况：
 - 年龄：{age}岁
-- 症状/情况：{condition}
+- 症状：{symptoms}
+- 过敏史：{allergies}""")
+
+RECOVERY_PROMPT = register_template("medical.recovery", """请作为一个康复科医生，针对用户提供的情况提供康复建议。
 
 请提供以下建议：
 1. 康复计划
@@ -107,108 +76,231 @@ def suggest_recovery(condition: str, age: int, model_type: str, api_key: str) ->
 3. 生活起居注意事项
 4. 康复周期预估
 5. 康复效果评估标准
-6. 需要注意的事项"""
+6. 需要注意的事项""", """患者情况：
+- 年龄：{age}岁
+- 症状/情况：{condition}""")
+
+PREVENTION_PROMPT = register_template("medical.prevention", """请作为一个预防医学专家，针对用户提供的情况提供预防建议。
+
+请提供以下建议：
+1. 疾病风险评估
+2. 预防措施
+3. 生活方式建议
+4. 定期检查计划
+5. 预防保健措施""", """个人情况：
+- 年龄：{age}岁
+- 性别：{gender}
+- 风险因素：{risk_factors}""")
+
+HOSPITAL_PROMPT = register_template("medical.hospital", """请作为一个医疗资源专家，针对用户提供的情况推荐合适的医院。
+
+请提供以下建议：
+1. 推荐医院列表（请列出3-5家）
+2. 医院特色和优势
+3. 就医建议
+4. 挂号注意事项
+5. 就医准备事项""", """患者情况：
+- 病情：{condition}
+- 所在地区：{location}""")
+
+EXERCISE_PROMPT = register_template("medical.exercise", """请作为一个运动康复专家，针对用户提供的情况提供运动建议。
+
+请提供以下建议：
+1. 建议的运动类型
+2. 运动强度和时长
+3. 运动注意事项
+4. 循序渐进计划
+5. 禁忌动作
+6. 运动效果评估""", """个人情况：
+- 年龄：{age}岁
+- 身体状况：{condition}
+- 运动水平：{fitness_level}""")
+
+CASE_SUMMARY_PROMPT = register_template("medical.case_summary", """请根据医生和患者的新增对话，更新已有的病情总结，总结患者的主要症状、关键信息和建议。
+
+请从以下几个方面进行总结：
+1. 主要症状
+2. 可能的原因
+3. 关键建议
+4. 需要注意的事项""", """已有总结：
+{previous_summary}
+
+新增对话：
+{new_messages}""")
+
+DOCTOR_CHAT_PROMPT = register_template("medical.doctor_chat", """作为一个专业、富有同理心的AI医生，请基于对话历史，回复患者的问题。请注意：
+1. 保持专业、准确，但语言要平易近人
+2. 结合之前的对话内容，给出更有针对性的建议
+3. 必要时建议就医
+4. 不做确定性诊断
+5. 对患者表示理解和关心
+
+请针对患者最新的问题给出回复。""", """对话历史：
+{conversation_history}""")
+
+
+def query_symptoms(symptoms: str, model_type: str, api_key: str, stream: bool = False) -> Dict:
+    """查询症状分析"""
+    prompt = SYMPTOMS_PROMPT.render(symptoms=symptoms)
 
     try:
-        response = get_chat_response(
-            prompt=prompt,
-            memory=None,
-            model_type=model_type,
-            api_key=api_key,
-            is_chat_feature=False
-        )
-        return {'status': 'success', 'advice': response}
+        response = _run_medical_prompt(prompt, model_type, api_key, stream)
+        return {'status': 'success', 'analysis': response}
     except Exception as e:
         return {'status': 'error', 'message': str(e)}
 
 
-def suggest_prevention(risk_factors: str, age: int, gender: str, model_type: str, api_key: str) -> Dict:
-    """预防建议"""
-    prompt = f"""请作为一个预防医学专家，针对以下情况提供预防建议：
+def health_self_check(age: int, gender: str, conditions: List[str], model_type: str, api_key: str, stream: bool = False) -> Dict:
+    """健康自查分析"""
+    conditions_text = "\n".join([f"- {condition}" for condition in conditions])
+    prompt = HEALTH_CHECK_PROMPT.render(age=age, gender=gender, conditions=conditions_text)
 
-个人情况：
-- 年龄：{age}岁
-- 性别：{gender}
-- 风险因素：{risk_factors}
+    try:
+        response = _run_medical_prompt(prompt, model_type, api_key, stream)
+        return {'status': 'success', 'analysis': response}
+    except Exception as e:
+        return {'status': 'error', 'message': str(e)}
 
-请提供以下建议：
-1. 疾病风险评估
-2. 预防措施
-3. 生活方式建议
-4. 定期检查计划
-5. 预防保健措施"""
+
+def suggest_medication(symptoms: str, age: int, allergies: str, model_type: str, api_key: str, stream: bool = False) -> Dict:
+    """药物建议"""
+    prompt = MEDICATION_PROMPT.render(age=age, symptoms=symptoms, allergies=allergies if allergies else "无")
 
     try:
-        response = get_chat_response(
-            prompt=prompt,
-            memory=None,
-            model_type=model_type,
-            api_key=api_key,
-            is_chat_feature=False
-        )
+        response = _run_medical_prompt(prompt, model_type, api_key, stream)
         return {'status': 'success', 'advice': response}
     except Exception as e:
         return {'status': 'error', 'message': str(e)}
 
 
-def match_hospital(condition: str, location: str, model_type: str, api_key: str) -> Dict:
-    """医院匹配推荐"""
-    prompt = f"""请作为一个医疗资源专家，针对以下情况推荐合适的医院：
+def suggest_recovery(condition: str, age: int, model_type: str, api_key: str, stream: bool = False) -> Dict:
+    """康复建议"""
+    prompt = RECOVERY_PROMPT.render(age=age, condition=condition)
 
-患者情况：
-- 病情：{condition}
-- 所在地区：{location}
+    try:
+        response = _run_medical_prompt(prompt, model_type, api_key, stream)
+        return {'status': 'success', 'advice': response}
+    except Exception as e:
+        return {'status': 'error', 'message': str(e)}
 
-请提供以下建议：
-1. 推荐医院列表（请列出3-5家）
-2. 医院特色和优势
-3. 就医建议
-4. 挂号注意事项
-5. 就医准备事项"""
+
+def suggest_prevention(risk_factors: str, age: int, gender: str, model_type: str, api_key: str, stream: bool = False) -> Dict:
+    """预防建议"""
+    prompt = PREVENTION_PROMPT.render(age=age, gender=gender, risk_factors=risk_factors)
 
     try:
-        response = get_chat_response(
-            prompt=prompt,
-            memory=None,
-            model_type=model_type,
-            api_key=api_key,
-            is_chat_feature=False
-        )
-        return {'status': 'success', 'recommendations': response}
+        response = _run_medical_prompt(prompt, model_type, api_key, stream)
+        return {'status': 'success', 'advice': response}
     except Exception as e:
         return {'status': 'error', 'message': str(e)}
 
 
-def suggest_exercise(condition: str, age: int, fitness_level: str, model_type: str, api_key: str) -> Dict:
-    """运动康复建议"""
-    prompt = f"""请作为一个运动康复专家，针对以下情况提供运动建议：
+def match_hospital(condition: str, location: str, model_type: str, api_key: str, stream: bool = False) -> Dict:
+    """医院匹配推荐"""
+    prompt = HOSPITAL_PROMPT.render(condition=condition, location=location)
 
-个人情况：
-- 年龄：{age}岁
-- 身体状况：{condition}
-- 运动水平：{fitness_level}
+    try:
+        response = _run_medical_prompt(prompt, model_type, api_key, stream)
+        return {'status': 'success', 'recommendations': response}
+    except Exception as e:
+        return {'status': 'error', 'message': str(e)}
 
-请提供以下建议：
-1. 建议的运动类型
-2. 运动强度和时长
-3. 运动注意事项
-4. 循序渐进计划
-5. 禁忌动作
-6. 运动效果评估"""
+
+def suggest_exercise(condition: str, age: int, fitness_level: str, model_type: str, api_key: str, stream: bool = False) -> Dict:
+    """运动康复建议"""
+    prompt = EXERCISE_PROMPT.render(age=age, condition=condition, fitness_level=fitness_level)
 
     try:
-        response = get_chat_response(
-            prompt=prompt,
-            memory=None,
-            model_type=model_type,
-            api_key=api_key,
-            is_chat_feature=False
-        )
+        response = _run_medical_prompt(prompt, model_type, api_key, stream)
         return {'status': 'success', 'advice': response}
     except Exception as e:
         return {'status': 'error', 'message': str(e)}
 
 
+def _format_doctor_messages(messages: List[Dict]) -> str:
+    """把医生对话消息渲染成文本"""
+    return "\n".join([
+        f"{'患者' if msg['role'] == 'user' else 'AI医生'}: {msg['content']}"
+        for msg in messages
+    ])
+
+
+def _summarize_case(previous_summary: str, new_messages: List[Dict], model_type: str, api_key: str) -> str:
+    """基于已有总结和新增对话生成更新后的病情总结（在后台线程中执行）"""
+    prompt = CASE_SUMMARY_PROMPT.render(
+        previous_summary=previous_summary or "（暂无）",
+        new_messages=_format_doctor_messages(new_messages)
+    )
+
+    return get_chat_response(
+        prompt=prompt,
+        memory=None,
+        model_type=model_type,
+        api_key=api_key,
+        is_chat_feature=False
+    )
+
+
+def refresh_case_summary(conv: Dict, model_type: str, api_key: str) -> bool:
+    """应用已完成的后台总结，并在需要时提交新的增量总结任务
+
+    总结任务只处理上次总结之后的新增消息；任务完成前界面继续显示旧总结。
+
+    Returns:
+        bool: 是否还有总结任务在进行或等待提交
+    """
+    future = conv.get('summary_future')
+    if future is not None:
+        if not future.done():
+            return True
+        conv['summary_future'] = None
+        try:
+            summary = future.result()
+        except Exception as e:
+            summary = f"抱歉，处理请求时出现错误: {str(e)}"
+        if summary and not summary.startswith("抱歉"):
+            conv['summary'] = summary
+            conv['summarized_count'] = conv.get('summary_pending_count', 0)
+        else:
+            # 失败时保留旧总结，未总结的消息留待下次重试
+            print(f"Case summary update failed: {summary}")
+
+    messages = conv['messages']
+    summarized = conv.get('summarized_count', 0)
+    if summarized > len(messages):
+        # 对话被清空或截断，重新开始总结
+        summarized = conv['summarized_count'] = 0
+    if len(messages) < SUMMARY_MIN_MESSAGES or len(messages) - summarized < 2:
+        return False
+    if time.time() - conv.get('summary_submitted_at', 0) < SUMMARY_DEBOUNCE_SECONDS:
+        return True
+
+    conv['summary_pending_count'] = len(messages)
+    conv['summary_submitted_at'] = time.time()
+    conv['summary_future'] = submit_in_context(
+        _summary_executor, _summarize_case, conv['summary'], list(messages[summarized:]), model_type, api_key
+    )
+    return True
+
+
+def _render_case_summary(conv: Dict, model_type: str, api_key: str):
+    """显示病情总结；后台有任务时定时刷新这一块，新总结到达后替换旧总结"""
+    pending = refresh_case_summary(conv, model_type, api_key)
+
+    @st.fragment(run_every=SUMMARY_POLL_SECONDS if pending else None)
+    def case_summary_panel():
+        if not refresh_case_summary(conv, model_type, api_key) and pending:
+            # 总结已完成：整页重跑一次，以不带定时刷新的方式重新创建这一块，停止轮询
+            st.rerun()
+        if conv['summary']:
+            with st.expander("查看病情总结", expanded=False):
+                st.write(conv['summary'])
+        if conv.get('summary_future') is not None:
+            st.caption("病情总结更新中...")
+
+    case_summary_panel()
+
+
 def render_medical_assistant():
     """渲染医疗助手界面"""
     st.header("👨‍⚕️ AI医疗助手")
@@ -251,12 +343,13 @@ def render_medical_assistant():
                     result = query_symptoms(
                         symptoms=symptoms,
                         model_type=current_model,
-                        api_key=st.session_state.api_keys[current_model]
+                        api_key=st.session_state.api_keys[current_model],
+                        stream=True
                     )
 
                     if result['status'] == 'success':
                         st.markdown("### 分析结果")
-                        st.write(result['analysis'])
+                        result['analysis'] = st.write_stream(result['analysis'])
                         create_copy_button(
                             text=result['analysis'],
                             button_text="📋 复制分析结果",
@@ -294,12 +387,13 @@ def render_medical_assistant():
                         gender=gender,
                         conditions=health_conditions,
                         model_type=current_model,
-                        api_key=st.session_state.api_keys[current_model]
+                        api_key=st.session_state.api_keys[current_model],
+                        stream=True
                     )
 
                     if result['status'] == 'success':
                         st.markdown("### 分析结果")
-                        st.write(result['analysis'])
+                        result['analysis'] = st.write_stream(result['analysis'])
                         create_copy_button(
                             text=result['analysis'],
                             button_text="📋 复制分析结果",
@@ -389,10 +483,8 @@ def render_medical_assistant():
                     st.markdown(f"**👨‍⚕️ AI医生**：\n{message['content']}")
                     st.markdown("---")
 
-            # 显示对话总结（如果有）
-            if current_conv['summary']:
-                with st.expander("查看病情总结", expanded=False):
-                    st.write(current_conv['summary'])
+            # 显示对话总结（如果有），总结在后台增量更新
+            _render_case_summary(current_conv, current_model, st.session_state.api_keys[current_model])
 
             # 用户输入区
             user_input = st.text_input(
@@ -418,33 +510,23 @@ def render_medical_assistant():
                         })
 
                         # 构建完整的对话历史上下文
-                        conversation_history = "\n".join([
-                            f"{'患者' if msg['role'] == 'user' else 'AI医生'}: {msg['content']}"
-                            for msg in current_conv['messages']
-                        ])
+                        conversation_history = _format_doctor_messages(current_conv['messages'])
 
                         # 构建医生角色提示词
-                        prompt = f"""作为一个专业、富有同理心的AI医生，请基于以下对话历史，回复患者的问题。请注意：
-1. 保持专业、准确，但语言要平易近人
-2. 结合之前的对话内容，给出更有针对性的建议
-3. 必要时建议就医
-4. 不做确定性诊断
-5. 对患者表示理解和关心
-
-对话历史：
-{conversation_history}
-
-请针对患者最新的问题给出回复。"""
+                        prompt = DOCTOR_CHAT_PROMPT.render(conversation_history=conversation_history)
 
                         with st.spinner("AI医生正在回复..."):
                             try:
-                                response = get_chat_response(
+                                # 流式渲染回复，首个token到达即开始显示
+                                st.markdown("**👨‍⚕️ AI医生**：")
+                                response = st.write_stream(stream_chat_response(
                                     prompt=prompt,
                                     memory=None,
                                     model_type=current_model,
                                     api_key=st.session_state.api_keys[current_model],
-                                    is_chat_feature=True
-                                )
+                                    is_chat_feature=True,
+                                    hedge_with=get_hedge_targets(current_model)
+                                ))
 
                                 # 添加AI回复
                                 current_conv['messages'].append({
@@ -452,26 +534,7 @@ def render_medical_assistant():
                                     "content": response
                                 })
 
-                                # 生成对话总结
-                                if len(current_conv['messages']) >= 4:  # 当有足够的对话内容时生成总结
-                                    summary_prompt = f"""请根据以下医生和患者的对话，总结患者的主要症状、关键信息和建议：
-
-{conversation_history}
-
-请从以下几个方面进行总结：
-1. 主要症状
-2. 可能的原因
-3. 关键建议
-4. 需要注意的事项"""
-
-                                    summary = get_chat_response(
-                                        prompt=summary_prompt,
-                                        memory=None,
-                                        model_type=current_model,
-                                        api_key=st.session_state.api_keys[current_model],
-                                        is_chat_feature=False
-                                    )
-                                    current_conv['summary'] = summary
+                                # 对话总结在下一次渲染时交给后台增量更新，不阻塞回复
 
                                 st.rerun()
 
@@ -483,14 +546,13 @@ def render_medical_assistant():
                 if st.button("清空当前对话", use_container_width=True):
                     current_conv['messages'] = []
                     current_conv['summary'] = ''
+                    current_conv['summarized_count'] = 0
+                    current_conv['summary_future'] = None
                     st.rerun()
 
             # 复制对话记录按钮
             if current_conv['messages']:
-                conversation_text = "\n".join([
-                    f"{'患者' if msg['role'] == 'user' else 'AI医生'}: {msg['content']}"
-                    for msg in current_conv['messages']
-                ])
+                conversation_text = _format_doctor_messages(current_conv['messages'])
 
                 if current_conv['summary']:
                     conversation_text += f"\n\n病情总结：\n{current_conv['summary']}"
@@ -527,12 +589,13 @@ def render_medical_assistant():
                         age=med_age,
                         allergies=allergies,
                         model_type=current_model,
-                        api_key=st.session_state.api_keys[current_model]
+                        api_key=st.session_state.api_keys[current_model],
+                        stream=True
                     )
 
                     if result['status'] == 'success':
                         st.markdown("### 用药建议")
-                        st.write(result['advice'])
+                        result['advice'] = st.write_stream(result['advice'])
                         create_copy_button(
                             text=result['advice'],
                             button_text="📋 复制用药建议",
@@ -562,12 +625,13 @@ def render_medical_assistant():
                         condition=recovery_condition,
                         age=recovery_age,
                         model_type=current_model,
-                        api_key=st.session_state.api_keys[current_model]
+                        api_key=st.session_state.api_keys[current_model],
+                        stream=True
                     )
 
                     if result['status'] == 'success':
                         st.markdown("### 康复建议")
-                        st.write(result['advice'])
+                        result['advice'] = st.write_stream(result['advice'])
                         create_copy_button(
                             text=result['advice'],
                             button_text="📋 复制康复建议",
@@ -606,12 +670,13 @@ def render_medical_assistant():
                         age=prev_age,
                         gender=prev_gender,
                         model_type=current_model,
-                        api_key=st.session_state.api_keys[current_model]
+                        api_key=st.session_state.api_keys[current_model],
+                        stream=True
                     )
 
                     if result['status'] == 'success':
                         st.markdown("### 预防建议")
-                        st.write(result['advice'])
+                        result['advice'] = st.write_stream(result['advice'])
                         create_copy_button(
                             text=result['advice'],
                             button_text="📋 复制预防建议",
@@ -641,12 +706,13 @@ def render_medical_assistant():
                         condition=hospital_condition,
                         location=location,
                         model_type=current_model,
-                        api_key=st.session_state.api_keys[current_model]
+                        api_key=st.session_state.api_keys[current_model],
+                        stream=True
                     )
 
                     if result['status'] == 'success':
                         st.markdown("### 医院推荐")
-                        st.write(result['recommendations'])
+                        result['recommendations'] = st.write_stream(result['recommendations'])
                         create_copy_button(
                             text=result['recommendations'],
                             button_text="📋 复制医院推荐",
@@ -685,12 +751,13 @@ def render_medical_assistant():
                         age=exercise_age,
                         fitness_level=fitness_level,
                         model_type=current_model,
-                        api_key=st.session_state.api_keys[current_model]
+                        api_key=st.session_state.api_keys[current_model],
+                        stream=True
                     )
 
                     if result['status'] == 'success':
                         st.markdown("### 运动建议")
-                        st.write(result['advice'])
+                        result['advice'] = st.write_stream(result['advice'])
                         create_copy_button(
                             text=result['advice'],
                             button_text="📋 复制运动建议",
@@ -0,0 +1,48 @@
+import io
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+import PyPDF2
+
+# PDF 提取子进程使用的函数。单独成模块，子进程（spawn 启动）只需导入 PyPDF2，
+# 不会加载 streamlit 等主进程依赖。
+
+# 每个子进程缓存最近解析过的 PDF，同一文档的多个页段只解析一次
+_READER_CACHE_SIZE = 2
+_readers: "OrderedDict[str, PyPDF2.PdfReader]" = OrderedDict()
+
+
+def largest_page_image(page) -> Optional[bytes]:
+    """返回页面中最大的内嵌图片（扫描件通常整页就是一张图）"""
+    try:
+        images = list(page.images)
+    except Exception:
+        return None
+    if not images:
+        return None
+    return max(images, key=lambda image: len(image.data)).data
+
+
+def extract_pdf_page(page) -> Tuple[str, Optional[bytes]]:
+    """提取单页文本；没有文本层的页面附带页面图片供 OCR"""
+    text = page.extract_text() or ""
+    return text, None if text.strip() else largest_page_image(page)
+
+
+def _get_reader(path: str, digest: str) -> PyPDF2.PdfReader:
+    reader = _readers.get(digest)
+    if reader is None:
+        with open(path, "rb") as f:
+            reader = PyPDF2.PdfReader(io.BytesIO(f.read()))
+        _readers[digest] = reader
+        while len(_readers) > _READER_CACHE_SIZE:
+            _readers.popitem(last=False)
+    else:
+        _readers.move_to_end(digest)
+    return reader
+
+
+def extract_pdf_page_range(path: str, digest: str, start: int, stop: int) -> List[Tuple[str, Optional[bytes]]]:
+    """在子进程中提取 [start, stop) 范围的页面；文档通过临时文件传递，按内容摘要缓存"""
+    reader = _get_reader(path, digest)
+    return [extract_pdf_page(reader.pages[index]) for index in range(start, stop)]
@@ -0,0 +1,100 @@
+import string
+import threading
+from typing import Any, Dict, Mapping, Optional, Sequence, Tuple
+
+from rate_limiter import estimate_tokens
+
+# 静态前缀与变量部分之间的分隔
+PREFIX_SEPARATOR = "\n\n"
+
+
+class RenderedPrompt(str):
+    """渲染后的提示词
+
+    作为字符串使用时是完整提示词文本（缓存键、日志等不受影响）；客户端发送时
+    依次发送系统消息 system、历史消息 history 和用户消息 user，并按 feature 统计
+    provider 提示词缓存的命中率。digest 不为空时，响应缓存直接用它作为提示词的键，
+    不再对全文做规范化和哈希。
+    """
+
+    system: Optional[str]
+    user: str
+    feature: Optional[str]
+    history: Tuple[Mapping[str, str], ...]
+    digest: Optional[str]
+
+    def __new__(cls, text: str, system: Optional[str], user: str, feature: Optional[str] = None,
+                history: Sequence[Mapping[str, str]] = (), digest: Optional[str] = None) -> "RenderedPrompt":
+        rendered = super().__new__(cls, text)
+        rendered.system = system
+        rendered.user = user
+        rendered.feature = feature
+        rendered.history = tuple(history)
+        rendered.digest = digest
+        return rendered
+
+
+class PromptTemplate:
+    """预编译的提示词模板
+
+    模板拆成静态部分（角色设定、输出要求等不随输入变化的文本）和变量部分（只含
+    用户输入的槽位）。静态部分在注册时渲染一次并缓存 token 数；渲染时静态部分
+    总在最前，同一模板的每次请求都以字节完全相同的前缀开头，可以命中 provider
+    的提示词缓存。
+    """
+
+    def __init__(self, name: str, static: str, variable: str, **constants: Any):
+        self.name = name
+        # constants 只用于静态部分中注册时即可确定的槽位（如输出格式说明）
+        self.static = static.format(**constants) if constants else static
+        self.variable = variable
+        self.slots: Tuple[str, ...] = tuple(
+            field for _, field, _, _ in string.Formatter().parse(variable) if field
+        )
+        self.prefix = self.static + PREFIX_SEPARATOR
+        self.static_tokens = estimate_tokens(self.static)
+
+    def render_variable(self, **values: Any) -> str:
+        return self.variable.format(**values)
+
+    def render(self, **values: Any) -> RenderedPrompt:
+        """渲染完整提示词：缓存的静态前缀 + 变量部分"""
+        user = self.render_variable(**values)
+        return RenderedPrompt(self.prefix + user, self.static, user, self.name)
+
+
+_templates: Dict[str, PromptTemplate] = {}
+_templates_lock = threading.Lock()
+
+
+def register_template(name: str, static: str, variable: str, **constants: Any) -> PromptTemplate:
+    """注册（预编译）模板；同名且内容相同的模板直接复用已编译的实例"""
+    template = PromptTemplate(name, static, variable, **constants)
+    with _templates_lock:
+        existing = _templates.get(name)
+        if existing is not None and existing.static == template.static and existing.variable == template.variable:
+            return existing
+        _templates[name] = template
+        return template
+
+
+def get_template(name: str) -> PromptTemplate:
+    with _templates_lock:
+        template = _templates.get(name)
+    if template is None:
+        raise KeyError(f"未注册的提示词模板: {name}")
+    return template
+
+
+def render_prompt(name: str, **values: Any) -> RenderedPrompt:
+    return get_template(name).render(**values)
+
+
+def template_stats() -> Dict[str, Dict[str, Any]]:
+    """各模板的静态前缀 token 数与槽位"""
+    with _templates_lock:
+        templates = list(_templates.values())
+    return {
+        template.name: {'static_tokens': template.static_tokens, 'slots': template.slots}
+        for template in templates
+    }
@@ -1,3 +1,5 @@
+from prompt_registry import register_template
+
 system_template_text = """你是小红书爆款写作专家，请你遵循以下步骤进行创作：
 首先产出5个标题（包含适当的emoji表情），然后产出1段正文（每一个段落包含适当的emoji表情，文末有适当的tag标签）。
 标题字数在20个字以内，正文字数在800字以内，并且按以下技巧进行创作。
@@ -36,3 +38,90 @@ system_template_text = """你是小红书爆款写作专家，请你遵循以下
 """
 
 user_template_text = "{theme}"
+
+
+# 旅游助手各功能的提示词模板，静态的输出要求在前，行程信息在后
+TRAVEL_PROMPTS = {
+    "行程规划": register_template("travel.itinerary", """请根据用户提供的出行信息规划详细行程。
+
+请提供详细的行程安排，包括：
+1. 每天的行程安排（景点、用餐、休息等）
+2. 建议游玩时长
+3. 交通方式建议
+4. 用餐和休息时间安排
+5. 注意事项和建议
+
+请确保行程合理，充分考虑游玩时间和交通时间。""", """请帮我规划一个{destination}的{days}天行程。
+具体信息如下：
+- 出行日期：{start_date} 到 {end_date}
+- 预算：{budget}元
+- 出行人数：{travelers}人
+- 偏好：{preferences}"""),
+    "交通建议": register_template("travel.transport", """请根据用户提供的出行信息推荐去目的地的最佳交通方式。
+
+请提供以下信息：
+1. 不同交通方式的对比（飞机、高铁、大巴等）
+2. 各种交通方式的大概价格
+3. 最优交通方案建议
+4. 当地交通卡办理建议
+5. 从机场/车站到市区的交通建议""", """目的地：{destination}
+具体信息如下：
+- 出行日期：{start_date}
+- 出行人数：{travelers}人
+- 预算：{budget}元"""),
+    "住宿推荐": register_template("travel.lodging", """请根据用户提供的出行信息推荐目的地合适的住宿。
+
+请提供以下信息：
+1. 推荐的住宿区域
+2. 不同价位的住宿选择
+3. 各类型住宿的优缺点
+4. 订房注意事项
+5. 具体住宿推荐（含预估价格）""", """目的地：{destination}
+具体信息如下：
+- 入住日期：{start_date} 到 {end_date}
+- 人数：{travelers}人
+- 预算：每晚{nightly_budget}元左右"""),
+    "美食指南": register_template("travel.food", """请根据用户提供的出行信息推荐目的地的特色美食。
+
+请提供以下信息：
+1. 必尝特色美食清单
+2. 推荐餐厅和小吃街
+3. 各美食预估价格
+4. 用餐建议和注意事项
+5. 美食打卡地图规划""", """目的地：{destination}
+具体信息如下：
+- 预算：人均{daily_budget_per_person}元/天
+- 人数：{travelers}人"""),
+    "景点介绍": register_template("travel.attractions", """请为用户介绍目的地的主要景点。
+
+请提供以下信息：
+1. 必游景点清单及门票价格
+2. 各景点游玩建议时长
+3. 最佳游玩时间
+4. 门票预订建议
+5. 景点之间的交通安排""", """目的地：{destination}"""),
+    "天气查询": register_template("travel.weather", """请为用户介绍目的地在计划出行日期的天气情况。
+
+请提供以下信息：
+1. 当地天气特点
+2. 建议携带的衣物
+3. 天气对行程的影响
+4. 出行建议
+5. 必备物品清单""", """目的地：{destination}
+计划出行日期：{start_date} 到 {end_date}"""),
+    "花费预估": register_template("travel.budget", """请根据用户提供的出行信息预估旅行的整体费用。
+
+请提供以下信息：
+1. 交通费用预估
+2. 住宿费用预估
+3. 餐饮费用预估
+4. 门票费用预估
+5. 其他费用预估（购物、娱乐等）
+6. 建议预留的额外费用
+7. 省钱建议和攻略""", """目的地：{destination}
+具体信息如下：
+- 出行日期：{start_date} 到 {end_date}
+- 人数：{travelers}人
+- 总预算：{budget}元
+- 偏好：{preferences}""")
+}
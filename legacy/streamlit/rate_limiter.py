@@ -0,0 +1,246 @@
+import asyncio
+import hashlib
+import re
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Optional, Tuple
+
+# 各 provider 的默认限额：(每分钟请求数, 每分钟 token 数, 最大并发数)，None 表示不限
+DEFAULT_RATE_LIMITS: Dict[str, Tuple[Optional[float], Optional[float], Optional[int]]] = {
+    "qwen": (60, 100_000, 5),
+    "chatgpt": (60, 80_000, 8),
+    "claude": (50, 80_000, 5),
+    "glm": (60, 100_000, 5)
+}
+
+# 未设置截止时间时排队等待额度的上限（秒），避免额度被占满后调用方永久阻塞
+DEFAULT_ACQUIRE_TIMEOUT = 120.0
+
+_CJK_PATTERN = re.compile(r'[　-〿㐀-䶿一-鿿＀-￯]')
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数：中日韩字符按 1 个计，其余字符按 4 个计 1 个"""
+    if not text:
+        return 0
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+class RateLimiter:
+    """请求数 + token 数双令牌桶限流，附带并发上限
+
+    调用方按到达顺序排队（FIFO），只有队首在两个令牌桶都足够、并发未满且不在
+    Retry-After 冷却期时才能放行，后来的请求不会插队。单次请求的 token 数超过桶容量
+    时只需等桶装满，不会永久阻塞。同步与异步调用方共用一个队列：线程在条件变量上
+    等待，协程在所属事件循环的 future 上等待，额度变化时两者都会被唤醒。
+    """
+
+    def __init__(
+            self,
+            requests_per_minute: Optional[float] = None,
+            tokens_per_minute: Optional[float] = None,
+            max_concurrency: Optional[int] = None
+    ):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_concurrency = max_concurrency
+        self._requests = float(requests_per_minute or 0)
+        self._tokens = float(tokens_per_minute or 0)
+        self._updated = time.monotonic()
+        self._active = 0
+        self._blocked_until = 0.0
+        self._queue: deque = deque()
+        self._cond = threading.Condition()
+        self._async_waiters: Dict[object, Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = {}
+        self._stats = {'acquired': 0, 'queued': 0, 'wait_seconds': 0.0, 'throttled': 0, 'timeouts': 0}
+
+    def acquire(self, tokens: int = 0, timeout: Optional[float] = None,
+                cancelled: Optional[threading.Event] = None) -> bool:
+        """排队获取一次请求额度，超时或 cancelled 被设置时返回 False"""
+        ticket = object()
+        started = time.monotonic()
+        deadline = started + timeout if timeout is not None else None
+        with self._cond:
+            self._queue.append(ticket)
+            try:
+                while True:
+                    if cancelled is not None and cancelled.is_set():
+                        return False
+                    acquired, wait = self._poll_locked(ticket, tokens, started, deadline)
+                    if acquired is not None:
+                        return acquired
+                    self._cond.wait(wait)
+            finally:
+                self._leave_locked(ticket)
+
+    async def aacquire(self, tokens: int = 0, timeout: Optional[float] = None) -> bool:
+        """异步排队获取额度，超时返回 False
+
+        协程在事件循环内等待，不占用线程。额度在持锁期间取得并立即返回，中间没有
+        await，任务被取消时只会放弃排队，不会泄漏并发额度。
+        """
+        loop = asyncio.get_running_loop()
+        ticket = object()
+        started = time.monotonic()
+        deadline = started + timeout if timeout is not None else None
+        with self._cond:
+            self._queue.append(ticket)
+        try:
+            while True:
+                with self._cond:
+                    acquired, wait = self._poll_locked(ticket, tokens, started, deadline)
+                    if acquired is not None:
+                        return acquired
+                    wakeup = loop.create_future()
+                    self._async_waiters[ticket] = (loop, wakeup)
+                await asyncio.wait([wakeup], timeout=wait)
+        finally:
+            with self._cond:
+                self._async_waiters.pop(ticket, None)
+                self._leave_locked(ticket)
+
+    def _poll_locked(self, ticket: object, tokens: int, started: float,
+                     deadline: Optional[float]) -> Tuple[Optional[bool], Optional[float]]:
+        """检查排队中的 ticket：返回 (结果, None)，或 (None, 需要等待的秒数)"""
+        now = time.monotonic()
+        self._refill_locked(now)
+        wait = None
+        if self._queue[0] is ticket:
+            wait = self._wait_time_locked(tokens, now)
+            if wait == 0:
+                self._take_locked(tokens)
+                waited = now - started
+                self._stats['acquired'] += 1
+                if waited > 0.001:
+                    self._stats['queued'] += 1
+                    self._stats['wait_seconds'] += waited
+                return True, None
+        if deadline is not None:
+            remaining = deadline - now
+            if remaining <= 0:
+                self._stats['timeouts'] += 1
+                return False, None
+            wait = remaining if wait is None else min(wait, remaining)
+        return None, wait
+
+    def _leave_locked(self, ticket: object) -> None:
+        self._queue.remove(ticket)
+        self._notify_locked()
+
+    def _notify_locked(self) -> None:
+        """唤醒所有等待者：线程通过条件变量，协程通过各自事件循环中的 future"""
+        self._cond.notify_all()
+        for loop, wakeup in self._async_waiters.values():
+            try:
+                loop.call_soon_threadsafe(_wake, wakeup)
+            except RuntimeError:
+                # 事件循环已关闭，等待者随之结束
+                pass
+
+    def release(self, extra_tokens: int = 0) -> None:
+        """释放并发额度；extra_tokens 为实际用量超出预估的部分，从桶中补扣"""
+        with self._cond:
+            self._active = max(0, self._active - 1)
+            if self.tokens_per_minute and extra_tokens:
+                self._tokens -= extra_tokens
+            self._notify_locked()
+
+    def penalize(self, retry_after: float) -> None:
+        """收到 429 后暂停放行 retry_after 秒（取已有冷却期与新值中较晚者）"""
+        with self._cond:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + retry_after)
+            self._stats['throttled'] += 1
+            self._notify_locked()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                **self._stats,
+                'active': self._active,
+                'waiting': len(self._queue),
+                'cooldown': max(0.0, self._blocked_until - time.monotonic())
+            }
+
+    def _refill_locked(self, now: float) -> None:
+        elapsed = now - self._updated
+        self._updated = now
+        if self.requests_per_minute:
+            self._requests = min(self.requests_per_minute, self._requests + elapsed * self.requests_per_minute / 60)
+        if self.tokens_per_minute:
+            self._tokens = min(self.tokens_per_minute, self._tokens + elapsed * self.tokens_per_minute / 60)
+
+    def _wait_time_locked(self, tokens: int, now: float) -> Optional[float]:
+        """距离可以放行还需等待的秒数；并发已满时返回 None（等待 release 通知）"""
+        if self.max_concurrency and self._active >= self.max_concurrency:
+            return None
+        wait = max(0.0, self._blocked_until - now)
+        if self.requests_per_minute and self._requests < 1:
+            wait = max(wait, (1 - self._requests) * 60 / self.requests_per_minute)
+        if self.tokens_per_minute:
+            needed = min(tokens, self.tokens_per_minute)
+            if self._tokens < needed:
+                wait = max(wait, (needed - self._tokens) * 60 / self.tokens_per_minute)
+        return wait
+
+    def _take_locked(self, tokens: int) -> None:
+        if self.requests_per_minute:
+            self._requests -= 1
+        if self.tokens_per_minute:
+            self._tokens -= min(tokens, self.tokens_per_minute)
+        self._active += 1
+
+
+def _wake(wakeup: asyncio.Future) -> None:
+    if not wakeup.done():
+        wakeup.set_result(None)
+
+
+_limiters: Dict[Tuple[str, str], RateLimiter] = {}
+_limit_overrides: Dict[str, Tuple[Optional[float], Optional[float], Optional[int]]] = {}
+_limiters_lock = threading.Lock()
+
+
+def _key_digest(api_key: str) -> str:
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:16]
+
+
+def get_rate_limiter(provider: str, api_key: str) -> RateLimiter:
+    """获取 (provider, api_key) 对应的限流器，同一密钥的所有客户端与会话共享"""
+    key = (provider, _key_digest(api_key))
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limits = _limit_overrides.get(provider) or DEFAULT_RATE_LIMITS.get(provider, (None, None, None))
+            limiter = RateLimiter(*limits)
+            _limiters[key] = limiter
+        return limiter
+
+
+def configure_rate_limit(
+        provider: str,
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None,
+        max_concurrency: Optional[int] = None
+) -> None:
+    """设置 provider 的限额（对之后新建的限流器生效，并替换已有限流器）"""
+    with _limiters_lock:
+        _limit_overrides[provider] = (requests_per_minute, tokens_per_minute, max_concurrency)
+        for key in [key for key in _limiters if key[0] == provider]:
+            del _limiters[key]
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """解析 Retry-After 头（秒数或 HTTP 日期），无法解析时返回 None"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        from email.utils import parsedate_to_datetime
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,238 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_prompt(prompt: str) -> str:
+    """规范化提示词：统一换行并去掉行尾及首尾空白，使等价提示词得到相同的键"""
+    lines = prompt.replace('\r\n', '\n').replace('\r', '\n').split('\n')
+    return '\n'.join(line.rstrip() for line in lines).strip()
+
+
+def make_cache_key(provider: str, model: str, prompt: str, temperature: Optional[float]) -> str:
+    """根据 (provider, model, 规范化提示词, temperature) 生成内容寻址的缓存键
+
+    提示词自带摘要（例如增量维护的聊天记录）时直接使用该摘要，不再处理全文。
+    """
+    digest = getattr(prompt, 'digest', None)
+    raw = json.dumps(
+        [provider, model, f"digest:{digest}" if digest else normalize_prompt(prompt), temperature],
+        ensure_ascii=False
+    )
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """模型响应缓存
+
+    进程内按 LRU + TTL 淘汰，并限制条目数与总字节数；可选的 SQLite 存储让命中
+    在进程重启后依然有效。所有方法都是线程安全的。
+    """
+
+    def __init__(
+            self,
+            max_entries: int = 512,
+            max_bytes: int = 32 * 1024 * 1024,
+            ttl: float = 24 * 3600,
+            db_path: Optional[str] = None
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'disk_hits': 0, 'evictions': 0}
+        self._db: Optional[sqlite3.Connection] = None
+        if db_path:
+            self._open_db(db_path)
+
+    def _open_db(self, db_path: str) -> None:
+        try:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._db.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - self.ttl,))
+            self._db.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"Response cache database unavailable ({db_path}): {str(e)}")
+            self._db = None
+
+    def get(self, key: str) -> Optional[str]:
+        """读取缓存，未命中或已过期返回 None"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, created_at = entry
+                if now - created_at <= self.ttl:
+                    self._entries.move_to_end(key)
+                    self._stats['hits'] += 1
+                    return value
+                self._remove_locked(key)
+
+            if self._db is not None:
+                row = self._db_get_locked(key)
+                if row is not None and now - row[1] <= self.ttl:
+                    self._store_locked(key, row[0], row[1])
+                    self._stats['hits'] += 1
+                    self._stats['disk_hits'] += 1
+                    return row[0]
+
+            self._stats['misses'] += 1
+            return None
+
+    def set(self, key: str, value: str) -> None:
+        """写入缓存"""
+        created_at = time.time()
+        with self._lock:
+            self._store_locked(key, value, created_at)
+            if self._db is not None:
+                try:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO responses (key, value, created_at) VALUES (?, ?, ?)",
+                        (key, value, created_at)
+                    )
+                    self._db.commit()
+                except sqlite3.Error as e:
+                    logger.warning(f"Failed to persist cached response: {str(e)}")
+
+    def clear(self) -> None:
+        """清空内存与磁盘缓存"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            if self._db is not None:
+                self._db.execute("DELETE FROM responses")
+                self._db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        """返回命中/未命中计数及当前占用"""
+        with self._lock:
+            lookups = self._stats['hits'] + self._stats['misses']
+            return {
+                **self._stats,
+                'hit_rate': self._stats['hits'] / lookups if lookups else 0.0,
+                'entries': len(self._entries),
+                'bytes': self._bytes
+            }
+
+    def _db_get_locked(self, key: str) -> Optional[Tuple[str, float]]:
+        try:
+            return self._db.execute(
+                "SELECT value, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to read cached response: {str(e)}")
+            return None
+
+    def _store_locked(self, key: str, value: str, created_at: float) -> None:
+        self._remove_locked(key)
+        self._entries[key] = (value, created_at)
+        self._bytes += len(value.encode('utf-8'))
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            oldest = next(iter(self._entries))
+            self._remove_locked(oldest)
+            self._stats['evictions'] += 1
+
+    def _remove_locked(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= len(entry[0].encode('utf-8'))
+
+
+class _Call:
+    """一次进行中的上游调用"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """合并进行中的相同请求
+
+    同一个键同时只执行一次 fn，其余并发调用者等待并共享它的结果（或异常）。调用
+    结束后立即移除记录，之后的请求会重新执行，结果复用交给 ResponseCache。
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, _Call] = {}
+        self._lock = threading.Lock()
+        self._stats = {'executed': 0, 'shared': 0}
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self._stats['shared'] += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                self._stats['executed'] += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def stats(self) -> Dict[str, Any]:
+        """返回实际执行次数与被合并的请求数"""
+        with self._lock:
+            return {**self._stats, 'in_flight': len(self._calls)}
+
+
+_single_flight = SingleFlight()
+
+
+def get_single_flight() -> SingleFlight:
+    """获取进程级请求合并器，所有会话共享"""
+    return _single_flight
+
+
+_response_cache: Optional[ResponseCache] = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache:
+    """获取进程级响应缓存，设置 RESPONSE_CACHE_DB 环境变量即可启用磁盘存储"""
+    global _response_cache
+    with _response_cache_lock:
+        if _response_cache is None:
+            _response_cache = ResponseCache(db_path=os.environ.get("RESPONSE_CACHE_DB"))
+        return _response_cache
+
+
+def configure_response_cache(**kwargs) -> ResponseCache:
+    """按给定参数重建进程级响应缓存（参数同 ResponseCache）"""
+    global _response_cache
+    with _response_cache_lock:
+        _response_cache = ResponseCache(**kwargs)
+        return _response_cache
@@ -0,0 +1,194 @@
+import contextvars
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import Executor, Future
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional, Sequence, Tuple, Type
+
+
+class RetryPolicy:
+    """单类错误的重试策略
+
+    max_attempts 为总尝试次数（含首次）；退避使用 decorrelated jitter：
+    sleep = min(max_delay, uniform(base_delay, 上次等待 * 3))，避免大量客户端同步重试。
+    """
+
+    def __init__(self, max_attempts: int = 3, base_delay: float = 0.5, max_delay: float = 8.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def backoff(self, previous_delay: Optional[float]) -> float:
+        upper = max(self.base_delay, (previous_delay or self.base_delay) * 3)
+        return min(self.max_delay, random.uniform(self.base_delay, upper))
+
+
+NO_RETRY = RetryPolicy(max_attempts=1)
+
+
+class RetryBudget:
+    """进程级重试预算
+
+    统计 window 秒内的请求数与重试数，重试数不得超过 min_retries + ratio × 请求数。
+    provider 大面积故障时重试最多只额外增加约 ratio 的负载，而不是成倍放大。
+    """
+
+    def __init__(self, ratio: float = 0.1, min_retries: int = 10, window: float = 60.0):
+        self.ratio = ratio
+        self.min_retries = min_retries
+        self.window = window
+        self._requests: deque = deque()
+        self._retries: deque = deque()
+        self._lock = threading.Lock()
+        self._rejected = 0
+
+    def record_request(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            self._requests.append(now)
+            self._trim_locked(now)
+
+    def try_spend(self) -> bool:
+        """尝试为一次重试扣减预算，预算不足返回 False"""
+        with self._lock:
+            now = time.monotonic()
+            self._trim_locked(now)
+            if len(self._retries) >= self.min_retries + self.ratio * len(self._requests):
+                self._rejected += 1
+                return False
+            self._retries.append(now)
+            return True
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._trim_locked(time.monotonic())
+            return {'requests': len(self._requests), 'retries': len(self._retries), 'rejected': self._rejected}
+
+    def _trim_locked(self, now: float) -> None:
+        for samples in (self._requests, self._retries):
+            while samples and now - samples[0] > self.window:
+                samples.popleft()
+
+
+# 调用方设置的截止时间（time.monotonic() 时刻），随上下文传递到下游请求
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("request_deadline", default=None)
+
+# 各功能入口（一次页面操作）的总耗时上限（秒），包含排队、重试与分块请求
+FEATURE_DEADLINES: Dict[str, float] = {
+    "chat": 120.0,
+    "writing": 180.0,
+    "travel": 180.0,
+    "medical": 180.0,
+    "legal": 600.0
+}
+
+
+@contextmanager
+def request_deadline(seconds: float) -> Iterator[float]:
+    """在此范围内发出的请求（含重试与等待）总耗时不超过 seconds，嵌套时取更早者"""
+    deadline = time.monotonic() + seconds
+    current = _deadline.get()
+    if current is not None:
+        deadline = min(deadline, current)
+    token = _deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _deadline.reset(token)
+
+
+@contextmanager
+def deadline_at(deadline: Optional[float]) -> Iterator[Optional[float]]:
+    """在此范围内使用给定的截止时刻（例如从其他线程或事件循环带过来的截止时间）"""
+    token = _deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _deadline.reset(token)
+
+
+def current_deadline() -> Optional[float]:
+    return _deadline.get()
+
+
+def submit_in_context(executor: Executor, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Future:
+    """把任务连同当前上下文（含截止时间）一起提交到线程池，线程池默认不继承上下文"""
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+def remaining_time() -> Optional[float]:
+    """当前截止时间前剩余的秒数，未设置截止时间返回 None"""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+class DeadlineExceeded(Exception):
+    """截止时间已到，不再发起请求或重试"""
+    pass
+
+
+class RetryState:
+    """一次调用（可能包含多次尝试）的重试状态"""
+
+    def __init__(self, engine: "RetryEngine", max_attempts: int):
+        self.engine = engine
+        self.max_attempts = max_attempts
+        self.attempt = 0
+        self.deadline = _deadline.get()
+        self._previous_delay: Optional[float] = None
+
+    def remaining(self) -> Optional[float]:
+        return None if self.deadline is None else self.deadline - time.monotonic()
+
+    def attempt_timeout(self, timeout: float) -> float:
+        """本次尝试可用的超时时间，截止时间已过时抛出 DeadlineExceeded"""
+        self.attempt += 1
+        remaining = self.remaining()
+        if remaining is None:
+            return timeout
+        if remaining <= 0:
+            raise DeadlineExceeded("请求已超过截止时间")
+        return min(timeout, remaining)
+
+    def next_delay(self, error: BaseException, min_delay: float = 0.0) -> Optional[float]:
+        """返回重试前的等待秒数；不应重试时返回 None"""
+        policy = self.engine.policy_for(error)
+        if self.attempt >= min(policy.max_attempts, self.max_attempts):
+            return None
+        delay = max(min_delay, policy.backoff(self._previous_delay))
+        remaining = self.remaining()
+        if remaining is not None and delay >= remaining:
+            # 等待结束时已经超过调用方的截止时间，直接放弃
+            return None
+        if not self.engine.budget.try_spend():
+            return None
+        self._previous_delay = delay
+        return delay
+
+
+class RetryEngine:
+    """按错误类型选择重试策略，并受进程级重试预算与调用方截止时间约束"""
+
+    def __init__(
+            self,
+            policies: Sequence[Tuple[Type[BaseException], RetryPolicy]],
+            budget: Optional[RetryBudget] = None,
+            default_policy: RetryPolicy = NO_RETRY
+    ):
+        # 按顺序匹配，子类应排在父类之前
+        self.policies = list(policies)
+        self.budget = budget or RetryBudget()
+        self.default_policy = default_policy
+
+    def policy_for(self, error: BaseException) -> RetryPolicy:
+        for error_type, policy in self.policies:
+            if isinstance(error, error_type):
+                return policy
+        return self.default_policy
+
+    def start(self, max_attempts: int) -> RetryState:
+        """开始一次调用，记入预算的请求数"""
+        self.budget.record_request()
+        return RetryState(self, max_attempts)
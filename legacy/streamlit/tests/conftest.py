@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# 模块平铺在 legacy/streamlit 下，测试直接按模块名导入
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,52 @@
+import api_clients
+from api_clients import ClaudeClient, ClientPool
+
+
+def test_claude_merges_leading_assistant_history_into_system():
+    history = [
+        {"role": "assistant", "content": "你好，我是小助手"},
+        {"role": "user", "content": "在吗"},
+        {"role": "assistant", "content": "在的"}
+    ]
+    payload = ClaudeClient("key").prepare_chat_payload("帮我写首诗", system="人设", history=history)
+    assert payload["messages"][0] == {"role": "user", "content": "在吗"}
+    assert payload["messages"][-1] == {"role": "user", "content": "帮我写首诗"}
+    system = payload["system"][0]["text"]
+    assert system.startswith("人设")
+    assert "你好，我是小助手" in system
+
+
+def test_claude_opening_without_system_prompt():
+    payload = ClaudeClient("key").prepare_chat_payload("问题", history=[{"role": "assistant", "content": "欢迎"}])
+    assert payload["messages"] == [{"role": "user", "content": "问题"}]
+    assert "欢迎" in payload["system"][0]["text"]
+    assert "system" not in ClaudeClient("key").prepare_chat_payload("问题")
+
+
+def test_client_pool_skips_clients_in_use(monkeypatch):
+    closed = []
+    monkeypatch.setattr(api_clients.requests.Session, "close", lambda session: closed.append(session))
+    pool = ClientPool(max_size=1)
+    first = pool.get("glm", "k1")
+    with first._using_session():
+        second = pool.get("glm", "k2")
+        # 正在使用的 first 不被淘汰，池暂时超过上限
+        assert len(pool) == 2
+        assert closed == []
+        pool.get("qwen", "k3")
+        assert second.session in closed
+        assert first.session not in closed
+    pool.evict_idle()
+    assert first.session in closed
+    assert len(pool) == 1
+
+
+def test_close_is_deferred_until_request_finishes(monkeypatch):
+    closed = []
+    monkeypatch.setattr(api_clients.requests.Session, "close", lambda session: closed.append(session))
+    client = ClaudeClient("key")
+    with client._using_session():
+        with client._using_session():
+            client.close()
+        assert closed == []
+    assert closed == [client.session]
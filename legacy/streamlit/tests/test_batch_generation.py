@@ -0,0 +1,73 @@
+import json
+import threading
+
+import pytest
+
+import batch_generation
+from batch_generation import XiaohongshuBatch, load_batch_themes
+
+ITEMS = [{"id": str(i), "theme": f"主题{i}"} for i in range(1, 7)]
+
+
+@pytest.fixture
+def fake_generate(monkeypatch):
+    calls = []
+    failing = set()
+    lock = threading.Lock()
+
+    def generate(theme, model_type, api_key, temperature):
+        with lock:
+            calls.append(theme)
+        if theme in failing:
+            raise RuntimeError("upstream failed")
+        return {"titles": [theme], "content": f"{theme}的正文", "tags": []}
+
+    monkeypatch.setattr(batch_generation, "generate_xiaohongshu_content", generate)
+    return calls, failing
+
+
+def test_run_writes_every_item(tmp_path, fake_generate):
+    calls, _ = fake_generate
+    batch = XiaohongshuBatch(ITEMS, {"glm": "k1", "qwen": "k2"}, output_dir=tmp_path)
+    records = list(batch.run())
+    assert sorted(record["id"] for record in records) == [item["id"] for item in ITEMS]
+    assert all(record["status"] == "ok" for record in records)
+    assert len(calls) == len(ITEMS)
+    exported = [json.loads(line) for line in batch.export_jsonl().decode("utf-8").splitlines()]
+    assert [record["id"] for record in exported] == [item["id"] for item in ITEMS]
+
+
+def test_resume_skips_done_and_retries_failed(tmp_path, fake_generate):
+    calls, failing = fake_generate
+    failing.add("主题3")
+    first = XiaohongshuBatch(ITEMS, {"glm": "k1"}, output_dir=tmp_path)
+    statuses = {record["id"]: record["status"] for record in first.run()}
+    assert statuses["3"] == "error"
+
+    failing.clear()
+    calls.clear()
+    # 同一份输入得到同一个任务，只重新生成失败的条目
+    second = XiaohongshuBatch(ITEMS, {"glm": "k1"}, output_dir=tmp_path)
+    assert second.path == first.path
+    assert [record["id"] for record in second.run()] == ["3"]
+    assert calls == ["主题3"]
+    assert all(record["status"] == "ok" for record in second.records().values())
+
+
+def test_resume_after_half_written_line(tmp_path, fake_generate):
+    calls, _ = fake_generate
+    batch = XiaohongshuBatch(ITEMS[:2], {"glm": "k1"}, output_dir=tmp_path)
+    tmp_path.joinpath(f"{batch.job_id}.jsonl").write_text(
+        json.dumps({"id": "1", "theme": "主题1", "status": "ok"}, ensure_ascii=False) + '\n{"id": "2", "the',
+        encoding="utf-8"
+    )
+    assert [record["id"] for record in batch.run()] == ["2"]
+    assert calls == ["主题2"]
+    assert set(batch.records()) == {"1", "2"}
+
+
+def test_load_batch_themes_csv_and_jsonl():
+    csv_items = load_batch_themes("id,主题,temperature\nA,露营,0.5\nB,,\n,咖啡,\n".encode("utf-8"), "themes.csv")
+    assert csv_items == [{"id": "A", "theme": "露营", "temperature": 0.5}, {"id": "3", "theme": "咖啡"}]
+    jsonl_items = load_batch_themes('"穿搭"\n\n{"theme": "读书", "id": 9}\n'.encode("utf-8"), "themes.jsonl")
+    assert jsonl_items == [{"id": "1", "theme": "穿搭"}, {"id": "9", "theme": "读书"}]
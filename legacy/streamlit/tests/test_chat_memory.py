@@ -0,0 +1,83 @@
+import threading
+
+import chat_memory
+from chat_memory import SlidingSummaryMemory, create_chat_memory
+
+
+def wait_for_summary(memory):
+    memory._future.result(2)
+
+
+def fill(memory, turns, model_type="glm", api_key="key"):
+    for i in range(turns):
+        memory.save_turn(f"问题{i}", f"回答{i}", model_type, api_key)
+
+
+def test_overflow_is_summarized_in_background(monkeypatch):
+    calls = []
+    monkeypatch.setattr(chat_memory, "_summarize",
+                        lambda previous, messages, model_type, api_key: calls.append(len(messages)) or ("摘要", messages))
+    memory = SlidingSummaryMemory(max_turns=2, token_budget=10_000)
+    fill(memory, 3)
+    # 摘要完成前旧对话仍在窗口内
+    assert len(memory.chat_memory.messages) == 6
+    wait_for_summary(memory)
+    assert memory.prepare() == "摘要"
+    assert [message.content for message in memory.chat_memory.messages] == ["问题1", "回答1", "问题2", "回答2"]
+    assert calls == [2]
+
+
+def test_token_budget_folds_old_turns_but_keeps_latest(monkeypatch):
+    monkeypatch.setattr(chat_memory, "_summarize", lambda previous, messages, *args: ("摘要", messages))
+    memory = SlidingSummaryMemory(max_turns=10, token_budget=5)
+    memory.save_turn("很长的问题" * 10, "很长的回答" * 10)
+    assert memory._overflow() == []
+    memory.save_turn("第二个问题", "第二个回答")
+    assert [message.content for message in memory._overflow()] == ["很长的问题" * 10, "很长的回答" * 10]
+
+
+def test_summary_not_applied_after_clear(monkeypatch):
+    release = threading.Event()
+
+    def slow_summarize(previous, messages, *args):
+        release.wait(2)
+        return "旧摘要", messages
+
+    monkeypatch.setattr(chat_memory, "_summarize", slow_summarize)
+    memory = SlidingSummaryMemory(max_turns=1, token_budget=10_000)
+    fill(memory, 2)
+    future = memory._future
+    memory.clear()
+    memory.save_turn("新问题", "新回答")
+    release.set()
+    future.result(2)
+    assert memory.prepare() == ""
+    assert len(memory.chat_memory.messages) == 2
+
+
+def test_failed_summary_keeps_window(monkeypatch):
+    def failing(*args):
+        raise RuntimeError("upstream failed")
+
+    monkeypatch.setattr(chat_memory, "_summarize", failing)
+    memory = SlidingSummaryMemory(max_turns=1, token_budget=10_000)
+    fill(memory, 2)
+    memory._future.exception(2)
+    assert memory.prepare() == ""
+    assert len(memory.chat_memory.messages) == 4
+
+
+def test_no_summary_without_credentials():
+    memory = SlidingSummaryMemory(max_turns=1)
+    fill(memory, 3, model_type=None, api_key=None)
+    assert memory._future is None
+    assert len(memory.chat_memory.messages) == 6
+
+
+def test_create_chat_memory_uses_character_config(monkeypatch):
+    monkeypatch.setitem(chat_memory.CHARACTER_TEMPLATES, "测试人设",
+                        {"memory": {"strategy": "sliding_summary", "max_turns": 3}})
+    memory = create_chat_memory("测试人设")
+    assert isinstance(memory, SlidingSummaryMemory)
+    assert memory.max_turns == 3
+    assert not isinstance(create_chat_memory(None), SlidingSummaryMemory)
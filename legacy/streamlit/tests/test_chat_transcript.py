@@ -0,0 +1,79 @@
+import hashlib
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+from chat_transcript import IncrementalTranscript, get_transcript, render_message
+
+
+def conversation(turns):
+    messages = []
+    for i in range(turns):
+        messages.append(HumanMessage(content=f"问题{i}"))
+        messages.append(AIMessage(content=f"回答{i}"))
+    return messages
+
+
+def fresh_render(messages):
+    return "".join(render_message(message) for message in messages)
+
+
+def test_appending_keeps_prefix_and_matches_full_render():
+    messages = conversation(2)
+    transcript = IncrementalTranscript()
+    first = transcript.render(messages)
+    messages += conversation(3)[4:]
+    second = transcript.render(messages)
+    assert second.startswith(first)
+    assert second == fresh_render(messages)
+    assert [turn["role"] for turn in transcript.turns] == ["user", "assistant"] * 3
+
+
+def test_digest_matches_for_equal_content():
+    messages = conversation(3)
+    incremental = IncrementalTranscript()
+    incremental.render(messages[:2])
+    incremental.render(messages)
+    rebuilt = IncrementalTranscript()
+    rebuilt.render(conversation(3))
+    assert incremental.digest == rebuilt.digest
+    other = IncrementalTranscript()
+    other.render(conversation(2))
+    assert other.digest != rebuilt.digest
+
+
+def test_head_trim_drops_prefix():
+    messages = conversation(4)
+    transcript = IncrementalTranscript()
+    transcript.render(messages)
+    window = messages[2:] + [HumanMessage(content="新问题")]
+    assert transcript.render(window) == fresh_render(window)
+    assert transcript.turns[0] == {"role": "user", "content": "问题1"}
+    rebuilt = IncrementalTranscript()
+    rebuilt.render(window)
+    assert transcript.digest == rebuilt.digest
+
+
+def test_edited_history_is_rebuilt():
+    messages = conversation(2)
+    transcript = IncrementalTranscript()
+    transcript.render(messages)
+    edited = [messages[0], AIMessage(content="改写的回答")] + messages[2:]
+    assert transcript.render(edited) == fresh_render(edited)
+    assert transcript.render([]) == ""
+    assert transcript.digest == hashlib.sha256().hexdigest()
+
+
+def test_empty_messages_are_skipped():
+    messages = [HumanMessage(content="你好"), AIMessage(content=""), HumanMessage(content="在吗")]
+    transcript = IncrementalTranscript()
+    assert transcript.render(messages) == "Human: 你好\nHuman: 在吗\n"
+    assert len(transcript.turns) == 2
+
+
+def test_get_transcript_is_bound_to_memory():
+    class Memory:
+        pass
+
+    memory = Memory()
+    assert get_transcript(memory) is get_transcript(memory)
+    assert get_transcript(Memory()) is not get_transcript(memory)
@@ -0,0 +1,77 @@
+import time
+
+from api_clients import BaseAPIClient, NetworkError, ServerError
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+
+
+def make_breaker(**kwargs):
+    params = dict(min_calls=4, window=60.0, open_duration=0.1, slow_call_seconds=1.0)
+    params.update(kwargs)
+    return CircuitBreaker(**params)
+
+
+def test_opens_after_failure_rate_reached():
+    breaker = make_breaker()
+    for _ in range(2):
+        breaker.record_success(0.1)
+    breaker.record_failure(0.1)
+    assert breaker.state == CLOSED
+    breaker.record_failure(0.1)
+    assert breaker.state == OPEN
+    assert not breaker.allow_request()
+
+
+def test_does_not_open_below_min_calls():
+    breaker = make_breaker()
+    for _ in range(3):
+        breaker.record_failure(0.1)
+    assert breaker.state == CLOSED
+
+
+def test_opens_on_slow_calls():
+    breaker = make_breaker(slow_call_rate=0.75)
+    for _ in range(4):
+        breaker.record_success(2.0)
+    assert breaker.state == OPEN
+
+
+def test_half_open_probe_success_closes():
+    breaker = make_breaker()
+    for _ in range(4):
+        breaker.record_failure(0.1)
+    time.sleep(0.12)
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow_request()
+    # 半开状态只放行一个探测请求
+    assert not breaker.allow_request()
+    breaker.record_success(0.1)
+    assert breaker.state == CLOSED
+    assert breaker.allow_request()
+
+
+def test_half_open_probe_failure_reopens():
+    breaker = make_breaker()
+    for _ in range(4):
+        breaker.record_failure(0.1)
+    time.sleep(0.12)
+    assert breaker.allow_request()
+    breaker.record_failure(0.1)
+    assert breaker.state == OPEN
+
+
+def test_long_completions_with_fast_headers_do_not_trip():
+    breaker = make_breaker()
+    started = time.monotonic() - 25.0
+    for _ in range(5):
+        BaseAPIClient._record_circuit(breaker, None, started, headers_latency=0.3)
+    assert breaker.state == CLOSED
+
+
+def test_errors_without_response_use_total_latency():
+    breaker = make_breaker()
+    started = time.monotonic()
+    BaseAPIClient._record_circuit(breaker, NetworkError("timeout"), started, None)
+    BaseAPIClient._record_circuit(breaker, ServerError("502"), started, 0.1)
+    snapshot = breaker.snapshot()
+    assert snapshot['calls'] == 2
+    assert snapshot['failure_rate'] == 1.0
@@ -0,0 +1,83 @@
+import time
+
+import pytest
+
+import api_clients
+from api_clients import APIError, HedgedClient, ProviderLatencyStats
+
+
+class FakeClient:
+    def __init__(self, first_delay=0.0, chunks=("你好", "世界"), error=None):
+        self.first_delay = first_delay
+        self.chunks = chunks
+        self.error = error
+        self.closed = False
+
+    def stream_chat(self, prompt, temperature=None, **kwargs):
+        try:
+            time.sleep(self.first_delay)
+            if self.error:
+                raise self.error
+            for chunk in self.chunks:
+                yield chunk
+                time.sleep(0.01)
+        finally:
+            self.closed = True
+
+
+@pytest.fixture
+def providers(monkeypatch):
+    clients = {}
+    monkeypatch.setattr(api_clients, "get_client", lambda provider, api_key: clients[provider])
+    return clients
+
+
+def test_stream_uses_primary_when_fast(providers):
+    providers["glm"] = FakeClient()
+    providers["qwen"] = FakeClient(chunks=("备用",))
+    stats = ProviderLatencyStats()
+    client = HedgedClient(("glm", "k1"), [("qwen", "k2")], hedge_after=0.5, stats=stats)
+    assert "".join(client.stream_chat("hi")) == "你好世界"
+    assert stats.snapshot()["glm"]["wins"] == 1
+    assert "qwen" not in stats.snapshot()
+
+
+def test_stream_switches_to_backup_with_first_token(providers):
+    providers["glm"] = FakeClient(first_delay=0.5, chunks=("慢",))
+    providers["qwen"] = FakeClient(chunks=("快", "速"))
+    stats = ProviderLatencyStats()
+    client = HedgedClient(("glm", "k1"), [("qwen", "k2")], hedge_after=0.05, stats=stats)
+    started = time.monotonic()
+    assert "".join(client.stream_chat("hi")) == "快速"
+    assert time.monotonic() - started < 0.4
+    snapshot = stats.snapshot()
+    assert snapshot["qwen"]["wins"] == 1
+    assert snapshot["qwen"]["hedges"] == 1
+    assert snapshot["glm"]["losses"] == 1
+
+
+def test_stream_falls_back_immediately_on_error(providers):
+    providers["glm"] = FakeClient(error=APIError("boom"))
+    providers["qwen"] = FakeClient(chunks=("备用",))
+    client = HedgedClient(("glm", "k1"), [("qwen", "k2")], hedge_after=5, stats=ProviderLatencyStats())
+    started = time.monotonic()
+    assert "".join(client.stream_chat("hi")) == "备用"
+    assert time.monotonic() - started < 1
+
+
+def test_stream_raises_when_all_fail(providers):
+    providers["glm"] = FakeClient(error=APIError("glm down"))
+    providers["qwen"] = FakeClient(chunks=())
+    client = HedgedClient(("glm", "k1"), [("qwen", "k2")], hedge_after=5, stats=ProviderLatencyStats())
+    with pytest.raises(APIError):
+        list(client.stream_chat("hi"))
+
+
+def test_closing_stream_cancels_attempts(providers):
+    providers["glm"] = FakeClient(chunks=("a",) * 50)
+    client = HedgedClient(("glm", "k1"), [], stats=ProviderLatencyStats())
+    stream = client.stream_chat("hi")
+    assert next(stream) == "a"
+    stream.close()
+    time.sleep(0.1)
+    assert providers["glm"].closed
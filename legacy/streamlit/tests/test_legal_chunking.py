@@ -0,0 +1,56 @@
+import utils
+from utils import _batch_legal_sections, split_legal_document
+
+
+def make_contract(count, body="双方应按照约定履行义务，任何一方违约应承担相应责任。"):
+    return "".join(f"第{i}条 {body * 3}\n" for i in range(1, count + 1))
+
+
+def test_chunks_cover_document_within_limit():
+    text = make_contract(120)
+    chunks = split_legal_document(text, max_chars=1000)
+    assert "".join(chunks) == text
+    assert all(len(chunk) <= 1000 for chunk in chunks)
+    assert len(chunks) > 1
+
+
+def test_editing_one_clause_keeps_other_chunks():
+    text = make_contract(120)
+    edited = text.replace("第60条 双方", "第60条 甲乙双方", 1)
+    before = split_legal_document(text, max_chars=1000)
+    after = split_legal_document(edited, max_chars=1000)
+    changed = set(after) - set(before)
+    assert len(changed) <= 2
+    assert len(set(after) & set(before)) >= len(before) - 2
+
+
+def test_oversized_clause_is_split():
+    text = "第1条 " + "很长的条款内容。\n" * 500
+    chunks = split_legal_document(text, max_chars=1000)
+    assert "".join(chunks) == text
+    assert all(len(chunk) <= 1000 for chunk in chunks)
+
+
+def test_batches_respect_budget_and_shrink():
+    sections = ["分析" * 100] * 7
+    batches = _batch_legal_sections(sections, token_budget=450)
+    assert sum(len(batch) for batch in batches) == 7
+    assert all(len(batch) >= 2 for batch in batches)
+    assert len(batches) < len(sections)
+
+
+def test_tree_reduce_keeps_each_request_within_budget(monkeypatch):
+    reduce_inputs = []
+
+    def fake_reduce(sections, document_type, api_key):
+        reduce_inputs.append(sections)
+        return "汇总" * 50
+
+    monkeypatch.setattr(utils, "_analyze_legal_chunk", lambda chunk, document_type, api_key: "分析" * 200)
+    monkeypatch.setattr(utils, "_reduce_legal_sections", fake_reduce)
+    result = utils._analyze_legal_document_chunked(make_contract(200), "contract", "key", token_budget=1000)
+    assert result == "汇总" * 50
+    assert len(reduce_inputs) > 2
+    assert all(len(sections) >= 2 for sections in reduce_inputs)
+    # 最终一次汇总的输入都来自阶段汇总
+    assert all(section.startswith("【第") for section in reduce_inputs[-1])
@@ -0,0 +1,70 @@
+import glob
+import os
+import tempfile
+
+import pytest
+
+import utils
+from pdf_extract import extract_pdf_page_range
+
+
+def make_pdf(page_count):
+    """生成每页一行文本的最小 PDF"""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>"]
+    kids = " ".join(f"{4 + 2 * i} 0 R" for i in range(page_count))
+    objects.append(f"<< /Type /Pages /Kids [{kids}] /Count {page_count} >>".encode())
+    objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    for i in range(page_count):
+        content = f"BT /F1 12 Tf 72 712 Td (Page {i + 1} text) Tj ET".encode()
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents {5 + 2 * i} 0 R "
+                       f"/Resources << /Font << /F1 3 0 R >> >> >>".encode())
+        objects.append(b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream")
+    out = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return out
+
+
+@pytest.fixture(scope="module")
+def pdf_pool():
+    yield
+    pool = utils._pdf_pool
+    if pool is not None:
+        utils._discard_pdf_pool(pool)
+
+
+def temp_pdfs():
+    return set(glob.glob(os.path.join(tempfile.gettempdir(), "tmp*.pdf")))
+
+
+def test_page_range_in_process(tmp_path):
+    path = tmp_path / "doc.pdf"
+    path.write_bytes(make_pdf(5))
+    pages = extract_pdf_page_range(str(path), "digest", 1, 3)
+    assert [text.strip() for text, _ in pages] == ["Page 2 text", "Page 3 text"]
+
+
+def test_process_pool_keeps_page_order(pdf_pool):
+    content = make_pdf(30)
+    before = temp_pdfs()
+    serial = utils.extract_text_from_pdf(content, processes=0)
+    parallel = utils.extract_text_from_pdf(content, processes=2)
+    assert utils._pdf_pool is not None
+    assert parallel == serial
+    assert "Page 1 text" in parallel and "Page 30 text" in parallel
+    assert parallel.index("Page 9 text") < parallel.index("Page 10 text")
+    # 临时文件在提取结束后删除
+    assert temp_pdfs() <= before
+
+
+def test_process_pool_stops_at_char_limit(pdf_pool):
+    text = utils.extract_text_from_pdf(make_pdf(40), max_chars=100, processes=2)
+    assert "Page 1 text" in text
+    assert "Page 40 text" not in text
+    assert "文档共40页" in text
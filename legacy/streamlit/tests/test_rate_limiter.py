@@ -0,0 +1,145 @@
+import asyncio
+import threading
+import time
+
+from api_clients import IMAGE_TOKEN_COST, OUTPUT_TOKEN_ALLOWANCE, GLMClient
+from rate_limiter import RateLimiter
+
+
+def test_acquire_respects_concurrency_and_release():
+    limiter = RateLimiter(max_concurrency=1)
+    assert limiter.acquire()
+    assert not limiter.acquire(timeout=0.05)
+    limiter.release()
+    assert limiter.acquire(timeout=0.05)
+    stats = limiter.stats()
+    assert stats['active'] == 1
+    assert stats['timeouts'] == 1
+
+
+def test_waiter_is_woken_by_release():
+    limiter = RateLimiter(max_concurrency=1)
+    limiter.acquire()
+    acquired = []
+    waiter = threading.Thread(target=lambda: acquired.append(limiter.acquire(timeout=2)))
+    waiter.start()
+    time.sleep(0.05)
+    limiter.release()
+    waiter.join(2)
+    assert acquired == [True]
+
+
+def test_cancelled_event_stops_waiting():
+    limiter = RateLimiter(max_concurrency=1)
+    limiter.acquire()
+    cancelled = threading.Event()
+    result = []
+    waiter = threading.Thread(target=lambda: result.append(limiter.acquire(cancelled=cancelled)))
+    waiter.start()
+    time.sleep(0.05)
+    cancelled.set()
+    with limiter._cond:
+        limiter._cond.notify_all()
+    waiter.join(2)
+    assert result == [False]
+    assert limiter.stats()['waiting'] == 0
+
+
+def test_cancelled_async_waiter_does_not_leak_slot():
+    limiter = RateLimiter(max_concurrency=1)
+
+    async def scenario():
+        limiter.acquire()
+        task = asyncio.create_task(limiter.aacquire())
+        await asyncio.sleep(0.05)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        limiter.release()
+        await asyncio.sleep(0.1)
+
+    asyncio.run(scenario())
+    assert limiter.stats()['active'] == 0
+    assert limiter.acquire(timeout=0.1)
+
+
+def test_slot_taken_while_cancelling_is_released():
+    limiter = RateLimiter(max_concurrency=1)
+
+    async def scenario():
+        limiter.acquire()
+        task = asyncio.create_task(limiter.aacquire())
+        await asyncio.sleep(0.05)
+        # 释放与取消同时发生：等待线程可能已经拿到额度，由回调归还
+        limiter.release()
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        await asyncio.sleep(0.1)
+
+    asyncio.run(scenario())
+    assert limiter.stats()['active'] == 0
+
+
+def test_async_acquire_times_out():
+    limiter = RateLimiter(max_concurrency=1)
+    limiter.acquire()
+    assert asyncio.run(limiter.aacquire(timeout=0.05)) is False
+    assert limiter.stats()['active'] == 1
+
+
+def test_async_waiters_do_not_block_other_limiters():
+    busy = [RateLimiter(max_concurrency=1) for _ in range(40)]
+    idle = RateLimiter(max_concurrency=1)
+
+    async def scenario():
+        for limiter in busy:
+            limiter.acquire()
+        waiters = [asyncio.create_task(limiter.aacquire(timeout=5)) for limiter in busy]
+        await asyncio.sleep(0.05)
+        started = time.monotonic()
+        assert await idle.aacquire(timeout=1)
+        elapsed = time.monotonic() - started
+        for waiter in waiters:
+            waiter.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        return elapsed
+
+    assert asyncio.run(scenario()) < 0.1
+    assert all(limiter.stats()['waiting'] == 0 for limiter in busy)
+
+
+def test_async_waiter_is_woken_by_release_from_thread():
+    limiter = RateLimiter(max_concurrency=1)
+    limiter.acquire()
+
+    async def scenario():
+        threading.Timer(0.05, limiter.release).start()
+        started = time.monotonic()
+        assert await limiter.aacquire(timeout=2)
+        return time.monotonic() - started
+
+    assert asyncio.run(scenario()) < 1
+    assert limiter.stats()['active'] == 1
+
+
+def test_penalize_delays_next_acquire():
+    limiter = RateLimiter()
+    limiter.penalize(0.1)
+    started = time.monotonic()
+    assert limiter.acquire(timeout=1)
+    assert time.monotonic() - started >= 0.09
+
+
+def test_image_payload_charged_fixed_cost():
+    client = GLMClient("key")
+    image = {"type": "image_url", "image_url": {"url": "data:image/png;base64," + "A" * 400_000}}
+    payload = {"model": "glm-4v", "messages": [{"role": "user", "content": [{"type": "text", "text": "识别"}, image]}]}
+    text_only = {"model": "glm-4v", "messages": [{"role": "user", "content": [{"type": "text", "text": "识别"}, None]}]}
+    expected = client.estimate_request_tokens(text_only) + IMAGE_TOKEN_COST
+    assert client.estimate_request_tokens(payload) == expected
+    assert expected < IMAGE_TOKEN_COST + OUTPUT_TOKEN_ALLOWANCE + 100
@@ -0,0 +1,35 @@
+import time
+
+import pytest
+
+from prompt_registry import RenderedPrompt
+from response_cache import ResponseCache, make_cache_key
+
+
+def test_response_cache_ttl_and_eviction():
+    cache = ResponseCache(max_entries=2, ttl=0.1)
+    cache.set("a", "1")
+    cache.set("b", "2")
+    cache.set("c", "3")
+    assert cache.get("a") is None
+    assert cache.get("c") == "3"
+    time.sleep(0.12)
+    assert cache.get("c") is None
+
+
+def test_response_cache_persists_to_disk(tmp_path):
+    db_path = str(tmp_path / "cache.db")
+    ResponseCache(db_path=db_path).set("key", "value")
+    assert ResponseCache(db_path=db_path).get("key") == "value"
+
+
+@pytest.mark.parametrize("a, b", [("hello\r\n", "hello"), ("  hi  \n", "hi")])
+def test_cache_key_normalizes_prompt(a, b):
+    assert make_cache_key("glm", "m", a, 0.7) == make_cache_key("glm", "m", b, 0.7)
+
+
+def test_cache_key_uses_prompt_digest():
+    first = RenderedPrompt("long transcript A", None, "q", digest="abc")
+    second = RenderedPrompt("long transcript B", None, "q", digest="abc")
+    assert make_cache_key("glm", "m", first, 0.7) == make_cache_key("glm", "m", second, 0.7)
+    assert make_cache_key("glm", "m", first, 0.7) != make_cache_key("glm", "m", "long transcript A", 0.7)
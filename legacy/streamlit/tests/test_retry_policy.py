@@ -0,0 +1,46 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from api_clients import run_async
+from retry_policy import (RetryBudget, RetryEngine, RetryPolicy, remaining_time, request_deadline,
+                          submit_in_context)
+
+
+def test_deadline_reaches_pool_threads():
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        assert executor.submit(remaining_time).result() is None
+        with request_deadline(30):
+            remaining = submit_in_context(executor, remaining_time).result()
+    assert remaining is not None and 29 < remaining <= 30
+
+
+def test_deadline_reaches_event_loop():
+    async def read_deadline():
+        return remaining_time()
+
+    with request_deadline(30):
+        remaining = run_async(read_deadline())
+    assert remaining is not None and 29 < remaining <= 30
+
+
+def test_nested_deadline_keeps_earlier():
+    with request_deadline(10):
+        with request_deadline(60):
+            assert remaining_time() <= 10
+    assert remaining_time() is None
+
+
+def test_retry_stops_before_deadline():
+    engine = RetryEngine([(ValueError, RetryPolicy(max_attempts=5, base_delay=1.0, max_delay=1.0))])
+    with request_deadline(0.5):
+        state = engine.start(5)
+    state.attempt_timeout(10)
+    assert state.next_delay(ValueError()) is None
+
+
+def test_retry_budget_limits_retries():
+    budget = RetryBudget(ratio=0.0, min_retries=2)
+    assert budget.try_spend()
+    assert budget.try_spend()
+    assert not budget.try_spend()
+    assert budget.stats()['rejected'] == 1
@@ -0,0 +1,97 @@
+import threading
+import time
+
+from response_cache import SingleFlight
+
+
+def run_concurrently(count, fn):
+    results = [None] * count
+    errors = [None] * count
+
+    def worker(index):
+        try:
+            results[index] = fn()
+        except Exception as e:
+            errors[index] = e
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(2)
+    return results, errors
+
+
+def test_single_flight_shares_result():
+    flight = SingleFlight()
+    calls = []
+
+    def fn():
+        calls.append(1)
+        time.sleep(0.1)
+        return "result"
+
+    results, errors = run_concurrently(4, lambda: flight.do("key", fn))
+    assert results == ["result"] * 4
+    assert errors == [None] * 4
+    assert len(calls) == 1
+    assert flight.stats() == {'executed': 1, 'shared': 3, 'in_flight': 0}
+
+
+def test_single_flight_propagates_error_to_all_waiters():
+    flight = SingleFlight()
+
+    def fn():
+        time.sleep(0.1)
+        raise ValueError("upstream failed")
+
+    results, errors = run_concurrently(3, lambda: flight.do("key", fn))
+    assert all(isinstance(error, ValueError) for error in errors)
+    # 调用结束后不保留错误，下一次请求重新执行
+    assert flight.do("key", lambda: "ok") == "ok"
+
+
+def test_single_flight_different_keys_run_separately():
+    flight = SingleFlight()
+    keys = iter(["a", "b"])
+    lock = threading.Lock()
+
+    def call():
+        with lock:
+            key = next(keys)
+        return flight.do(key, lambda: time.sleep(0.05) or key)
+
+    results, _ = run_concurrently(2, call)
+    assert sorted(results) == ["a", "b"]
+    assert flight.stats()['executed'] == 2
+
+
+def test_pooled_response_does_not_share_across_api_keys(monkeypatch):
+    import utils
+    from api_clients import AuthenticationError
+
+    class FakeClient:
+        model = "fake"
+
+        def __init__(self, api_key):
+            self.api_key = api_key
+
+        def chat(self, prompt, temperature=None):
+            time.sleep(0.1)
+            if self.api_key == "bad":
+                raise AuthenticationError("API密钥无效或已过期")
+            return f"ok-{self.api_key}"
+
+    monkeypatch.setattr(utils, "get_client", lambda model_type, api_key: FakeClient(api_key))
+    keys = iter(["bad", "good"])
+    lock = threading.Lock()
+
+    def call():
+        with lock:
+            api_key = next(keys)
+        return api_key, utils._get_pooled_response("glm", "same prompt", api_key)
+
+    results, _ = run_concurrently(2, call)
+    replies = dict(results)
+    assert replies["good"] == "ok-good"
+    assert "密钥无效" in replies["bad"]
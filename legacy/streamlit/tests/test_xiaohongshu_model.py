@@ -0,0 +1,50 @@
+import json
+
+import pytest
+
+from xiaohongshu_model import XiaohongshuStreamParser, parse_xiaohongshu_json, parse_xiaohongshu_titles
+
+OUTPUT = json.dumps({
+    "titles": ["标题一✨", "标题 \"二\"", "标题三", "标题四", "标题五"],
+    "content": "正文内容",
+    "tags": ["旅行", "#美食"]
+}, ensure_ascii=False)
+
+
+def feed_in_pieces(text, size):
+    parser = XiaohongshuStreamParser()
+    emitted = []
+    for i in range(0, len(text), size):
+        emitted.append(parser.feed(text[i:i + size]))
+    return parser, emitted
+
+
+@pytest.mark.parametrize("size", [1, 3, 17, len(OUTPUT)])
+def test_stream_parser_emits_each_title_once(size):
+    parser, emitted = feed_in_pieces(OUTPUT, size)
+    flat = [title for titles in emitted for title in titles]
+    assert flat == ["标题一✨", "标题 \"二\"", "标题三", "标题四", "标题五"]
+    assert parser.titles == flat
+    assert parser.text == OUTPUT
+
+
+def test_stream_parser_emits_titles_before_content_finishes():
+    parser = XiaohongshuStreamParser()
+    assert parser.feed('```json\n{"titles": ["第一个", "第') == ["第一个"]
+    assert parser.feed('二个"], "content": "正文') == ["第二个"]
+    assert parser.feed('还在输出"}') == []
+
+
+def test_parse_json_tolerates_wrapping_and_trailing_comma():
+    text = '好的：\n```json\n{"titles": ["a", "b", "c", "d", "e", "f"], "content": " 正文 ", "tags": "#旅行#美食",}\n```'
+    data = parse_xiaohongshu_json(text)
+    assert data == {"titles": ["a", "b", "c", "d", "e"], "content": "正文", "tags": ["旅行", "美食"]}
+
+
+def test_parse_json_requires_content():
+    with pytest.raises(ValueError):
+        parse_xiaohongshu_json('{"titles": ["a"]}')
+
+
+def test_parse_titles_only():
+    assert parse_xiaohongshu_titles('{"titles": ["a", " ", "b"]}') == ["a", "b"]
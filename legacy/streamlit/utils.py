@@ -1,18 +1,35 @@
-import time
-import requests
+import os
+import re
 import json
-from typing import Tuple, Dict, List
-from xiaohongshu_model import Xiaohongshu
+import base64
+import hashlib
+import multiprocessing
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from typing import Tuple, Dict, List, Iterator, Optional, Sequence
+from xiaohongshu_model import (Xiaohongshu, XiaohongshuStreamParser, TITLE_COUNT, parse_xiaohongshu_json,
+                               parse_xiaohongshu_titles)
 from prompt_template import system_template_text, user_template_text
+from prompt_registry import RenderedPrompt, register_template
 from langchain.memory import ConversationBufferMemory, ConversationSummaryMemory
 from langchain.chains import ConversationChain
 from langchain_openai import ChatOpenAI
-import dashscope
-from character_templates import CHARACTER_TEMPLATES
-from api_clients import create_client
+from character_templates import PERSONA_MESSAGES, PERSONA_PROMPTS
+from api_clients import (get_client, run_prompt_group, verify_api_key, HedgedClient, APIError, NetworkError)
+from response_cache import get_response_cache, get_single_flight, make_cache_key
+from retry_policy import submit_in_context
+from circuit_breaker import is_provider_available
+from rate_limiter import estimate_tokens
+from chat_transcript import get_transcript
+from pdf_extract import extract_pdf_page, extract_pdf_page_range
+from chat_memory import SlidingSummaryMemory
 import io
 from docx import Document
 import PyPDF2
+from PIL import Image, ImageOps
 import streamlit as st
 
 
@@ -66,31 +83,20 @@ def create_copy_button(text: str, button_text: str = "📋 复制到剪贴板",
     # 渲染HTML
     st.components.v1.html(js_code + html_button, height=80)
 
-def verify_api_key(model_type: str, api_key: str, max_retries: int = 2) -> Tuple[bool, str]:
-    """验证API密钥是否有效，带重试机制"""
-    print(f"开始验证密钥: model_type={model_type}")
+SCRIPT_PROMPT = register_template("script", """你是一位短视频内容创作专家。根据用户给出的主题、时长和创意度，为短视频创作一个详细的脚本。
 
-    for attempt in range(max_retries):
-        try:
-            test_prompt = "Hi"
-            print(f"创建客户端: 第{attempt + 1}次尝试")
-            client = create_client(model_type, api_key, temperature=0.1)
-            print("客户端创建成功，发送测试请求")
-            response = client.chat(test_prompt)
-            print(f"验证成功: {response[:100]}")
-            return True, "API密钥验证成功"
-        except Exception as e:
-            print(f"验证错误: {str(e)}")
-            if attempt == max_retries - 1:
-                error_msg = str(e)
-                if "auth" in error_msg.lower():
-                    return False, "API密钥无效或已过期"
-                elif "rate" in error_msg.lower():
-                    return False, "API调用频率超限"
-                else:
-                    return False, f"验证失败: {error_msg}"
-            time.sleep(1)
-    return False, "验证超时，请稍后重试"
+要求：
+1. 整体内容长度要符合视频时长的要求
+2. 脚本分为【开头】【中间】【结尾】三部分
+3. 开头要吸引眼球，快速抓住观众注意力
+4. 中间部分要有干货内容，注意节奏感
+5. 结尾要有惊喜或意料之外的转折
+6. 整体表达要轻松有趣，适合年轻人观看
+7. 可以加入一些流行梗或者有趣的元素
+
+请直接给出脚本内容，按照【开头】【中间】【结尾】的格式分段输出。""", """主题：{subject}
+时长：{video_length}分钟
+创意度：{creativity}（0-1之间，越大创意性越强）""")
 
 
 def generate_script(subject: str, video_length: float, creativity: float,
@@ -109,36 +115,20 @@ def generate_script(subject: str, video_length: float, creativity: float,
         Tuple[str, str]: (标题, 脚本内容)
     """
     try:
-        client = create_client(model_type, api_key, temperature)
-
         # 生成标题的模板
         title_template = f"请为'{subject}'这个主题的视频想一个吸引人的标题，直接输出标题即可，不要包含任何其他内容和解释。"
 
         # 生成脚本的模板
-        script_template = f"""你是一位短视频内容创作专家。根据以下要求，为短视频创作一个详细的脚本。
-
-主题：{subject}
-时长：{video_length}分钟
-创意度：{creativity}（0-1之间，越大创意性越强）
-
-要求：
-1. 整体内容长度要符合视频时长的要求
-2. 脚本分为【开头】【中间】【结尾】三部分
-3. 开头要吸引眼球，快速抓住观众注意力
-4. 中间部分要有干货内容，注意节奏感
-5. 结尾要有惊喜或意料之外的转折
-6. 整体表达要轻松有趣，适合年轻人观看
-7. 可以加入一些流行梗或者有趣的元素
-
-请直接给出脚本内容，按照【开头】【中间】【结尾】的格式分段输出。"""
-
-        # 生成标题
-        title_response = client.chat(title_template)
+        script_template = SCRIPT_PROMPT.render(subject=subject, video_length=video_length, creativity=creativity)
+
+        # 标题与脚本互不依赖，并发生成
+        title_response, script_response = run_prompt_group(
+            model_type,
+            api_key,
+            [title_template, script_template],
+            temperature=temperature
+        )
         title = title_response.strip()
-
-        # 生成脚本
-        script_prompt = script_template
-        script_response = client.chat(script_prompt)
         script = script_response.strip()
 
         return title, script
@@ -147,96 +137,152 @@ def generate_script(subject: str, video_length: float, creativity: float,
         raise Exception(f"脚本生成失败: {str(e)}")
 
 
-def generate_xiaohongshu_content(theme: str, model_type: str, api_key: str, temperature: float = 0.2) -> dict:
-    """生成小红书内容的函数"""
-    try:
-        client = create_client(model_type, api_key, temperature)
+# 由 Xiaohongshu 模型导出的 JSON Schema，各 provider 据此启用原生结构化输出
+XIAOHONGSHU_SCHEMA = Xiaohongshu.schema()
+_XIAOHONGSHU_TITLES_SCHEMA = {
+    "title": "XiaohongshuTitles",
+    "type": "object",
+    "properties": {"titles": {"type": "array", "items": {"type": "string"}}},
+    "required": ["titles"]
+}
 
-        full_prompt = f"""{system_template_text}
 
-{user_template_text.format(theme=theme)}
+XIAOHONGSHU_PROMPT = register_template(
+    "xiaohongshu", system_template_text, user_template_text,
+    parser_instructions=(
+        "请只输出一个符合以下 JSON Schema 的 JSON 对象，按 titles、content、tags 的顺序输出字段，"
+        f"不要输出其他内容：\n{json.dumps(XIAOHONGSHU_SCHEMA, ensure_ascii=False)}"
+    )
+)
 
-请直接按照以下格式输出内容，不要输出JSON格式：
 
-[标题部分]
-标题1
-标题2
-标题3
-标题4
-标题5
+def _xiaohongshu_prompt(theme: str) -> str:
+    return XIAOHONGSHU_PROMPT.render(theme=theme)
 
-[正文部分]
-正文内容...
 
-[标签部分]
-#标签1 #标签2 #标签3 ..."""
+def _finalize_xiaohongshu(text: str, theme: str, client, temperature: float) -> dict:
+    """解析并校验输出，必要时只做小范围修复而不是整篇重新生成"""
+    try:
+        data = parse_xiaohongshu_json(text)
+    except ValueError as parse_error:
+        print(f"小红书输出解析失败，尝试修复: {str(parse_error)}")
+        repair_prompt = f"""下面是一段格式有误的小红书文案输出。请不要改写内容，只把它整理成符合以下 JSON Schema 的 JSON 对象并输出：
+{json.dumps(XIAOHONGSHU_SCHEMA, ensure_ascii=False)}
 
-        # 获取响应
-        response = client.chat(full_prompt)
+原输出：
+{text}"""
+        data = parse_xiaohongshu_json(client.chat(repair_prompt, temperature=0, response_schema=XIAOHONGSHU_SCHEMA))
 
-        try:
-            # 解析返回的内容
-            sections = response.split('[')
-            titles = []
-            content = ""
-            tags = []
-
-            for section in sections:
-                if '标题部分]' in section:
-                    # 提取标题
-                    titles_text = section.split(']')[1].strip()
-                    titles = [t.strip() for t in titles_text.split('\n') if t.strip()]
-                elif '正文部分]' in section:
-                    # 提取正文
-                    content = section.split(']')[1].strip()
-                elif '标签部分]' in section:
-                    # 提取标签
-                    tags_text = section.split(']')[1].strip()
-                    tags = [tag.strip('#') for tag in tags_text.split('#') if tag.strip()]
-
-            # 确保至少有一个标题
-            if not titles:
-                titles = ["✨ " + theme]
-
-            # 确保有5个标题
-            while len(titles) < 5:
-                titles.append(titles[0] + f" - 版本{len(titles)+1}")
-
-            # 返回结果
-            return {
-                'titles': titles[:5],  # 只取前5个标题
-                'content': content,
-                'tags': tags
-            }
+    missing = TITLE_COUNT - len(data['titles'])
+    if missing > 0:
+        # 只补写缺少的标题
+        titles_prompt = f"""主题：{theme}
+已有标题：{json.dumps(data['titles'], ensure_ascii=False)}
+请再写{missing}个风格一致、互不重复、20字以内并包含emoji的小红书标题，只输出 JSON：{{"titles": [...]}}"""
+        extra = client.chat(titles_prompt, temperature=temperature, response_schema=_XIAOHONGSHU_TITLES_SCHEMA)
+        data['titles'] = (data['titles'] + parse_xiaohongshu_titles(extra))[:TITLE_COUNT]
+
+    return Xiaohongshu(**data).dict()
 
-        except Exception as parse_error:
-            raise ValueError(f"解析响应内容出错: {str(parse_error)}")
 
+def generate_xiaohongshu_content(theme: str, model_type: str, api_key: str, temperature: float = 0.2) -> dict:
+    """生成小红书内容的函数（结构化 JSON 输出）"""
+    try:
+        # 使用进程级客户端池，批量生成时复用连接与限流器
+        client = get_client(model_type, api_key)
+        response = client.chat(_xiaohongshu_prompt(theme), temperature=temperature, response_schema=XIAOHONGSHU_SCHEMA)
+        return _finalize_xiaohongshu(response, theme, client, temperature)
     except Exception as e:
         raise Exception(f"小红书内容生成失败: {str(e)}")
 
 
-def generate_character_prompt(character_type: str, user_prompt: str) -> str:
-    """根据选择的人设生成完整的提示词"""
-    if character_type not in CHARACTER_TEMPLATES:
-        return user_prompt
+def stream_xiaohongshu_content(theme: str, model_type: str, api_key: str,
+                               temperature: float = 0.2) -> Iterator[Tuple[str, object]]:
+    """流式生成小红书内容
 
-    character = CHARACTER_TEMPLATES[character_type]
-    system_prompt = f"""
-{character['personality']}
+    每解析出一个完整标题就产出 ("title", 标题)，输出结束后产出 ("result", 结果字典)。
+    """
+    try:
+        client = get_client(model_type, api_key)
+        parser = XiaohongshuStreamParser()
+        for delta in client.stream_chat(_xiaohongshu_prompt(theme), temperature=temperature,
+                                        response_schema=XIAOHONGSHU_SCHEMA):
+            for title in parser.feed(delta):
+                yield "title", title
+        yield "result", _finalize_xiaohongshu(parser.text, theme, client, temperature)
+    except Exception as e:
+        raise Exception(f"小红书内容生成失败: {str(e)}")
 
-以下是一些你的回复示例，请参考其中的语气和风格：
-{chr(10).join(character['example_responses'])}
 
-请始终保持这个人设风格回复用户的消息。
-现在用户说：{user_prompt}
-"""
-    return system_prompt
+def generate_character_prompt(character_type: str, user_prompt: str) -> str:
+    """根据选择的人设生成完整的提示词（人设在导入时已预编译）"""
+    if character_type not in PERSONA_PROMPTS:
+        return user_prompt
+    return PERSONA_PROMPTS[character_type].render(user_prompt=user_prompt)
+
+
+# 需要从特定人设回复中移除的emoji
+CHARACTER_UNWANTED_EMOJIS = {
+    "性感冷艳御姐": [
+        "😏", "😌", "🤔", "😎",  # 傲慢/邪魅类
+    ]
+}
+
+
+def _build_full_prompt(prompt: str, memory: ConversationBufferMemory,
+                       character_type: str = None, is_chat_feature: bool = False) -> str:
+    """组装发送给模型的完整提示词（聊天功能附带历史记忆和人设）"""
+    # 只有在聊天功能中才使用历史记忆和人设
+    if not (is_chat_feature and memory):
+        # 其他功能直接使用原始prompt
+        return prompt
+
+    # 滑动窗口记忆：先应用后台已完成的摘要，窗口外的旧对话以摘要形式带入
+    summary = memory.prepare() if isinstance(memory, SlidingSummaryMemory) else ""
+    # 增量维护的对话记录：每轮只处理新增消息，历史消息与记录摘要都随之增量更新
+    transcript = get_transcript(memory)
+    transcript_text = transcript.render(memory.chat_memory.messages)
+    history = transcript.turns
+    summary_note = f"（更早的对话摘要：{summary}）\n" if summary else ""
+    if summary_note and history:
+        history = [{**history[0], "content": summary_note + history[0]["content"]}] + history[1:]
+
+    # 请求按 冻结的人设系统消息 → 历史消息 → 当前问题 的顺序发送（只在聊天功能中应用人设）
+    persona = PERSONA_MESSAGES.get(character_type, ()) if character_type else ()
+    system = persona[0]["content"] if persona else None
+    user = prompt if history or not summary_note else summary_note + prompt
+
+    # 字符串形式为 人设前缀 + 对话记录 + 当前问题；缓存键使用记录的增量摘要，不再哈希全文
+    feature = f"character.{character_type}" if persona else "chat"
+    text = (PERSONA_PROMPTS[character_type].prefix if persona else "") + summary_note + \
+        transcript_text + f"Human: {prompt}\n"
+    digest = hashlib.sha256(
+        json.dumps([feature, summary, transcript.digest, prompt], ensure_ascii=False).encode('utf-8')
+    ).hexdigest()
+    return RenderedPrompt(text, system, user, feature, history, digest)
+
+
+def _save_chat_turn(memory: ConversationBufferMemory, prompt: str, response: str,
+                    model_type: str, api_key: str) -> None:
+    """保存一轮对话；滑动窗口记忆会在后台折叠超出预算的旧对话"""
+    if isinstance(memory, SlidingSummaryMemory):
+        memory.save_turn(prompt, response, model_type, api_key)
+    else:
+        memory.chat_memory.add_user_message(prompt)
+        memory.chat_memory.add_ai_message(response)
+
+
+def _filter_character_emojis(text: str, character_type: str = None) -> str:
+    """特定人设的表情符号过滤"""
+    for emoji in CHARACTER_UNWANTED_EMOJIS.get(character_type, []):
+        text = text.replace(emoji, '')
+    return text
 
 
 def get_chat_response(prompt: str, memory: ConversationBufferMemory,
                       model_type: str, api_key: str, character_type: str = None,
-                      is_chat_feature: bool = False) -> str:
+                      is_chat_feature: bool = False, use_cache: bool = False,
+                      hedge_with: Optional[Sequence[Tuple[str, str]]] = None) -> str:
     """Generate chat response with memory support
 
     Args:
@@ -246,73 +292,32 @@ def get_chat_response(prompt: str, memory: ConversationBufferMemory,
         api_key: API key for the selected model
         character_type: Optional character personality type
         is_chat_feature: Whether this is being used in chat mode
+        use_cache: Whether to serve/store the response in the response cache
+        hedge_with: Optional backup (model_type, api_key) pairs for hedged requests
 
     Returns:
         str: Generated response text
     """
     try:
-        # 只有在聊天功能中才使用历史记忆和人设
-        if is_chat_feature and memory:
-            chat_history = ""
-            if memory.chat_memory.messages:
-                for message in memory.chat_memory.messages:
-                    if hasattr(message, 'content') and message.content:
-                        role = 'Human' if message.type == 'human' else 'Assistant'
-                        chat_history += f"{role}: {message.content}\n"
-
-            full_prompt = f"""
-历史对话:
-{chat_history}
-
-当前问题: {prompt}
-
-请基于以上历史对话回答当前问题。
-"""
-            # 只在聊天功能中应用人设
-            if character_type:
-                full_prompt = generate_character_prompt(character_type, full_prompt)
-        else:
-            # 其他功能直接使用原始prompt
-            full_prompt = prompt
+        full_prompt = _build_full_prompt(prompt, memory, character_type, is_chat_feature)
 
         print(f"Using model: {model_type}")
 
         # 根据不同模型获取响应
-        response = ""
-        if model_type == "qwen":
-            response = _get_qwen_response(full_prompt, api_key)
-        elif model_type == "chatgpt":
-            response = _get_chatgpt_response(full_prompt, api_key)
-        elif model_type == "claude":
-            response = _get_claude_response(full_prompt, api_key)
-        elif model_type == "glm":
-            response = _get_glm_response(full_prompt, api_key)
-        else:
+        if model_type not in ("qwen", "chatgpt", "claude", "glm"):
             raise ValueError(f"不支持的模型类型: {model_type}")
+        response = _get_pooled_response(model_type, full_prompt, api_key, use_cache=use_cache,
+                                        hedge_with=hedge_with)
 
         if not response or response.startswith("API"):
             print(f"Warning: Invalid response: {response}")
             return "抱歉，我暂时无法生成有效回复，请稍后再试。"
 
-        # 特定人设的表情符号过滤
-        if character_type == "性感冷艳御姐":
-            # 定义需要移除的emoji列表
-            unwanted_emojis = [
-                "😏", "😌", "🤔", "😎",  # 傲慢/邪魅类
-            ]
-            # 允许使用的emoji列表（用于提示词）
-            allowed_emojis = [
-                "🌹", "💗", "💕", "🥰",  # 玫瑰和可爱类
-                "💋", "✨", "👗", "💄", "😜", "😝"  # 优雅类
-            ]
-            # 替换不想要的emoji
-            for emoji in unwanted_emojis:
-                response = response.replace(emoji, '')
+        response = _filter_character_emojis(response, character_type)
 
         # 只在聊天功能中保存对话记忆
         if is_chat_feature and memory:
-            memory.chat_memory.add_user_message(prompt)
-            memory.chat_memory.add_ai_message(response)
+            _save_chat_turn(memory, prompt, response, model_type, api_key)
 
         return response
 
@@ -321,189 +326,280 @@ def get_chat_response(prompt: str, memory: ConversationBufferMemory,
         return f"抱歉，处理请求时出现错误: {str(e)}"
 
 
-def _get_qwen_response(prompt: str, api_key: str) -> str:
-    """Get response from Qwen API with better error handling"""
-    try:
-        dashscope.api_key = api_key
-        response = dashscope.Generation.call(
-            model='qwen-max',
-            messages=[{'role': 'user', 'content': prompt}],
-            result_format='message'
-        )
-        print(f"Qwen API Response: {response}")  # 打印完整响应用于调试
-
-        if response.status_code == 200:
-            # 从新的响应格式中提取文本
-            if response.output and response.output.choices:
-                message = response.output.choices[0].get('message', {})
-                response_text = message.get('content', '')
-                if response_text:
-                    return response_text
+def stream_chat_response(prompt: str, memory: ConversationBufferMemory,
+                         model_type: str, api_key: str, character_type: str = None,
+                         is_chat_feature: bool = False, use_cache: bool = False,
+                         hedge_with: Optional[Sequence[Tuple[str, str]]] = None) -> Iterator[str]:
+    """get_chat_response 的流式版本，随模型输出逐段返回文本
 
-            print("Warning: Could not extract valid response from Qwen API output")
-            return "抱歉，我没有得到有效的回复，请重试。"
-        else:
-            error_msg = f"API调用失败: {response.code}, {response.message}"
-            print(f"Qwen API Error: {error_msg}")
-            return f"API调用出错: {response.message}"
+    参数与 get_chat_response 相同，可直接交给 st.write_stream 渲染。出错时以文本形式
+    返回错误提示；只有完整生成的回复才会写入对话记忆和响应缓存。
+    """
+    chunks = []
+    cache_key = None
+    try:
+        full_prompt = _build_full_prompt(prompt, memory, character_type, is_chat_feature)
+
+        print(f"Using model (stream): {model_type}")
+
+        client = get_client(model_type, api_key)
+        if use_cache:
+            cache_key = make_cache_key(model_type, client.model, full_prompt, 0.7)
+            cached = get_response_cache().get(cache_key)
+            if cached is not None:
+                yield cached
+                return
+        if hedge_with:
+            client = HedgedClient((model_type, api_key), hedge_with)
+        for delta in client.stream_chat(full_prompt, temperature=0.7):
+            delta = _filter_character_emojis(delta, character_type)
+            if delta:
+                chunks.append(delta)
+                yield delta
     except Exception as e:
-        print(f"Error in Qwen API call: {str(e)}")
-        return f"API调用异常: {str(e)}"
-
-
-def _get_chatgpt_response(prompt: str, api_key: str) -> str:
-    """Get response from ChatGPT API with better error handling"""
+        print(f"Error in stream_chat_response: {str(e)}")
+        if chunks:
+            yield f"\n\n（回复中断: {str(e)}）"
+        else:
+            yield f"抱歉，处理请求时出现错误: {str(e)}"
+        return
+
+    if not chunks:
+        yield "抱歉，我暂时无法生成有效回复，请稍后再试。"
+        return
+
+    if cache_key:
+        get_response_cache().set(cache_key, "".join(chunks))
+
+    # 只在聊天功能中保存对话记忆
+    if is_chat_feature and memory:
+        _save_chat_turn(memory, prompt, "".join(chunks), model_type, api_key)
+
+
+def get_hedge_targets(model_type: str) -> List[Tuple[str, str]]:
+    """侧边栏开启对冲请求时，返回可作为备用的其他已验证模型 (model_type, api_key)"""
+    if not st.session_state.get("hedge_enabled"):
+        return []
+    return [
+        (other, key) for other, key in st.session_state.get("api_keys", {}).items()
+        if other != model_type and key and st.session_state.get(f"{other}_verified")
+        and is_provider_available(other)
+    ]
+
+
+def _get_pooled_response(model_type: str, prompt: str, api_key: str, temperature: float = 0.7,
+                         use_cache: bool = False,
+                         hedge_with: Optional[Sequence[Tuple[str, str]]] = None) -> str:
+    """通过进程级客户端池获取模型响应，复用 keep-alive 连接
+
+    use_cache 为 True 时按 (provider, model, 提示词, temperature) 读写响应缓存，
+    只缓存成功的响应。无论是否启用缓存，使用同一密钥并发的相同请求（来自同一或
+    不同会话）都只发起一次上游调用并共享结果；不同密钥的请求不合并，一个密钥的
+    鉴权或额度错误不会传给其他用户，费用也记在各自的密钥上。提供 hedge_with 时以对冲模式请求，主模型
+    首 token 过慢时由备用模型兜底。
+    """
     try:
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json"
-        }
-        data = {
-            "model": "gpt-4",
-            "messages": [{"role": "user", "content": prompt}],
-            "temperature": 0.7
-        }
-        response = requests.post(
-            "https://api.openai.com/v1/chat/completions",
-            headers=headers,
-            json=data,
-            timeout=30  # 添加超时设置
-        )
-        response.raise_for_status()
-        content = response.json()['choices'][0]['message']['content']
+        client = get_client(model_type, api_key)
+        cache_key = make_cache_key(model_type, client.model, prompt, temperature)
+        if hedge_with:
+            client = HedgedClient((model_type, api_key), hedge_with)
+        if use_cache:
+            cached = get_response_cache().get(cache_key)
+            if cached is not None:
+                return cached
+        flight_key = f"{cache_key}:{hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:16]}"
+        content = get_single_flight().do(flight_key, lambda: client.chat(prompt, temperature=temperature))
         if not content:
-            print("Warning: Empty response from ChatGPT API")
+            print(f"Warning: Empty response from {model_type} API")
             return "抱歉，我没有得到有效的回复，请重试。"
+        if use_cache:
+            get_response_cache().set(cache_key, content)
         return content
-    except requests.exceptions.RequestException as e:
-        print(f"ChatGPT API Request Error: {str(e)}")
+    except NetworkError as e:
+        print(f"{model_type} API Network Error: {str(e)}")
+        return f"API请求超时，请稍后重试。建议：\n1. 检查网络连接\n2. 尝试缩短输入内容\n3. 如果问题持续，可以选择其他AI模型"
+    except APIError as e:
+        print(f"{model_type} API Request Error: {str(e)}")
         return f"API请求异常: {str(e)}"
     except Exception as e:
-        print(f"Error in ChatGPT API call: {str(e)}")
+        print(f"Error in {model_type} API call: {str(e)}")
         return f"API调用异常: {str(e)}"
 
 
-def _get_claude_response(prompt: str, api_key: str) -> str:
-    """Get response from Claude API with better error handling"""
-    try:
-        headers = {
-            "anthropic-version": "2023-06-01",
-            "x-api-key": api_key,
-            "content-type": "application/json"
-        }
-        data = {
-            "model": "claude-3-sonnet-20240229",
-            "messages": [{"role": "user", "content": prompt}],
-            "temperature": 0.7
-        }
-        response = requests.post(
-            "https://api.anthropic.com/v1/messages",
-            headers=headers,
-            json=data,
-            timeout=30
-        )
-        response.raise_for_status()
-        content = response.json()['content'][0]['text']
-        if not content:
-            print("Warning: Empty response from Claude API")
-            return "抱歉，我没有得到有效的回复，请重试。"
-        return content
-    except requests.exceptions.RequestException as e:
-        print(f"Claude API Request Error: {str(e)}")
-        return f"API请求异常: {str(e)}"
-    except Exception as e:
-        print(f"Error in Claude API call: {str(e)}")
-        return f"API调用异常: {str(e)}"
+def _get_qwen_response(prompt: str, api_key: str) -> str:
+    """Get response from Qwen API with better error handling"""
+    return _get_pooled_response("qwen", prompt, api_key)
 
 
-def _get_glm_response(prompt: str, api_key: str, max_retries: int = 3, timeout: int = 60) -> str:
-    """Get response from GLM API with improved error handling and retry mechanism
+def _get_chatgpt_response(prompt: str, api_key: str) -> str:
+    """Get response from ChatGPT API with better error handling"""
+    return _get_pooled_response("chatgpt", prompt, api_key)
 
-    Args:
-        prompt: The prompt text to send
-        api_key: GLM API key
-        max_retries: Maximum number of retry attempts
-        timeout: Timeout in seconds for the request
 
-    Returns:
-        Response text from the API
-    """
-    import requests
-    from requests.adapters import HTTPAdapter
-    from urllib3.util.retry import Retry
-    import time
-
-    # 创建一个带重试机制的session
-    session = requests.Session()
-    retries = Retry(
-        total=max_retries,
-        backoff_factor=1,  # 重试间隔会按1, 2, 4秒延长
-        status_forcelist=[500, 502, 503, 504],
-        allowed_methods=["POST"]
-    )
-    session.mount('https://', HTTPAdapter(max_retries=retries))
+def _get_claude_response(prompt: str, api_key: str) -> str:
+    """Get response from Claude API with better error handling"""
+    return _get_pooled_response("claude", prompt, api_key)
 
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json"
-    }
 
-    data = {
-        "model": "glm-4-plus",
-        "messages": [{"role": "user", "content": prompt}],
-        "temperature": 0.7
-    }
+def _get_glm_response(prompt: str, api_key: str, use_cache: bool = False) -> str:
+    """Get response from GLM API with improved error handling"""
+    return _get_pooled_response("glm", prompt, api_key, use_cache=use_cache)
 
-    for attempt in range(max_retries):
-        try:
-            response = session.post(
-                "https://open.bigmodel.cn/api/paas/v4/chat/completions",
-                headers=headers,
-                json=data,
-                timeout=timeout  # 增加超时时间
-            )
 
-            response.raise_for_status()
-            content = response.json()['choices'][0]['message']['content']
+# PDF 提取上限：超过页数或文本字符数后提前停止，避免超长文档占满内存
+PDF_MAX_PAGES = 200
+PDF_MAX_CHARS = 500_000
+# 页数达到该值时才启用多进程提取，小文件用进程池反而更慢
+PDF_PROCESS_MIN_PAGES = 40
+PDF_PAGES_PER_TASK = 8
 
-            if not content:
-                print("Warning: Empty response from GLM API")
-                return "抱歉，我没有得到有效的回复，请重试。"
-            return content
+# 进程级共享的 PDF 提取进程池，首次需要时创建。使用 spawn 启动子进程：Streamlit
+# 服务端是多线程的，fork 出的子进程可能继承其他线程持有的锁而死锁
+_pdf_pool: Optional[ProcessPoolExecutor] = None
+_pdf_pool_lock = threading.Lock()
 
-        except requests.exceptions.Timeout:
-            if attempt == max_retries - 1:
-                print(f"GLM API final timeout after {max_retries} attempts")
-                return f"API请求超时，请稍后重试。建议：\n1. 检查网络连接\n2. 尝试缩短输入内容\n3. 如果问题持续，可以选择其他AI模型"
 
-            print(f"GLM API timeout on attempt {attempt + 1}, retrying...")
-            time.sleep(2 ** attempt)  # 指数退避
+def _get_pdf_pool() -> ProcessPoolExecutor:
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is None:
+            _pdf_pool = ProcessPoolExecutor(max_workers=os.cpu_count() or 1,
+                                            mp_context=multiprocessing.get_context("spawn"))
+        return _pdf_pool
 
-        except requests.exceptions.RequestException as e:
-            if attempt == max_retries - 1:
-                print(f"GLM API Request Error: {str(e)}")
-                return f"API请求异常: {str(e)}"
 
-            print(f"GLM API error on attempt {attempt + 1}, retrying... Error: {str(e)}")
-            time.sleep(2 ** attempt)
+def _discard_pdf_pool(pool: ProcessPoolExecutor) -> None:
+    """子进程异常退出后进程池不可再用，丢弃后下次重新创建"""
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is pool:
+            _pdf_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
 
-        except Exception as e:
-            print(f"Error in GLM API call: {str(e)}")
-            return f"API调用异常: {str(e)}"
 
-    return "请求失败，请稍后重试"
+def _iter_pdf_pages_parallel(file_content: bytes, page_count: int,
+                             processes: int) -> Iterator[Tuple[str, Optional[bytes]]]:
+    """多进程按页段提取，按页序逐页返回；调用方停止迭代时取消未开始的页段
 
+    文档写入临时文件后按路径交给子进程，每个子进程只解析一次；processes 限制
+    同时在途的页段数。
+    """
+    pool = _get_pdf_pool()
+    digest = hashlib.sha256(file_content).hexdigest()
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as f:
+        f.write(file_content)
+        path = f.name
+    ranges = iter([
+        (start, min(start + PDF_PAGES_PER_TASK, page_count))
+        for start in range(0, page_count, PDF_PAGES_PER_TASK)
+    ])
+    pending = deque()
+    try:
+        # 只保持有限个页段在途，既能并行又不会一次性提取整本文档
+        for start, stop in ranges:
+            pending.append(pool.submit(extract_pdf_page_range, path, digest, start, stop))
+            if len(pending) >= processes * 2:
+                break
+        while pending:
+            yield from pending.popleft().result()
+            next_range = next(ranges, None)
+            if next_range is not None:
+                pending.append(pool.submit(extract_pdf_page_range, path, digest, *next_range))
+    except BrokenProcessPool:
+        _discard_pdf_pool(pool)
+        raise
+    finally:
+        for future in pending:
+            future.cancel()
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _iter_pdf_pages(pdf_reader, file_content: bytes, page_count: int, ocr_api_key: Optional[str],
+                    processes: Optional[int]) -> Iterator[Tuple[int, str]]:
+    if processes is None:
+        processes = (os.cpu_count() or 1) if page_count >= PDF_PROCESS_MIN_PAGES else 0
+    if processes > 1:
+        pages = _iter_pdf_pages_parallel(file_content, page_count, processes)
+    else:
+        pages = (extract_pdf_page(pdf_reader.pages[index]) for index in range(page_count))
+
+    # 没有文本层的页面并发 OCR，结果仍按页序返回
+    ocr_executor = ThreadPoolExecutor(max_workers=OCR_MAX_WORKERS, thread_name_prefix="pdf-ocr") if ocr_api_key else None
+    pending = deque()
+
+    def resolve(item) -> str:
+        if not isinstance(item, Future):
+            return item
+        try:
+            return item.result()
+        except Exception as e:
+            print(f"PDF page OCR failed: {str(e)}")
+            return ""
 
-def extract_text_from_pdf(file_content: bytes) -> str:
-    """从PDF文件内容中提取文本"""
     try:
-        pdf_file = io.BytesIO(file_content)
-        pdf_reader = PyPDF2.PdfReader(pdf_file)
+        for index, (text, image) in enumerate(pages):
+            if image is not None and ocr_executor is not None:
+                pending.append((index, submit_in_context(ocr_executor, extract_text_from_image, image, ocr_api_key)))
+            else:
+                pending.append((index, text))
+            while pending and not (isinstance(pending[0][1], Future) and not pending[0][1].done()):
+                head_index, item = pending.popleft()
+                yield head_index, resolve(item)
+        while pending:
+            head_index, item = pending.popleft()
+            yield head_index, resolve(item)
+    finally:
+        pages.close()
+        if ocr_executor is not None:
+            ocr_executor.shutdown(wait=False, cancel_futures=True)
+
+
+def iter_pdf_pages(file_content: bytes, max_pages: int = PDF_MAX_PAGES, ocr_api_key: Optional[str] = None,
+                   processes: Optional[int] = None) -> Iterator[Tuple[int, str]]:
+    """逐页惰性提取 PDF 文本，返回 (页码下标, 文本)
+
+    Args:
+        file_content: PDF 文件内容
+        max_pages: 最多提取的页数
+        ocr_api_key: 提供 GLM 密钥时，没有文本层的扫描页改用 OCR 识别
+        processes: 进程数；None 表示页数较多时自动使用全部 CPU，0 或 1 表示在当前进程提取
+    """
+    pdf_reader = PyPDF2.PdfReader(io.BytesIO(file_content))
+    page_count = min(len(pdf_reader.pages), max_pages)
+    yield from _iter_pdf_pages(pdf_reader, file_content, page_count, ocr_api_key, processes)
+
 
-        text = ""
-        for page in pdf_reader.pages:
-            text += page.extract_text() + "\n"
+def extract_text_from_pdf(file_content: bytes, max_pages: int = PDF_MAX_PAGES, max_chars: int = PDF_MAX_CHARS,
+                          ocr_api_key: Optional[str] = None, processes: Optional[int] = None) -> str:
+    """从PDF文件内容中提取文本
 
+    逐页提取，达到页数或字符上限即停止并在末尾注明截断位置。
+    """
+    try:
+        pdf_reader = PyPDF2.PdfReader(io.BytesIO(file_content))
+        total_pages = len(pdf_reader.pages)
+        page_count = min(total_pages, max_pages)
+
+        page_texts = []
+        total_chars = 0
+        extracted = 0
+        pages = _iter_pdf_pages(pdf_reader, file_content, page_count, ocr_api_key, processes)
+        try:
+            for _, page_text in pages:
+                page_texts.append(page_text)
+                total_chars += len(page_text) + 1
+                extracted += 1
+                if total_chars >= max_chars:
+                    break
+        finally:
+            pages.close()
+
+        text = "\n".join(page_texts) + "\n" if page_texts else ""
+        if extracted < total_pages:
+            text += f"\n（文档共{total_pages}页，超出处理上限，仅提取了前{extracted}页）\n"
         return text
     except Exception as e:
         raise Exception(f"PDF文件读取失败: {str(e)}")
@@ -520,22 +616,101 @@ def extract_text_from_docx(file_content: bytes) -> str:
     except Exception as e:
         raise Exception(f"Word文件读取失败: {str(e)}")
 
-def extract_text_from_image(image_content: bytes, api_key: str) -> str:
-    """从图片中提取文字内容，使用GLM-4V-Flash模型"""
-    import base64
-    import requests
+# GLM-4V 实际处理的图片分辨率上限（长边像素），更大的图片只会增加上传字节和延迟
+OCR_MAX_IMAGE_SIDE = 1120
+OCR_JPEG_QUALITY = 85
+OCR_MODEL = "glm-4v-flash"
+
+_IMAGE_MIME_TYPES = {
+    'JPEG': 'image/jpeg',
+    'PNG': 'image/png',
+    'WEBP': 'image/webp',
+    'GIF': 'image/gif',
+    'BMP': 'image/bmp'
+}
+
+
+def _sniff_image_mime(image_content: bytes) -> str:
+    """根据文件头判断图片的 MIME 类型"""
+    if image_content.startswith(b'\x89PNG'):
+        return 'image/png'
+    if image_content[:4] == b'RIFF' and image_content[8:12] == b'WEBP':
+        return 'image/webp'
+    if image_content[:3] == b'GIF':
+        return 'image/gif'
+    if image_content[:2] == b'BM':
+        return 'image/bmp'
+    return 'image/jpeg'
+
+
+def prepare_image_for_ocr(image_content: bytes) -> Tuple[bytes, str, str]:
+    """把图片规范化为发送给视觉模型的格式
 
+    按 EXIF 方向摆正后缩放到模型实际使用的分辨率，并重新压缩为 JPEG；已经足够小的
+    JPEG 原样发送。内容哈希基于规范化后的像素计算，同一扫描件重新保存或重新上传
+    也能得到相同的哈希。
+
+    Returns:
+        Tuple[bytes, str, str]: (图片数据, MIME 类型, 内容哈希)
+    """
     try:
+        with Image.open(io.BytesIO(image_content)) as image:
+            source_format = image.format
+            image = ImageOps.exif_transpose(image)
+            if image.mode in ('RGBA', 'LA', 'P'):
+                # 透明背景铺白，避免转 JPEG 后变黑
+                image = image.convert('RGBA')
+                background = Image.new('RGB', image.size, (255, 255, 255))
+                background.paste(image, mask=image.getchannel('A'))
+                image = background
+            elif image.mode != 'RGB':
+                image = image.convert('RGB')
+
+            resized = max(image.size) > OCR_MAX_IMAGE_SIDE
+            if resized:
+                image.thumbnail((OCR_MAX_IMAGE_SIDE, OCR_MAX_IMAGE_SIDE), Image.LANCZOS)
+
+            digest = hashlib.sha256()
+            digest.update(f"{image.size[0]}x{image.size[1]}".encode('utf-8'))
+            digest.update(image.tobytes())
+            content_hash = digest.hexdigest()
+
+            if source_format == 'JPEG' and not resized:
+                return image_content, 'image/jpeg', content_hash
+
+            buffer = io.BytesIO()
+            image.save(buffer, format='JPEG', quality=OCR_JPEG_QUALITY, optimize=True)
+            encoded = buffer.getvalue()
+            # 重新压缩反而更大时（例如小尺寸 PNG 截图）保留原图
+            if not resized and len(encoded) >= len(image_content):
+                return image_content, _IMAGE_MIME_TYPES.get(source_format, _sniff_image_mime(image_content)), content_hash
+            return encoded, 'image/jpeg', content_hash
+    except Exception as e:
+        # 无法解码时按原图发送，由模型端判断
+        print(f"Image normalization skipped: {str(e)}")
+        return image_content, _sniff_image_mime(image_content), hashlib.sha256(image_content).hexdigest()
+
+
+def extract_text_from_image(image_content: bytes, api_key: str, use_cache: bool = True) -> str:
+    """从图片中提取文字内容，使用GLM-4V-Flash模型
+
+    识别结果按图片内容哈希缓存，同一扫描件重复上传或页面重跑不会再次调用模型。
+    """
+    try:
+        image_content, mime_type, content_hash = prepare_image_for_ocr(image_content)
+
+        cache_key = None
+        if use_cache:
+            cache_key = make_cache_key("glm", OCR_MODEL, f"ocr:{content_hash}", None)
+            cached = get_response_cache().get(cache_key)
+            if cached is not None:
+                return cached
+
         # 将图片内容转换为base64
         image_base64 = base64.b64encode(image_content).decode('utf-8')
 
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json"
-        }
-
         data = {
-            "model": "glm-4v-flash",
+            "model": OCR_MODEL,
             "messages": [
                 {
                     "role": "user",
@@ -547,7 +722,7 @@ def extract_text_from_image(image_content: bytes, api_key: str) -> str:
                         {
                             "type": "image_url",
                             "image_url": {
-                                "url": f"data:image/jpeg;base64,{image_base64}"
+                                "url": f"data:{mime_type};base64,{image_base64}"
                             }
                         }
                     ]
@@ -555,55 +730,273 @@ def extract_text_from_image(image_content: bytes, api_key: str) -> str:
             ]
         }
 
-        response = requests.post(
-            "https://open.bigmodel.cn/api/paas/v4/chat/completions",
-            headers=headers,
-            json=data,
-            timeout=60
-        )
-
-        response.raise_for_status()
-        extracted_text = response.json()['choices'][0]['message']['content']
-        return extracted_text
+        # 复用池中 GLM 客户端的 keep-alive 会话
+        client = get_client("glm", api_key)
+        text = client.make_request(client.chat_endpoint, data)
+        if cache_key and text:
+            get_response_cache().set(cache_key, text)
+        return text
 
     except Exception as e:
         raise Exception(f"图片文字提取失败: {str(e)}")
 
 
-def analyze_legal_document(text: str, document_type: str, model_type: str, api_key: str) -> Dict:
-    """分析法律文档内容"""
-    from utils import _get_glm_response
+# 多图 OCR 的并发上限，避免一次上传过多页面时打满 GLM 的并发配额
+OCR_MAX_WORKERS = 4
 
-    # 根据文档类型构建不同的提示词
-    if document_type == "contract":
-        prompt = f"""作为一个专业的法律顾问,请对以下合同进行全面分析:
-{text}
 
-请从以下几个方面进行详细分析:
-1. 合同主要条款解析
+def extract_texts_from_images(images: Sequence[bytes], api_key: str,
+                              max_workers: int = OCR_MAX_WORKERS) -> Iterator[Tuple[int, Optional[str], Optional[str]]]:
+    """并发识别多张图片的文字
+
+    所有页面一次性提交到有界线程池，按完成先后逐页返回 (页码下标, 文本, 错误信息)，
+    调用方可据此更新进度并按下标回填，保持原有页序。单页失败只返回错误信息，不影响
+    其他页面，失败页可单独重新提交。
+    """
+    if not images:
+        return
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(images)), thread_name_prefix="ocr") as executor:
+        futures = {
+            submit_in_context(executor, extract_text_from_image, image_content, api_key): index
+            for index, image_content in enumerate(images)
+        }
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                yield index, future.result(), None
+            except Exception as e:
+                yield index, None, str(e)
+
+
+# 长文档分片分析：超过该长度的文档按条款切分后并发分析，再汇总
+LEGAL_MAP_REDUCE_MIN_CHARS = 8000
+LEGAL_CHUNK_CHARS = 4000
+LEGAL_CHUNK_WORKERS = 4
+# 汇总时单次请求中分析结果的 token 上限，超出时分批汇总，逐层合并直到一次放得下
+LEGAL_REDUCE_TOKEN_BUDGET = 24000
+
+# 条款/章节标题：第X条/章/节、一、（一）、1. / 1.1 以及图片OCR合并时的分页标记
+_LEGAL_SECTION_PATTERN = re.compile(
+    r'^\s*(?:第[一二三四五六七八九十百千零〇两\d]+[条章节部分款]'
+    r'|[一二三四五六七八九十]+、'
+    r'|[（(][一二三四五六七八九十\d]+[）)]'
+    r'|\d+(?:\.\d+)*[、.．]\s*\S'
+    r'|=== 第\d+页 ===)',
+    re.MULTILINE
+)
+
+_LEGAL_CHUNK_FOCUS = {
+    "contract": """1. 条款要点
+2. 潜在风险点和法律漏洞
+3. 模糊或有争议的表述
+4. 涉及的甲乙双方权责
+5. 具体的修改建议""",
+    "legal_document": """1. 格式规范性问题
+2. 法律依据是否准确
+3. 程序合法性问题
+4. 内容的完整性和准确性
+5. 存在的问题和改进建议"""
+}
+
+
+def split_legal_document(text: str, max_chars: int = LEGAL_CHUNK_CHARS) -> List[str]:
+    """按条款/章节把长文档切分成不超过 max_chars 的片段
+
+    片段边界只落在条款之间，并且由条款内容决定（而不是从文首累加长度），修改某一
+    条款通常只会改变它所在的片段，其余片段的文本和缓存保持不变。
+    """
+    starts = [match.start() for match in _LEGAL_SECTION_PATTERN.finditer(text)]
+    if not starts or starts[0] != 0:
+        starts.insert(0, 0)
+    sections = [text[start:end] for start, end in zip(starts, starts[1:] + [len(text)])]
+
+    # 单个条款超长时按段落（必要时按长度）继续切分
+    pieces = []
+    for section in sections:
+        while len(section) > max_chars:
+            cut = section.rfind('\n', 0, max_chars)
+            cut = cut if cut > max_chars // 2 else max_chars
+            pieces.append(section[:cut])
+            section = section[cut:]
+        if section.strip():
+            pieces.append(section)
+
+    chunks = []
+    current = ""
+    for piece in pieces:
+        if current and len(current) + len(piece) > max_chars:
+            chunks.append(current)
+            current = ""
+        current += piece
+        # 内容决定的边界：达到最小长度后，在哈希命中的条款之后断开
+        boundary = hashlib.sha256(piece.encode('utf-8')).digest()[0] % 3 == 0
+        if len(current) >= max_chars // 4 and boundary:
+            chunks.append(current)
+            current = ""
+    if current.strip():
+        chunks.append(current)
+    return chunks
+
+
+_LEGAL_ANALYSIS_FOCUS = {
+    "contract": """1. 合同主要条款解析
 2. 潜在风险点和法律漏洞
 3. 模糊或有争议的条款
 4. 对甲乙双方权责的评估
 5. 具体的修改建议
 
-请按以上顺序进行分析,并重点标注需要注意的内容。"""
-
-    elif document_type == "legal_document":
-        prompt = f"""作为一个专业的法律顾问,请对以下法律文书进行合法性分析:
-{text}
-
-请从以下几个方面进行详细分析:
-1. 文书格式规范性
+请按以上顺序进行分析,并重点标注需要注意的内容。""",
+    "legal_document": """1. 文书格式规范性
 2. 法律依据的准确性
 3. 程序合法性
 4. 内容的完整性和准确性
 5. 存在的问题和改进建议
 
 请按以上顺序进行分析,并指出需要特别注意或修改的地方。"""
+}
+_LEGAL_KIND = {"contract": "合同", "legal_document": "法律文书"}
+
+# 法律分析提示词：分析要求在前，文档内容在后
+LEGAL_CHUNK_PROMPTS = {
+    document_type: register_template(f"legal.chunk.{document_type}", """作为一个专业的法律顾问,请只针对用户提供的一份{kind}中的部分条款进行分析。
+
+请从以下几个方面简要分析(没有相关内容的方面可以略过):
+{focus}
+
+请在每个风险点和建议前注明对应的条款。""", "{chunk}", kind=_LEGAL_KIND[document_type], focus=focus)
+    for document_type, focus in _LEGAL_CHUNK_FOCUS.items()
+}
+LEGAL_REDUCE_PROMPTS = {
+    document_type: register_template(f"legal.reduce.{document_type}", """作为一个专业的法律顾问,请将用户提供的一份{kind}各部分的分段分析结果合并为一份完整的{report},去除重复内容,合并相同的风险点和建议:
+{focus}""", "{merged}", kind=_LEGAL_KIND[document_type],
+                                                     report="合同分析报告" if document_type == "contract" else "合法性分析报告",
+                                                     focus=focus)
+    for document_type, focus in _LEGAL_ANALYSIS_FOCUS.items()
+}
+LEGAL_DOCUMENT_PROMPTS = {
+    "contract": register_template("legal.document.contract", """作为一个专业的法律顾问,请对用户提供的合同进行全面分析。
+
+请从以下几个方面进行详细分析:
+{focus}""", "{text}", focus=_LEGAL_ANALYSIS_FOCUS["contract"]),
+    "legal_document": register_template("legal.document.legal_document", """作为一个专业的法律顾问,请对用户提供的法律文书进行合法性分析。
+
+请从以下几个方面进行详细分析:
+{focus}""", "{text}", focus=_LEGAL_ANALYSIS_FOCUS["legal_document"])
+}
+LEGAL_ADVICE_PROMPT = register_template("legal.advice", """作为一个专业律师,请针对用户提供的案例和问题提供专业的法律意见。
+
+请从以下方面提供详细分析和建议:
+1. 法律定性分析
+2. 相关法律法规
+3. 可能的法律后果
+4. 解决方案建议
+5. 风险提示
+
+请提供专业、客观的分析和建议。""", """案例描述:
+{case_description}
+
+咨询问题:
+{question}""")
+LEGAL_RISK_PROMPT = register_template("legal.risk", """作为一个专业律师,请对用户提供的情况进行法律风险分析。
+
+请从以下几个方面进行分析:
+1. 可能涉及的违法行为
+2. 相关法律法规
+3. 可能承担的法律责任
+4. 潜在的处罚后果
+5. 风险防范建议
+
+请详细说明每个方面,并提供具体的法律依据。""", "{scenario}")
+
+
+def _analyze_legal_chunk(chunk: str, document_type: str, api_key: str) -> str:
+    """分析单个片段，提示词只依赖片段内容，便于按片段命中缓存"""
+    prompt = LEGAL_CHUNK_PROMPTS[document_type].render(chunk=chunk)
+    return _get_glm_response(prompt, api_key, use_cache=True)
+
+
+def _reduce_legal_sections(sections: List[str], document_type: str, api_key: str) -> str:
+    """汇总一批分析结果"""
+    prompt = LEGAL_REDUCE_PROMPTS[document_type].render(merged="\n\n".join(sections))
+    return _get_glm_response(prompt, api_key, use_cache=True)
+
+
+def _batch_legal_sections(sections: List[str], token_budget: int) -> List[List[str]]:
+    """按 token 预算把分析结果顺序分批；每批至少两项，保证每一层汇总后数量减少"""
+    batches: List[List[str]] = []
+    batch_tokens = 0
+    for section in sections:
+        tokens = estimate_tokens(section)
+        if batches and (len(batches[-1]) < 2 or batch_tokens + tokens <= token_budget):
+            batches[-1].append(section)
+            batch_tokens += tokens
+        else:
+            batches.append([section])
+            batch_tokens = tokens
+    # 最后剩下的单项并入前一批，不为它单独发起一次汇总
+    if len(batches) > 1 and len(batches[-1]) == 1:
+        batches[-2].extend(batches.pop())
+    return batches
+
+
+def _run_legal_tasks(executor: ThreadPoolExecutor, fn, items: List, document_type: str, api_key: str,
+                     what: str) -> List[str]:
+    """并发执行分析/汇总任务，有失败时抛出异常"""
+    futures = [submit_in_context(executor, fn, item, document_type, api_key) for item in items]
+    results = [future.result() for future in futures]
+    failed = [result for result in results if result.startswith("API")]
+    if failed:
+        raise Exception(f"{len(failed)}/{len(items)} 个{what}失败: {failed[0]}")
+    return results
+
+
+def _analyze_legal_document_chunked(text: str, document_type: str, api_key: str,
+                                    token_budget: int = LEGAL_REDUCE_TOKEN_BUDGET) -> str:
+    """分片并发分析（map），再汇总合并风险点与建议（reduce）
+
+    分析结果总量超过 token_budget 时按树形逐层汇总：每批结果先合并成一份阶段性
+    汇总，直到剩余内容可以在一次请求中完成最终汇总，避免超长文档超出模型上下文。
+    """
+    chunks = split_legal_document(text)
+    with ThreadPoolExecutor(max_workers=min(LEGAL_CHUNK_WORKERS, len(chunks)), thread_name_prefix="legal-chunk") as executor:
+        chunk_analyses = _run_legal_tasks(executor, _analyze_legal_chunk, chunks, document_type, api_key, "片段分析")
+        sections = [f"【片段{i + 1}分析】\n{analysis}" for i, analysis in enumerate(chunk_analyses)]
+
+        batches = _batch_legal_sections(sections, token_budget)
+        while len(batches) > 1:
+            summaries = _run_legal_tasks(executor, _reduce_legal_sections, batches, document_type, api_key, "阶段汇总")
+            sections = [f"【第{i + 1}部分汇总】\n{summary}" for i, summary in enumerate(summaries)]
+            batches = _batch_legal_sections(sections, token_budget)
+
+    return _reduce_legal_sections(sections, document_type, api_key)
+
+
+def analyze_legal_document(text: str, document_type: str, model_type: str, api_key: str) -> Dict:
+    """分析法律文档内容
+
+    超过 LEGAL_MAP_REDUCE_MIN_CHARS 的长文档按条款分片并发分析后再汇总，每个片段
+    的分析结果单独缓存，修改某一条款只需重新分析对应片段。
+    """
+    from utils import _get_glm_response
+
+    if len(text) > LEGAL_MAP_REDUCE_MIN_CHARS:
+        try:
+            return {
+                'status': 'success',
+                'analysis': _analyze_legal_document_chunked(text, document_type, api_key)
+            }
+        except Exception as e:
+            return {
+                'status': 'error',
+                'message': f"分析失败: {str(e)}"
+            }
+
+    # 根据文档类型选择不同的提示词
+    prompt = LEGAL_DOCUMENT_PROMPTS[document_type].render(text=text)
 
     # 获取AI分析结果
     try:
-        analysis = _get_glm_response(prompt, api_key)
+        analysis = _get_glm_response(prompt, api_key, use_cache=True)
 
         return {
             'status': 'success',
@@ -620,25 +1013,10 @@ def get_legal_advice(case_description: str, question: str, model_type: str, api_
     """获取法律建议"""
     from utils import _get_glm_response
 
-    prompt = f"""作为一个专业律师,请针对以下案例和问题提供专业的法律意见:
-
-案例描述:
-{case_description}
-
-咨询问题:
-{question}
-
-请从以下方面提供详细分析和建议:
-1. 法律定性分析
-2. 相关法律法规
-3. 可能的法律后果
-4. 解决方案建议
-5. 风险提示
-
-请提供专业、客观的分析和建议。"""
+    prompt = LEGAL_ADVICE_PROMPT.render(case_description=case_description, question=question)
 
     try:
-        advice = _get_glm_response(prompt, api_key)
+        advice = _get_glm_response(prompt, api_key, use_cache=True)
 
         return {
             'status': 'success',
@@ -655,20 +1033,10 @@ def analyze_legal_risk(scenario: str, model_type: str, api_key: str) -> Dict:
     """分析法律风险"""
     from utils import _get_glm_response
 
-    prompt = f"""作为一个专业律师,请对以下情况进行法律风险分析:
-{scenario}
-
-请从以下几个方面进行分析:
-1. 可能涉及的违法行为
-2. 相关法律法规
-3. 可能承担的法律责任
-4. 潜在的处罚后果
-5. 风险防范建议
-
-请详细说明每个方面,并提供具体的法律依据。"""
+    prompt = LEGAL_RISK_PROMPT.render(scenario=scenario)
 
     try:
-        risk_analysis = _get_glm_response(prompt, api_key)
+        risk_analysis = _get_glm_response(prompt, api_key, use_cache=True)
 
         return {
             'status': 'success',
@@ -0,0 +1,191 @@
+import json
+import logging
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from character_templates import CHARACTER_TEMPLATES
+from prompt_registry import register_template
+from api_clients import get_client
+
+logger = logging.getLogger(__name__)
+
+# 每个 (人设, 模型) 预生成的开场白条数
+WELCOME_POOL_SIZE = 8
+# 开场白需要多样一些
+WELCOME_TEMPERATURE = 0.9
+# 开场白池的有效期，过期后仍可使用，同时在后台重新生成
+WELCOME_POOL_TTL = 24 * 3600
+WELCOME_POOL_PATH = Path.cwd() / "welcome_pool.json"
+
+WELCOME_PROMPT = register_template("welcome_pool", """请根据给定的人设，生成{count}条各不相同的开场白（每条不超过50字），展现人设的性格特点。
+每行输出一条开场白，不要编号，直接输出开场白内容，不需要任何解释。""", """你现在是一个{name}。
+
+个性特点：
+{personality}""", count=WELCOME_POOL_SIZE)
+
+_LINE_PREFIX = re.compile(r'^\s*(?:[-*•]|\d+[.、)）]|[（(]\d+[)）])\s*')
+
+
+def default_welcome_message(character_type: str) -> str:
+    character = CHARACTER_TEMPLATES.get(character_type)
+    if character is None:
+        return "你好，我是AI助手，有什么可以帮你的吗？"
+    return f"你好，我是{character['name']}，有什么可以帮你的吗？"
+
+
+def parse_welcome_lines(text: str) -> List[str]:
+    """按行拆分模型输出，去掉编号、引号和重复项"""
+    lines = []
+    for line in text.splitlines():
+        line = _LINE_PREFIX.sub('', line).strip().strip('"“”')
+        if line and line not in lines:
+            lines.append(line)
+    return lines[:WELCOME_POOL_SIZE]
+
+
+def generate_welcome_messages(character_type: str, model_type: str, api_key: str) -> List[str]:
+    """一次请求生成一组开场白，请求失败时抛出异常"""
+    character = CHARACTER_TEMPLATES[character_type]
+    prompt = WELCOME_PROMPT.render(name=character['name'], personality=character['personality'].strip())
+    # 直接调用客户端：get_chat_response 会把失败转成道歉文本，不能写进开场白池
+    response = get_client(model_type, api_key).chat(prompt, temperature=WELCOME_TEMPERATURE)
+    return parse_welcome_lines(response)
+
+
+class WelcomePool:
+    """按 (人设, 模型) 预生成的开场白池
+
+    开场白由预热任务批量生成并持久化到磁盘，打开聊天时只从池中随机取一条，
+    不发起模型请求。池为空或过期时在后台线程中重新生成，期间先使用已有内容
+    或默认开场白。
+    """
+
+    def __init__(self, path: Optional[Path] = WELCOME_POOL_PATH, ttl: float = WELCOME_POOL_TTL,
+                 max_workers: int = 2):
+        self.path = Path(path) if path else None
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._pools: Dict[str, Dict] = self._load()
+        self._refreshing: set = set()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="welcome-pool")
+
+    @staticmethod
+    def _key(character_type: str, model_type: str) -> str:
+        return f"{character_type}|{model_type}"
+
+    def _load(self) -> Dict[str, Dict]:
+        if not self.path or not self.path.exists():
+            return {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"Failed to load welcome pool: {str(e)}")
+            return {}
+
+    def _save(self) -> None:
+        # 先写独立的临时文件再替换，避免中途崩溃留下损坏的文件；写入串行进行，
+        # 并在写锁内取快照，后完成的写入总是包含最新内容
+        if not self.path:
+            return
+        with self._save_lock:
+            with self._lock:
+                data = json.dumps(self._pools, ensure_ascii=False, indent=2)
+            tmp_path = None
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=self.path.parent,
+                                                 prefix=f".{self.path.name}.", suffix=".tmp", delete=False) as f:
+                    tmp_path = f.name
+                    f.write(data)
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                logger.warning(f"Failed to save welcome pool: {str(e)}")
+                if tmp_path and os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+    def messages(self, character_type: str, model_type: str) -> List[str]:
+        with self._lock:
+            pool = self._pools.get(self._key(character_type, model_type))
+            return list(pool["messages"]) if pool else []
+
+    def is_fresh(self, character_type: str, model_type: str) -> bool:
+        with self._lock:
+            pool = self._pools.get(self._key(character_type, model_type))
+        return bool(pool and pool["messages"] and time.time() - pool["updated_at"] < self.ttl)
+
+    def get(self, character_type: str, model_type: str, api_key: Optional[str] = None) -> str:
+        """随机取一条开场白；池为空或过期且提供了密钥时在后台刷新"""
+        if api_key and character_type in CHARACTER_TEMPLATES and not self.is_fresh(character_type, model_type):
+            self.refresh_async(character_type, model_type, api_key)
+        messages = self.messages(character_type, model_type)
+        return random.choice(messages) if messages else default_welcome_message(character_type)
+
+    def refresh(self, character_type: str, model_type: str, api_key: str) -> List[str]:
+        """同步生成并替换开场白池；生成失败时保留原有内容"""
+        try:
+            messages = generate_welcome_messages(character_type, model_type, api_key)
+        except Exception as e:
+            logger.warning(f"Failed to generate welcome messages for {character_type}/{model_type}: {str(e)}")
+            return self.messages(character_type, model_type)
+        if not messages:
+            return self.messages(character_type, model_type)
+        with self._lock:
+            self._pools[self._key(character_type, model_type)] = {"messages": messages, "updated_at": time.time()}
+        self._save()
+        return messages
+
+    def refresh_async(self, character_type: str, model_type: str, api_key: str) -> bool:
+        """在后台刷新开场白池，同一个池同时只有一个刷新任务"""
+        key = self._key(character_type, model_type)
+        with self._lock:
+            if key in self._refreshing:
+                return False
+            self._refreshing.add(key)
+
+        def _run():
+            try:
+                self.refresh(character_type, model_type, api_key)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        self._executor.submit(_run)
+        return True
+
+    def warm_up(self, api_keys: Dict[str, str], characters: Optional[Iterable[str]] = None) -> List[Tuple[str, str]]:
+        """预热任务：为所有缺失或过期的 (人设, 模型) 在后台生成开场白池
+
+        Returns:
+            已提交刷新的 (人设, 模型) 列表
+        """
+        submitted = []
+        for character_type in characters or CHARACTER_TEMPLATES:
+            for model_type, api_key in api_keys.items():
+                if not api_key or self.is_fresh(character_type, model_type):
+                    continue
+                if self.refresh_async(character_type, model_type, api_key):
+                    submitted.append((character_type, model_type))
+        return submitted
+
+
+_welcome_pool: Optional[WelcomePool] = None
+_welcome_pool_lock = threading.Lock()
+
+
+def get_welcome_pool() -> WelcomePool:
+    """获取进程级开场白池，设置 WELCOME_POOL_PATH 环境变量可指定存储文件"""
+    global _welcome_pool
+    with _welcome_pool_lock:
+        if _welcome_pool is None:
+            _welcome_pool = WelcomePool(path=Path(os.environ.get("WELCOME_POOL_PATH") or WELCOME_POOL_PATH))
+        return _welcome_pool
@@ -1,6 +1,114 @@
 from langchain_core.pydantic_v1 import BaseModel, Field
-from typing import List
+from typing import Any, Dict, List, Optional
+import json
+import re
+
+TITLE_COUNT = 5
+
 
 class Xiaohongshu(BaseModel):
     titles: List[str] = Field(description="小红书的5个标题", min_items=5, max_items=5)
-    content: str = Field(description="小红书的正文内容")
\ No newline at end of file
+    content: str = Field(description="小红书的正文内容")
+    tags: List[str] = Field(default_factory=list, description="小红书的话题标签，不含#号")
+
+
+_TITLES_START = re.compile(r'"titles"\s*:\s*\[')
+_TRAILING_COMMA = re.compile(r',\s*([}\]])')
+
+
+def _load_json_object(text: str) -> Dict[str, Any]:
+    """提取并解析输出中的 JSON 对象，容忍代码块包裹、前后多余文字与尾逗号"""
+    start, end = text.find('{'), text.rfind('}')
+    if start < 0 or end <= start:
+        raise ValueError("输出中没有 JSON 对象")
+    candidate = text[start:end + 1]
+    try:
+        data = json.loads(candidate, strict=False)
+    except json.JSONDecodeError:
+        data = json.loads(_TRAILING_COMMA.sub(r'\1', candidate), strict=False)
+    if not isinstance(data, dict):
+        raise ValueError("输出不是 JSON 对象")
+    return data
+
+
+def _clean_titles(titles: Any) -> List[str]:
+    if isinstance(titles, str):
+        titles = titles.splitlines()
+    return [str(title).strip() for title in titles or [] if str(title).strip()]
+
+
+def parse_xiaohongshu_titles(text: str) -> List[str]:
+    """解析 {"titles": [...]} 格式的输出"""
+    return _clean_titles(_load_json_object(text).get('titles'))
+
+
+def parse_xiaohongshu_json(text: str) -> Dict[str, Any]:
+    """宽松解析模型输出的 JSON
+
+    标题多于5个时截断，少于5个时原样返回由调用方补齐。无法解析或缺少正文时抛出
+    ValueError。
+    """
+    data = _load_json_object(text)
+    if not isinstance(data.get('content'), str):
+        raise ValueError("JSON 缺少正文内容")
+
+    tags = data.get('tags') or []
+    if isinstance(tags, str):
+        tags = tags.split('#')
+    return {
+        'titles': _clean_titles(data.get('titles'))[:TITLE_COUNT],
+        'content': data['content'].strip(),
+        'tags': [str(tag).strip().lstrip('#') for tag in tags if str(tag).strip().lstrip('#')]
+    }
+
+
+class XiaohongshuStreamParser:
+    """流式输出的增量解析器
+
+    每次 feed 一段增量文本，返回其中新近完整的标题，无需等待整个 JSON 输出完毕。
+    只向前扫描 titles 数组一次，已解析的部分不会重复处理。
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        self._pos: Optional[int] = None
+        self._titles_done = False
+        self.titles: List[str] = []
+
+    @property
+    def text(self) -> str:
+        return self._buffer
+
+    def feed(self, delta: str) -> List[str]:
+        self._buffer += delta
+        if self._titles_done:
+            return []
+        if self._pos is None:
+            match = _TITLES_START.search(self._buffer)
+            if not match:
+                return []
+            self._pos = match.end()
+
+        new_titles = []
+        buffer = self._buffer
+        while True:
+            i = self._pos
+            while i < len(buffer) and buffer[i] in ' \t\r\n,':
+                i += 1
+            self._pos = i
+            if i >= len(buffer):
+                break
+            if buffer[i] != '"':
+                # 数组结束（或不是字符串数组），之后不再解析
+                self._titles_done = True
+                break
+            try:
+                title, end = json.decoder.scanstring(buffer, i + 1, False)
+            except json.JSONDecodeError:
+                # 标题字符串尚未输出完整
+                break
+            self._pos = end
+            if title.strip():
+                self.titles.append(title.strip())
+                new_titles.append(title.strip())
+        return new_titles